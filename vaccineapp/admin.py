@@ -1,8 +1,139 @@
-from django.contrib import admin
-from .models import UserProfile, Patient, Vaccine, VaccineInventory, VaccinationRecord, Appointment
+from datetime import datetime, timedelta
+
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.contrib.admin.utils import model_ngettext
+from django.core.paginator import Paginator
+from django.template.response import TemplateResponse
+from django.utils.functional import cached_property
+
+from .forms import StockAdjustmentForm
+from .models import (
+    UserProfile, Patient, Vaccine, VaccineInventory, VaccinationRecord, Appointment, WastageRecord,
+    MonthlyVaccinationCount,
+)
+from .rollups import counter_values
+from .search import search_ids
+
+
+# =============================================
+# LARGE TABLES
+# =============================================
+# Changelists of the high-volume tables never COUNT the whole table, take
+# their filter choices from the catalog and rollup tables instead of
+# DISTINCT scans, join their foreign keys into the list query and pick
+# related rows with autocomplete widgets instead of full dropdowns. Their
+# bulk actions are set-based updates.
+
+# Filtered and searched changelists count at most this many rows
+COUNT_LIMIT = 10000
+
+# Rollup counters that add up to the number of rows of each table
+ROW_COUNTERS = {
+    Patient: ['patients'],
+    VaccinationRecord: [f'records:{status}' for status, _ in VaccinationRecord.STATUS_CHOICES],
+    Appointment: [f'appointments:{status}' for status, _ in Appointment.APPOINTMENT_STATUS],
+    VaccineInventory: [f'inventory:{status}' for status, _ in VaccineInventory.STATUS_CHOICES],
+}
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator whose count never scans the table
+
+    Every list counts at most COUNT_LIMIT rows, which is exact below the
+    limit. Past it, unfiltered lists take the count from the rollup
+    counters when they report more rows; filtered lists stop at the limit,
+    so pages past it are not linked. Pages are sliced by number alone, so a
+    low count never cuts rows off the last page.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        counted = queryset.order_by()[:COUNT_LIMIT].count()
+        if counted == COUNT_LIMIT and not queryset.query.where and queryset.model in ROW_COUNTERS:
+            return max(counted, sum(counter_values(*ROW_COUNTERS[queryset.model]).values()))
+        return counted
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        return self._get_page(self.object_list[bottom:bottom + self.per_page], number, self)
+
+
+class LargeTableAdminMixin:
+    paginator = EstimatedCountPaginator
+    # Skip the second, unfiltered COUNT behind "N results (M total)"
+    show_full_result_count = False
+
+
+class VaccineFilter(admin.SimpleListFilter):
+    """Vaccines from the catalog, filtered on the indexed vaccine_id"""
+    title = 'vaccine'
+    parameter_name = 'vaccine'
+
+    def lookups(self, request, model_admin):
+        return Vaccine.objects.order_by('name').values_list('pk', 'name')
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(vaccine_id=self.value())
+        return queryset
+
+
+class AdministeredMonthFilter(admin.SimpleListFilter):
+    """Months that have records, read from the monthly rollup"""
+    title = 'month'
+    parameter_name = 'month'
+
+    def lookups(self, request, model_admin):
+        months = MonthlyVaccinationCount.objects.filter(count__gt=0).order_by('-month').values_list(
+            'month', flat=True
+        ).distinct()
+        return [(month.strftime('%Y-%m'), month.strftime('%B %Y')) for month in months]
+
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+        start = datetime.strptime(self.value(), '%Y-%m').date()
+        end = (start + timedelta(days=32)).replace(day=1)
+        return queryset.filter(date_administered__gte=start, date_administered__lt=end)
+
+
+def status_action(status, label):
+    """Admin action moving the selected rows to ``status`` with one set_status() call"""
+    @admin.action(description=f'Mark selected as {label.lower()}')
+    def action(modeladmin, request, queryset):
+        updated, skipped = queryset.set_status(status)
+        modeladmin.message_user(
+            request, f"{updated} {model_ngettext(modeladmin.opts, updated)} moved to {label.lower()}.", messages.SUCCESS
+        )
+        if skipped:
+            modeladmin.message_user(
+                request, f"{skipped} left unchanged: their lot is missing or out of stock.", messages.WARNING
+            )
+    action.__name__ = f'mark_{status}'
+    return action
+
+
+class FullTextSearchMixin:
+    """Answer the changelist search box from the full-text index
+
+    ``search_fields`` still enables the search box; the term is looked up in
+    the index for ``search_kind`` (at most 1000 best matches) instead of
+    icontains scans over those fields.
+    """
+    search_kind = None
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(pk__in=search_ids(self.search_kind, search_term)), False
+
 
 @admin.register(Vaccine)
-class VaccineAdmin(admin.ModelAdmin):
+class VaccineAdmin(FullTextSearchMixin, admin.ModelAdmin):
+    search_kind = 'vaccine'
     list_display = [
         'name', 
         'short_name', 
@@ -78,7 +209,8 @@ class UserProfileAdmin(admin.ModelAdmin):
     readonly_fields = ['created_at', 'updated_at']
 
 @admin.register(Patient)
-class PatientAdmin(admin.ModelAdmin):
+class PatientAdmin(LargeTableAdminMixin, FullTextSearchMixin, admin.ModelAdmin):
+    search_kind = 'patient'
     list_display = ['first_name', 'last_name', 'date_of_birth', 'gender', 'blood_type', 'created_at']
     list_filter = ['gender', 'blood_type', 'created_at']
     search_fields = ['first_name', 'last_name', 'patient_email']
@@ -86,7 +218,11 @@ class PatientAdmin(admin.ModelAdmin):
     date_hierarchy = 'created_at'
 
 @admin.register(VaccineInventory)
-class VaccineInventoryAdmin(admin.ModelAdmin):
+class VaccineInventoryAdmin(LargeTableAdminMixin, FullTextSearchMixin, admin.ModelAdmin):
+    search_kind = 'lot'
+    list_select_related = ['vaccine']
+    autocomplete_fields = ['vaccine']
+    actions = ['adjust_stock', 'refresh_status']
     list_display = [
         'get_vaccine_name',  # Changed to use method for better display
         'lot_number', 
@@ -99,7 +235,8 @@ class VaccineInventoryAdmin(admin.ModelAdmin):
     
     list_filter = [
         'status', 
-        'vaccine__name', 
+        'is_usable',
+        VaccineFilter,
         'expiration_date',
         'vaccine_type',
         'created_at'
@@ -135,6 +272,7 @@ class VaccineInventoryAdmin(admin.ModelAdmin):
                 'min_stock_level',
                 'doses_per_vial',
                 'status',  # Read-only but good to show
+                'is_usable',
             )
         }),
         ('Batch Information', {
@@ -158,9 +296,49 @@ class VaccineInventoryAdmin(admin.ModelAdmin):
         return obj.get_display_name()
     get_vaccine_name.short_description = 'Vaccine Name'
     get_vaccine_name.admin_order_field = 'vaccine__name'
+    
+    @admin.action(description='Adjust stock of selected lots')
+    def adjust_stock(self, request, queryset):
+        """Ask for a number of doses, then apply it with one bulk_adjust() call"""
+        form = StockAdjustmentForm(request.POST if 'apply' in request.POST else None)
+        if not form.is_valid():
+            return TemplateResponse(request, 'admin/vaccineapp/vaccineinventory/adjust_stock.html', {
+                **self.admin_site.each_context(request),
+                'title': 'Adjust stock',
+                'opts': self.model._meta,
+                'form': form,
+                'selected': request.POST.getlist(ACTION_CHECKBOX_NAME),
+                'select_across': request.POST.get('select_across') == '1',
+                'action_checkbox_name': ACTION_CHECKBOX_NAME,
+            })
+        delta = form.cleaned_data['delta']
+        pks = queryset.order_by().values_list('pk', flat=True)
+        results = VaccineInventory.objects.bulk_adjust({pk: {'delta': delta} for pk in pks})
+        errors = [result for result in results.values() if isinstance(result, str)]
+        self.message_user(request, f"Adjusted {len(results) - len(errors)} lots by {delta:+d} doses.", messages.SUCCESS)
+        for error in errors[:10]:
+            self.message_user(request, error, messages.WARNING)
+        return None
+    
+    @admin.action(description='Recompute status of selected lots')
+    def refresh_status(self, request, queryset):
+        updated = queryset.refresh_status()
+        self.message_user(request, f"Recomputed the status of {updated} lots.", messages.SUCCESS)
+
+@admin.register(WastageRecord)
+class WastageRecordAdmin(admin.ModelAdmin):
+    list_display = ['lot_number', 'vaccine', 'doses', 'reason', 'recorded_at']
+    list_filter = ['reason', 'recorded_at']
+    search_fields = ['lot_number', 'vaccine__name']
+    raw_id_fields = ['inventory']
+    readonly_fields = ['recorded_at']
 
 @admin.register(VaccinationRecord)
-class VaccinationRecordAdmin(admin.ModelAdmin):
+class VaccinationRecordAdmin(LargeTableAdminMixin, FullTextSearchMixin, admin.ModelAdmin):
+    search_kind = 'record'
+    list_select_related = ['patient', 'vaccine']
+    autocomplete_fields = ['patient', 'vaccine', 'inventory_used']
+    actions = [status_action(status, label) for status, label in VaccinationRecord.STATUS_CHOICES]
     list_display = [
         'patient', 
         'vaccine', 
@@ -174,7 +352,8 @@ class VaccinationRecordAdmin(admin.ModelAdmin):
     list_filter = [
         'status', 
         'reaction', 
-        'vaccine__name', 
+        VaccineFilter,
+        AdministeredMonthFilter,
         'date_administered',
         'follow_up_required'
     ]
@@ -192,11 +371,12 @@ class VaccinationRecordAdmin(admin.ModelAdmin):
         'created_at',
         'updated_at'
     ]
-    
-    date_hierarchy = 'date_administered'
 
 @admin.register(Appointment)
-class AppointmentAdmin(admin.ModelAdmin):
+class AppointmentAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+    list_select_related = ['patient']
+    autocomplete_fields = ['patient', 'vaccine']
+    actions = [status_action(status, label) for status, label in Appointment.APPOINTMENT_STATUS]
     list_display = [
         'patient', 
         'appointment_type', 
@@ -225,8 +405,6 @@ class AppointmentAdmin(admin.ModelAdmin):
         'created_at',
         'updated_at'
     ]
-    
-    date_hierarchy = 'scheduled_date'
 
 # Optional: Customize admin site header and title
 admin.site.site_header = "HealthCoach Vaccine Management System"
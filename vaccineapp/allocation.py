@@ -0,0 +1,147 @@
+from collections import Counter, defaultdict
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from .models import InsufficientStock, VaccineInventory
+
+# =============================================
+# FEFO LOT ALLOCATION
+# =============================================
+# Doses are taken from the usable lot of a vaccine that expires first
+# (first-expired, first-out), so older lots are used before they expire.
+# A single allocation holds no lock while choosing: the conditional stock
+# UPDATE done by VaccinationRecord.save() is the only lock taken, and a lot
+# emptied by a concurrent allocation is simply skipped for the next one.
+
+# Lots fetched per round when looking for one with stock left
+CANDIDATE_LOTS = 5
+
+# Record attributes an allocation sets, restored when it fails
+ALLOCATED_FIELDS = ('pk', 'inventory_used_id', 'stock_deducted_from_id', 'status', 'lot_number', 'expiration_date')
+
+
+def usable_lots(vaccine_ids, today=None):
+    """Unexpired usable lots of the given vaccines with stock left, first-expiring first"""
+    today = today or timezone.now().date()
+    return VaccineInventory.objects.filter(
+        vaccine_id__in=vaccine_ids,
+        is_usable=True,
+        current_stock__gt=0,
+        expiration_date__gte=today,
+    ).order_by('expiration_date', 'pk')
+
+
+def _remember(record):
+    """The state of ``record`` an allocation changes, for _restore()"""
+    return {name: getattr(record, name) for name in ALLOCATED_FIELDS}, record._state.adding
+
+
+def _restore(record, state):
+    values, adding = state
+    for name, value in values.items():
+        setattr(record, name, value)
+    record._state.adding = adding
+    record.__dict__.pop('_stock_preallocated', None)
+    record.__dict__.pop('_stock_required', None)
+
+
+def _administer_from(record, lot, state):
+    """Point ``record`` at ``lot``, keeping lot details the caller filled in"""
+    values, _ = state
+    record.inventory_used = lot
+    record.status = 'administered'
+    record.lot_number = values['lot_number'] or lot.lot_number
+    record.expiration_date = values['expiration_date'] or lot.expiration_date
+
+
+def allocate(record, today=None):
+    """Administer ``record`` from the first-expiring usable lot of its vaccine
+
+    Saves the record and returns the lot used. Raises ValidationError when
+    no lot of the vaccine has stock left; the record is then left as it was
+    passed in.
+    """
+    state = _remember(record)
+    tried = set()
+    try:
+        while True:
+            candidates = list(usable_lots([record.vaccine_id], today).exclude(pk__in=tried)[:CANDIDATE_LOTS])
+            if not candidates:
+                raise ValidationError(f"No usable stock left for vaccine {record.vaccine_id}.")
+            for lot in candidates:
+                tried.add(lot.pk)
+                _restore(record, state)
+                try:
+                    with transaction.atomic():
+                        _administer_from(record, lot, state)
+                        record._stock_required = True
+                        record.save()
+                except InsufficientStock:
+                    continue  # emptied by a concurrent allocation
+                return lot
+    except Exception:
+        _restore(record, state)
+        raise
+
+
+def allocate_session(records, today=None):
+    """Administer a clinic session's records in one transaction
+
+    The usable lots of every vaccine involved are read and locked with one
+    query and doses are assigned first-expiring first in memory. The records
+    are saved, then the doses taken out of all lots with a single UPDATE
+    whose ledger movements link to the records. Raises
+    ValidationError, saving nothing, when a vaccine runs short; on any error
+    the records are left as they were passed in. Returns a list of
+    ``(record, lot)`` pairs.
+    """
+    if any(record.stock_deducted_from_id for record in records):
+        raise ValidationError("Some records have already taken a dose from a lot.")
+    states = [_remember(record) for record in records]
+    try:
+        with transaction.atomic():
+            return _allocate_session(records, states, today)
+    except Exception:
+        for record, state in zip(records, states):
+            _restore(record, state)
+        raise
+
+
+def _allocate_session(records, states, today):
+    demand = Counter(record.vaccine_id for record in records)
+    lots = defaultdict(list)
+    for lot in usable_lots(demand, today).select_for_update():
+        lots[lot.vaccine_id].append(lot)
+
+    available = {vaccine_id: sum(lot.current_stock for lot in lots[vaccine_id]) for vaccine_id in demand}
+    shortages = [
+        f"vaccine {vaccine_id} needs {needed} doses, {available[vaccine_id]} left"
+        for vaccine_id, needed in demand.items() if needed > available[vaccine_id]
+    ]
+    if shortages:
+        raise ValidationError(f"Not enough usable stock: {'; '.join(shortages)}.")
+
+    plan, taken = [], Counter()
+    for record in records:
+        lot = next(lot for lot in lots[record.vaccine_id] if taken[lot.pk] < lot.current_stock)
+        taken[lot.pk] += 1
+        plan.append((record, lot))
+
+    # The lots are locked, so the records can be saved before the doses are
+    # taken out; their ledger movements then link to them
+    used = defaultdict(list)
+    for (record, lot), state in zip(plan, states):
+        _administer_from(record, lot, state)
+        record._stock_preallocated = lot.pk
+        record.save()
+        used[lot.pk].append(record)
+
+    results = VaccineInventory.objects.bulk_adjust(
+        {pk: {'delta': -count} for pk, count in taken.items()}, reason='administration', records=used
+    )
+    failed = [message for message in results.values() if isinstance(message, str)]
+    if failed:
+        raise ValidationError(failed)
+    return plan
@@ -0,0 +1,299 @@
+import json
+import os
+import shutil
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .models import VaccinationRecord
+
+# =============================================
+# COLUMNAR ANALYTICS SNAPSHOT
+# =============================================
+# ``python manage.py export_analytics_snapshot`` writes every vaccination
+# record, joined with its patient and vaccine, to one .npy file per column
+# in a new directory under ANALYTICS['DIRECTORY'], then points the CURRENT
+# file there. String columns are dictionary encoded: the .npy file holds
+# int32 codes into the sorted values listed in manifest.json. Queries
+# memory-map the current snapshot and filter, group and aggregate with
+# NumPy, so ad-hoc reports never read the live database.
+#
+# Dimensions (group by or filter on): vaccine, status, reaction, facility,
+# gender, dose_number, month, year (of date_administered) and age_band (age
+# at administration, in the bands given to the query; a record counts in
+# the first band containing it).
+
+DEFAULTS = {
+    'DIRECTORY': os.path.join(settings.BASE_DIR, 'analytics_snapshots'),
+    'KEEP': 2,                  # snapshots kept on disk, the current one included
+    'CHUNK_SIZE': 5000,         # records read per database round trip
+}
+
+# Column: (values_list field, dtype); 'dictionary' columns hold strings
+COLUMNS = {
+    'record_id': ('pk', 'int64'),
+    'patient_id': ('patient_id', 'int64'),
+    'owner_id': ('patient__user_id', 'int64'),
+    'vaccine': ('vaccine__name', 'dictionary'),
+    'dose_number': ('dose_number', 'int16'),
+    'status': ('status', 'dictionary'),
+    'reaction': ('reaction', 'dictionary'),
+    'facility': ('administering_facility', 'dictionary'),
+    'gender': ('patient__gender', 'dictionary'),
+    'date_administered': ('date_administered', 'datetime64[D]'),
+    'date_of_birth': ('patient__date_of_birth', 'datetime64[D]'),
+    'follow_up_required': ('follow_up_required', 'bool'),
+}
+
+DIMENSIONS = ('vaccine', 'status', 'reaction', 'facility', 'gender', 'dose_number', 'month', 'year', 'age_band')
+METRICS = ('count', 'patients', 'follow_ups', 'avg_age_months')
+
+# Above this many possible groups, groups are found by sorting instead of counting
+DENSE_GROUPS = 1 << 22
+
+
+def get_config():
+    """Return the analytics settings merged over the defaults"""
+    return {**DEFAULTS, **getattr(settings, 'ANALYTICS', {})}
+
+
+def age_in_months(born, on):
+    """Exact ages in whole months of ``datetime64[D]`` arrays, as in cohorts.age_in_months()"""
+    born_months, on_months = born.astype('datetime64[M]'), on.astype('datetime64[M]')
+    months = (on_months - born_months).astype(np.int64)
+    return months - ((on - on_months).astype(np.int64) < (born - born_months).astype(np.int64))
+
+
+# =============================================
+# EXPORT
+# =============================================
+
+def export_snapshot(directory=None):
+    """Write a new snapshot of every record and make it the current one
+
+    Returns the loaded Snapshot.
+    """
+    config = get_config()
+    root = Path(directory or config['DIRECTORY'])
+    created = timezone.now()
+    target = root / created.strftime('%Y%m%dT%H%M%S%fZ')
+    target.mkdir(parents=True)
+
+    values = {name: [] for name in COLUMNS}
+    dictionaries = {name: {} for name, (_, dtype) in COLUMNS.items() if dtype == 'dictionary'}
+    rows = VaccinationRecord.objects.order_by('pk').values_list(*[field for field, _ in COLUMNS.values()])
+    for row in rows.iterator(chunk_size=config['CHUNK_SIZE']):
+        for (name, (_, dtype)), value in zip(COLUMNS.items(), row):
+            if dtype == 'dictionary':
+                codes = dictionaries[name]
+                value = codes.setdefault(value or '', len(codes))
+            values[name].append(value)
+
+    manifest = {'created_at': created.isoformat(), 'rows': len(values['record_id']), 'columns': {}}
+    for name, (_, dtype) in COLUMNS.items():
+        if dtype == 'dictionary':
+            # Re-number the codes so they follow the sorted values
+            labels = sorted(dictionaries[name])
+            remap = np.empty(len(labels), dtype=np.int32)
+            remap[[dictionaries[name][label] for label in labels]] = np.arange(len(labels), dtype=np.int32)
+            array = remap[np.array(values.pop(name), dtype=np.int32)]
+            manifest['columns'][name] = {'dtype': 'int32', 'values': labels}
+        else:
+            array = np.array(values.pop(name), dtype=dtype)
+            manifest['columns'][name] = {'dtype': dtype}
+        np.save(target / f'{name}.npy', array)
+
+    age = age_in_months(np.load(target / 'date_of_birth.npy'), np.load(target / 'date_administered.npy'))
+    np.save(target / 'age_months.npy', age.astype(np.int32))
+    manifest['columns']['age_months'] = {'dtype': 'int32'}
+    (target / 'manifest.json').write_text(json.dumps(manifest))
+
+    pointer = root / 'CURRENT.tmp'
+    pointer.write_text(target.name)
+    os.replace(pointer, root / 'CURRENT')
+    prune_snapshots(root, config['KEEP'])
+    return Snapshot(target)
+
+
+def prune_snapshots(root, keep):
+    """Delete all but the newest ``keep`` snapshots under ``root``"""
+    snapshots = sorted(path for path in Path(root).iterdir() if (path / 'manifest.json').exists())
+    for path in snapshots[:-keep] if keep > 0 else []:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+# =============================================
+# LOADING
+# =============================================
+
+class Snapshot:
+    """Memory-mapped columns of one exported snapshot"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.manifest = json.loads((self.path / 'manifest.json').read_text())
+        # An empty file cannot be memory-mapped
+        mode = 'r' if self.rows else None
+        self.columns = {
+            name: np.load(self.path / f'{name}.npy', mmap_mode=mode) for name in self.manifest['columns']
+        }
+
+    @property
+    def rows(self):
+        return self.manifest['rows']
+
+    @property
+    def created_at(self):
+        return self.manifest['created_at']
+
+    def dictionary(self, name):
+        return self.manifest['columns'][name]['values']
+
+
+_current = None
+_lock = threading.Lock()
+
+
+def load_snapshot(directory=None):
+    """Return the current snapshot, or None when none was exported"""
+    global _current
+    root = Path(directory or get_config()['DIRECTORY'])
+    try:
+        path = root / (root / 'CURRENT').read_text().strip()
+    except FileNotFoundError:
+        return None
+    with _lock:
+        if _current is None or _current.path != path:
+            _current = Snapshot(path)
+        return _current
+
+
+# =============================================
+# QUERIES
+# =============================================
+
+@dataclass
+class QueryResult:
+    """Metric values per group, in the order of the group labels"""
+    group_by: list
+    metrics: list
+    groups: list
+    records: int
+
+    def as_dict(self):
+        return {
+            'group_by': self.group_by,
+            'metrics': self.metrics,
+            'records': self.records,
+            'groups': [{'key': dict(zip(self.group_by, key)), **values} for key, values in self.groups],
+        }
+
+
+def _offsets(values, unit=None):
+    """Codes and labels of an integer or datetime column, one label per value in its range"""
+    numbers = values.astype(f'datetime64[{unit}]').astype(np.int64) if unit else values.astype(np.int64)
+    if not len(numbers):
+        return numbers, []
+    low = int(numbers.min())
+    span = np.arange(low, int(numbers.max()) + 1)
+    labels = span.astype(f'datetime64[{unit}]').astype(str).tolist() if unit else span.tolist()
+    return numbers - low, labels
+
+
+def dimension(snapshot, name, bands=()):
+    """``(codes, labels)`` of a dimension for every row; a code of -1 has no label"""
+    columns = snapshot.columns
+    if name in ('vaccine', 'status', 'reaction', 'facility', 'gender'):
+        return columns[name], snapshot.dictionary(name)
+    if name == 'dose_number':
+        return _offsets(columns['dose_number'])
+    if name == 'month':
+        return _offsets(columns['date_administered'], 'M')
+    if name == 'year':
+        return _offsets(columns['date_administered'], 'Y')
+    if name == 'age_band':
+        if not bands:
+            raise ValueError("Grouping or filtering by age_band needs bands")
+        age = columns['age_months']
+        codes = np.full(len(age), -1, dtype=np.int64)
+        for index, band in reversed(list(enumerate(bands))):
+            inside = age >= band.lower
+            if band.upper is not None:
+                inside &= age < band.upper
+            codes[inside] = index
+        return codes, [band.label for band in bands]
+    raise ValueError(f"Unknown dimension {name!r}, expected one of {', '.join(DIMENSIONS)}")
+
+
+def query(snapshot, group_by=(), metrics=('count',), filters=None, start=None, end=None, owner_id=None, bands=()):
+    """Filter, group and aggregate the snapshot's records
+
+    ``filters`` maps dimensions to the labels to keep; ``start`` and ``end``
+    bound date_administered (inclusive) and ``owner_id`` keeps one user's
+    patients. Raises ValueError for unknown dimensions or metrics.
+    """
+    unknown = [metric for metric in metrics if metric not in METRICS]
+    if unknown:
+        raise ValueError(f"Unknown metrics: {', '.join(unknown)}")
+    columns = snapshot.columns
+    mask = np.ones(snapshot.rows, dtype=bool)
+    if owner_id is not None:
+        mask &= columns['owner_id'] == owner_id
+    if start is not None:
+        mask &= columns['date_administered'] >= np.datetime64(start, 'D')
+    if end is not None:
+        mask &= columns['date_administered'] <= np.datetime64(end, 'D')
+    for name, wanted in (filters or {}).items():
+        codes, labels = dimension(snapshot, name, bands)
+        wanted = {str(label) for label in wanted}
+        mask &= np.isin(codes, [code for code, label in enumerate(labels) if str(label) in wanted])
+
+    keys = []
+    for name in group_by:
+        codes, labels = dimension(snapshot, name, bands)
+        mask &= codes >= 0
+        keys.append((codes, labels))
+    selected = np.flatnonzero(mask)
+
+    # Combine the group codes into one integer key per row
+    key = np.zeros(len(selected), dtype=np.int64)
+    groups_possible = 1
+    for codes, labels in keys:
+        key = key * len(labels) + codes[selected]
+        groups_possible *= len(labels)
+    if groups_possible <= DENSE_GROUPS:
+        present = np.flatnonzero(np.bincount(key, minlength=groups_possible))
+        position = np.full(groups_possible, -1, dtype=np.int64)
+        position[present] = np.arange(len(present))
+        groups, inverse = present, position[key]
+    else:
+        groups, inverse = np.unique(key, return_inverse=True)
+
+    values = {}
+    counts = np.bincount(inverse, minlength=len(groups))
+    if 'count' in metrics:
+        values['count'] = counts.tolist()
+    if 'patients' in metrics:
+        patients = columns['patient_id'][selected]
+        width = int(patients.max()) + 1 if len(patients) else 1
+        pairs = np.unique(inverse * width + patients)
+        values['patients'] = np.bincount(pairs // width, minlength=len(groups)).tolist()
+    if 'follow_ups' in metrics:
+        follow_ups = columns['follow_up_required'][selected]
+        values['follow_ups'] = np.bincount(inverse, weights=follow_ups, minlength=len(groups)).astype(np.int64).tolist()
+    if 'avg_age_months' in metrics:
+        total = np.bincount(inverse, weights=columns['age_months'][selected], minlength=len(groups))
+        values['avg_age_months'] = np.round(total / np.maximum(counts, 1), 1).tolist()
+
+    rows = []
+    for position, group in enumerate(groups.tolist()):
+        labels = []
+        for codes, names in reversed(keys):
+            group, code = divmod(group, len(names))
+            labels.append(names[code])
+        rows.append((tuple(reversed(labels)), {metric: values[metric][position] for metric in metrics}))
+    return QueryResult(list(group_by), list(metrics), rows, len(selected))
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class VaccineappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'vaccineapp'
+
+    def ready(self):
+        # Register the signal handlers that keep the statistics rollups, the
+        # stock ledger and the search index current and expire cached coverage
+        from . import rollups, ledger, search, coverage  # noqa: F401
@@ -0,0 +1,143 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+# =============================================
+# STALE-WHILE-REVALIDATE CACHE
+# =============================================
+# Values are stored together with the time they were computed:
+#   age < FRESH_SECONDS            -> hit, served as is
+#   age < STALE_SECONDS            -> stale, served as is and recomputed in
+#                                     the background by a single worker
+#   older (or missing)             -> miss, recomputed before responding
+# Only the worker that wins ``cache.add`` on the lock key recomputes, so a
+# burst of requests triggers one recomputation per key. The default
+# LocMemCache is private to each process: every server process keeps its own
+# copy of the values and its own locks, so each one recomputes a key once.
+# Configure a shared backend (memcached, redis, database) in CACHES for one
+# recomputation per key across all processes.
+
+DEFAULTS = {
+    'FRESH_SECONDS': 30,
+    'STALE_SECONDS': 300,
+    'LOCK_SECONDS': 30,
+    'MISS_WAIT_SECONDS': 2,
+    'BACKGROUND_REFRESH': True,
+}
+
+METRICS = ('hit', 'miss', 'stale', 'refresh', 'error')
+METRIC_PREFIX = 'swr:metrics:'
+
+
+def get_config():
+    """Return the cache settings merged over the defaults"""
+    return {**DEFAULTS, **getattr(settings, 'DASHBOARD_CACHE', {})}
+
+
+def _record(metric):
+    key = METRIC_PREFIX + metric
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # The key was evicted between add() and incr()
+        cache.set(key, 1, timeout=None)
+
+
+def get_metrics():
+    """Return the hit/miss/stale/refresh/error counters"""
+    values = cache.get_many([METRIC_PREFIX + metric for metric in METRICS])
+    return {metric: values.get(METRIC_PREFIX + metric, 0) for metric in METRICS}
+
+
+def reset_metrics():
+    cache.delete_many([METRIC_PREFIX + metric for metric in METRICS])
+
+
+def _lock_key(key):
+    return f'swr:lock:{key}'
+
+
+def _store(key, value, config):
+    cache.set(key, {'value': value, 'computed_at': time.time()}, timeout=config['STALE_SECONDS'])
+
+
+def _refresh(key, compute, config):
+    """Recompute ``key`` and release its lock"""
+    try:
+        _store(key, compute(), config)
+        _record('refresh')
+    except Exception:
+        _record('error')
+        logger.exception("Recomputing cached value %s failed", key)
+    finally:
+        cache.delete(_lock_key(key))
+
+
+def _refresh_in_background(key, compute, config):
+    def run():
+        try:
+            _refresh(key, compute, config)
+        finally:
+            # Background threads get their own connection; don't leak it
+            connection.close()
+
+    threading.Thread(target=run, name=f'swr-refresh-{key}', daemon=True).start()
+
+
+def get_or_refresh(key, compute, fresh=None, stale=None):
+    """Return the cached value for ``key``, recomputing it with ``compute()``
+
+    ``fresh`` and ``stale`` override FRESH_SECONDS and STALE_SECONDS (the hard
+    deadline after which a value is never served) for this key.
+    """
+    config = get_config()
+    if fresh is not None:
+        config['FRESH_SECONDS'] = fresh
+    if stale is not None:
+        config['STALE_SECONDS'] = stale
+
+    entry = cache.get(key)
+    if entry is not None:
+        age = time.time() - entry['computed_at']
+        if age < config['FRESH_SECONDS']:
+            _record('hit')
+            return entry['value']
+        if age < config['STALE_SECONDS']:
+            _record('stale')
+            if cache.add(_lock_key(key), 1, timeout=config['LOCK_SECONDS']):
+                if config['BACKGROUND_REFRESH']:
+                    _refresh_in_background(key, compute, config)
+                else:
+                    _refresh(key, compute, config)
+            return entry['value']
+
+    _record('miss')
+    if cache.add(_lock_key(key), 1, timeout=config['LOCK_SECONDS']):
+        try:
+            value = compute()
+            _store(key, value, config)
+            return value
+        finally:
+            cache.delete(_lock_key(key))
+
+    # Another worker is computing this value; wait briefly for its result
+    # rather than piling onto the database with the same query.
+    deadline = time.monotonic() + config['MISS_WAIT_SECONDS']
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry['value']
+    # The worker holding the lock is slow or gone; compute here and store the
+    # result so the following requests hit instead of recomputing as well.
+    value = compute()
+    _store(key, value, config)
+    return value
+
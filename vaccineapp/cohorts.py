@@ -0,0 +1,201 @@
+import calendar
+from dataclasses import dataclass
+from datetime import date
+from typing import NamedTuple
+
+from django.db.models import Count, Exists, OuterRef, Q
+from django.utils import timezone
+
+from .models import Patient, Vaccine, VaccinationRecord
+
+# =============================================
+# AGE COHORTS
+# =============================================
+# A patient is at least N months old on ``as_of`` exactly when they were
+# born on or before ``as_of`` moved back N calendar months (clamped to the
+# end of shorter months), which matches Patient.age(). An age band is
+# therefore a range of birth dates, and every band is one conditional COUNT
+# in a single query that reads date_of_birth through its index and groups
+# by the optional split. Bands may overlap or leave gaps.
+
+SPLITS = ('gender', 'vaccine', 'coverage')
+
+
+class AgeBand(NamedTuple):
+    """Exact ages from ``lower`` up to, not including, ``upper`` months
+
+    ``upper`` is None for an open-ended band.
+    """
+    key: str
+    label: str
+    lower: int
+    upper: int = None
+
+
+# The Vaccine.AGE_GROUP_CHOICES groups, with inclusive year ranges made half-open
+AGE_GROUP_BOUNDS = {
+    'infant': (0, 12),
+    'toddler': (12, 36),
+    'preschool': (36, 72),
+    'school_age': (72, 156),
+    'adolescent': (156, 228),
+}
+AGE_GROUP_BANDS = [
+    AgeBand(key, label, *AGE_GROUP_BOUNDS[key]) for key, label in Vaccine.AGE_GROUP_CHOICES
+]
+
+# Buckets of the dashboard age distribution chart
+DASHBOARD_BANDS = [
+    AgeBand(f'{lower}-{upper}', f'{lower}-{upper}', lower * 12, upper * 12)
+    for lower, upper in ((0, 1), (1, 3), (3, 6), (6, 12), (12, 18))
+]
+
+PRESETS = {'age_groups': AGE_GROUP_BANDS, 'dashboard': DASHBOARD_BANDS}
+
+
+def months_before(day, months):
+    """``day`` moved back ``months`` calendar months, clamped to the month's last day"""
+    year, month = divmod(day.year * 12 + day.month - 1 - months, 12)
+    return date(year, month + 1, min(day.day, calendar.monthrange(year, month + 1)[1]))
+
+
+def age_in_months(date_of_birth, as_of):
+    """Exact age in whole months on ``as_of``"""
+    months = (as_of.year - date_of_birth.year) * 12 + as_of.month - date_of_birth.month
+    return months - (as_of.day < date_of_birth.day)
+
+
+def parse_bands(value, unit='years'):
+    """Bands from a preset name or a comma-separated list like ``0-2,2-5,5-``
+
+    Bounds are whole ``unit`` (years or months); an empty upper bound is
+    open-ended. Raises ValueError.
+    """
+    if value in PRESETS:
+        return PRESETS[value]
+    if unit not in ('years', 'months'):
+        raise ValueError(f"Unknown unit {unit!r}, expected years or months")
+    scale = 12 if unit == 'years' else 1
+    bands = []
+    for token in value.split(','):
+        lower, separator, upper = token.strip().partition('-')
+        if not separator or not lower.isdigit() or not (upper.isdigit() or upper == ''):
+            raise ValueError(f"Invalid age band {token.strip()!r}, expected lower-upper")
+        if upper and int(upper) <= int(lower):
+            raise ValueError(f"Invalid age band {token.strip()!r}, the upper bound must be above the lower one")
+        label = (f"{lower}-{upper}" if upper else f"{lower}+") + ('y' if unit == 'years' else 'm')
+        bands.append(AgeBand(token.strip(), label, int(lower) * scale, int(upper) * scale if upper else None))
+    return bands
+
+
+def band_condition(band, as_of, prefix=''):
+    """Birth-date range of the patients whose exact age on ``as_of`` is in ``band``"""
+    condition = Q(**{f'{prefix}date_of_birth__lte': months_before(as_of, band.lower)})
+    if band.upper is not None:
+        condition &= Q(**{f'{prefix}date_of_birth__gt': months_before(as_of, band.upper)})
+    return condition
+
+
+def bands_range(bands, as_of, prefix=''):
+    """Birth-date range covering every band, so only those rows are read"""
+    youngest = min(band.lower for band in bands)
+    condition = Q(**{f'{prefix}date_of_birth__lte': months_before(as_of, youngest)})
+    if all(band.upper is not None for band in bands):
+        oldest = max(band.upper for band in bands)
+        condition &= Q(**{f'{prefix}date_of_birth__gt': months_before(as_of, oldest)})
+    return condition
+
+
+@dataclass
+class CohortCounts:
+    """Patient counts per age band, per value of the split
+
+    ``rows`` maps each split value (None when not split) to its counts in
+    the order of ``bands``; ``labels`` names the split values.
+    """
+    bands: list
+    as_of: date
+    split: str
+    rows: dict
+    labels: dict
+
+    @property
+    def totals(self):
+        """Counts per band over every split value
+
+        With the vaccine split a patient is counted once per vaccine.
+        """
+        return [sum(counts[index] for counts in self.rows.values()) for index in range(len(self.bands))]
+
+    def as_dict(self):
+        return {
+            'as_of': self.as_of.isoformat(),
+            'split': self.split,
+            'bands': [
+                {'key': band.key, 'label': band.label, 'lower_months': band.lower, 'upper_months': band.upper}
+                for band in self.bands
+            ],
+            'rows': [
+                {'key': key, 'label': self.labels.get(key, key), 'counts': counts, 'total': sum(counts)}
+                for key, counts in self.rows.items()
+            ],
+            'totals': self.totals,
+        }
+
+
+def cohort_counts(bands, as_of=None, split=None, patients=None, vaccine=None):
+    """Count patients per exact-age band on ``as_of`` in one grouped query
+
+    ``patients`` scopes the count (every patient by default). ``split`` is
+    None, 'gender', 'coverage' (patients with an administered dose, of
+    ``vaccine`` if given) or 'vaccine' (patients with an administered dose
+    of each vaccine).
+    """
+    if split not in (None, *SPLITS):
+        raise ValueError(f"Unknown split {split!r}, expected one of {', '.join(SPLITS)}")
+    if not bands:
+        raise ValueError("At least one age band is required")
+    as_of = as_of or timezone.now().date()
+    patients = Patient.objects.all() if patients is None else patients
+    administered = VaccinationRecord.objects.filter(patient=OuterRef('pk'), status='administered')
+    if vaccine is not None:
+        administered = administered.filter(vaccine=vaccine)
+
+    if split == 'vaccine':
+        rows = VaccinationRecord.objects.filter(status='administered', patient__in=patients.values('pk'))
+        if vaccine is not None:
+            rows = rows.filter(vaccine=vaccine)
+        prefix, group = 'patient__', 'vaccine_id'
+        aggregates = {
+            f'band_{index}': Count('patient', distinct=True, filter=band_condition(band, as_of, prefix))
+            for index, band in enumerate(bands)
+        }
+    else:
+        rows = patients.annotate(covered=Exists(administered)) if split == 'coverage' else patients
+        prefix, group = '', {'gender': 'gender', 'coverage': 'covered'}.get(split)
+        aggregates = {
+            f'band_{index}': Count('pk', filter=band_condition(band, as_of))
+            for index, band in enumerate(bands)
+        }
+    rows = rows.filter(bands_range(bands, as_of, prefix)).order_by()
+
+    if group is None:
+        row = rows.aggregate(**aggregates)
+        counts = {None: [row[f'band_{index}'] for index in range(len(bands))]}
+    else:
+        counts = {
+            row[group]: [row[f'band_{index}'] for index in range(len(bands))]
+            for row in rows.values(group).annotate(**aggregates)
+        }
+
+    if split == 'gender':
+        labels = dict(Patient.GENDER_CHOICES)
+    elif split == 'coverage':
+        labels = {True: 'Vaccinated', False: 'Not vaccinated'}
+    elif split == 'vaccine':
+        labels = dict(Vaccine.objects.filter(pk__in=list(counts)).values_list('pk', 'name'))
+    else:
+        labels = {None: 'All patients'}
+    if split in ('gender', 'coverage'):
+        counts = {key: counts.get(key, [0] * len(bands)) for key in labels}
+    return CohortCounts(list(bands), as_of, split, counts, labels)
@@ -0,0 +1,197 @@
+import time
+from dataclasses import dataclass
+
+from django.core.cache import cache
+from django.contrib.auth.models import User
+from django.db.models import Count, F, Q, QuerySet
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from .models import Patient, Vaccine, VaccinationRecord
+from .signals import rows_updated
+from .caching import get_or_refresh
+
+# =============================================
+# VACCINE COVERAGE ANALYTICS
+# =============================================
+# Coverage of one user's patients is read with a fixed number of queries,
+# whatever the size of the catalog: one GROUP BY vaccine over the
+# administered records (doses, distinct patients, distinct patients with a
+# completed series), the vaccines to report and the patient total.
+#
+# Reports are cached per user under a key that embeds a version number for
+# the user and one for the catalog. Record and patient changes bump the
+# owner's version and vaccine changes the catalog version, so the next read
+# recomputes instead of serving a stale report.
+
+CACHE_SECONDS = 600
+
+
+@dataclass(frozen=True)
+class VaccineCoverage:
+    """Administered doses and patients covered for one vaccine"""
+    vaccine_id: int
+    name: str
+    doses: int = 0
+    patients: int = 0
+    completed_patients: int = 0
+    total_patients: int = 0
+
+    @property
+    def coverage_percentage(self):
+        """Percentage of all patients with at least one dose"""
+        if self.total_patients > 0:
+            return round(self.patients / self.total_patients * 100, 1)
+        return 0
+
+    @property
+    def completion_percentage(self):
+        """Percentage of the patients who started the series that completed it"""
+        if self.patients > 0:
+            return round(self.completed_patients / self.patients * 100, 1)
+        return 0
+
+
+@dataclass(frozen=True)
+class CoverageReport:
+    total_patients: int
+    total_doses: int
+    vaccines: list
+
+    def as_dict(self):
+        return {
+            'total_patients': self.total_patients,
+            'total_doses': self.total_doses,
+            'vaccines': [
+                {
+                    'vaccine_id': item.vaccine_id,
+                    'name': item.name,
+                    'doses': item.doses,
+                    'patients': item.patients,
+                    'completed_patients': item.completed_patients,
+                    'coverage_percentage': item.coverage_percentage,
+                    'completion_percentage': item.completion_percentage,
+                }
+                for item in self.vaccines
+            ],
+        }
+
+
+def compute_coverage(user):
+    """Coverage of ``user``'s patients for every active vaccine and every vaccine they received"""
+    rows = {
+        row['vaccine_id']: row
+        for row in VaccinationRecord.objects.filter(patient__user=user, status='administered').order_by()
+        .values('vaccine_id').annotate(
+            doses=Count('pk'),
+            patients=Count('patient', distinct=True),
+            completed_patients=Count('patient', distinct=True, filter=Q(dose_number__gte=F('total_doses'))),
+        )
+    }
+    vaccines = Vaccine.objects.filter(Q(is_active=True) | Q(pk__in=list(rows))).order_by('name').values_list('pk', 'name')
+    total_patients = Patient.objects.filter(user=user).count()
+    return CoverageReport(
+        total_patients=total_patients,
+        total_doses=sum(row['doses'] for row in rows.values()),
+        vaccines=[
+            VaccineCoverage(
+                vaccine_id=pk,
+                name=name,
+                doses=rows.get(pk, {}).get('doses', 0),
+                patients=rows.get(pk, {}).get('patients', 0),
+                completed_patients=rows.get(pk, {}).get('completed_patients', 0),
+                total_patients=total_patients,
+            )
+            for pk, name in vaccines
+        ],
+    )
+
+
+def _version_key(scope):
+    return f'coverage:version:{scope}'
+
+
+def _version(scope):
+    # Versions start from the clock, so a version lost to eviction never
+    # matches a report cached under the old one
+    return cache.get_or_set(_version_key(scope), time.time_ns, timeout=None)
+
+
+def invalidate(scope):
+    """Make cached reports for ``scope`` (a user id or 'catalog') stale"""
+    try:
+        cache.incr(_version_key(scope))
+    except ValueError:
+        cache.set(_version_key(scope), time.time_ns(), timeout=None)
+
+
+def get_coverage(user):
+    """Return compute_coverage(user), cached until the user's records or the catalog change"""
+    key = f'coverage:{user.pk}:{_version(user.pk)}:{_version("catalog")}'
+    return get_or_refresh(key, lambda: compute_coverage(user), fresh=CACHE_SECONDS, stale=CACHE_SECONDS)
+
+
+# =============================================
+# SIGNAL HANDLERS
+# =============================================
+
+def _invalidate_owners(patient_ids):
+    for user_id in set(Patient.objects.filter(pk__in=patient_ids).values_list('user_id', flat=True)):
+        invalidate(user_id)
+
+
+def _owner_id(record):
+    """Owner of the record's patient, read only when the patient is not loaded"""
+    if VaccinationRecord.patient.is_cached(record):
+        return record.patient.user_id
+    return Patient.objects.filter(pk=record.patient_id).values_list('user_id', flat=True).first()
+
+
+@receiver(post_save, sender=VaccinationRecord)
+def invalidate_record_coverage(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate(_owner_id(instance))
+
+
+@receiver(pre_delete, sender=VaccinationRecord)
+def invalidate_deleted_record_coverage(sender, instance, origin=None, **kwargs):
+    """Expire the owners' reports once per delete() call, however many records it removes"""
+    if (origin.model if isinstance(origin, QuerySet) else type(origin)) in (User, Patient, Vaccine):
+        # Records deleted with their patient, owner or vaccine: the patient
+        # and catalog receivers below expire the reports
+        return
+    if isinstance(origin, QuerySet):
+        if not getattr(origin, '_coverage_invalidated', False):
+            origin._coverage_invalidated = True
+            for user_id in set(origin.order_by().values_list('patient__user_id', flat=True)):
+                invalidate(user_id)
+        return
+    invalidate(_owner_id(instance))
+
+
+@receiver(post_delete, sender=VaccinationRecord)
+def forget_deleted_record_origin(sender, instance, origin=None, **kwargs):
+    # Every pre_delete of a delete() call comes before its post_deletes; a
+    # later delete() of the same queryset expires the reports again
+    if isinstance(origin, QuerySet):
+        origin.__dict__.pop('_coverage_invalidated', None)
+
+
+@receiver(rows_updated, sender=VaccinationRecord)
+def invalidate_updated_record_coverage(sender, changes, **kwargs):
+    # Record states are (status, date_administered, vaccine_id, patient_id, reaction)
+    _invalidate_owners({after[3] for _, after in changes})
+
+
+@receiver(post_save, sender=Patient)
+@receiver(post_delete, sender=Patient)
+def invalidate_patient_coverage(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate(instance.user_id)
+
+
+@receiver(post_save, sender=Vaccine)
+@receiver(post_delete, sender=Vaccine)
+def invalidate_catalog_coverage(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate('catalog')
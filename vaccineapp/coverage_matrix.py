@@ -0,0 +1,300 @@
+import re
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.utils import timezone
+
+from .models import Patient, Vaccine, VaccinationRecord
+from .rollups import counter_values
+
+# =============================================
+# PATIENT x VACCINE DOSE COVERAGE MATRIX
+# =============================================
+# Every patient is a row and every (vaccine, dose number) a column holding
+# one bit per row: set when the patient has that dose administered. Columns
+# are packed into little-endian uint64 words, so "dose 1 but not dose 2"
+# over a million patients is a few thousand word operations.
+#
+# The matrix lives in process memory and is refreshed incrementally: rows
+# of the patients whose records or details changed since the last refresh
+# (by updated_at) are re-read. Deletions leave no updated_at behind, so
+# the rollup counters of patients and administered records are compared
+# with the matrix after each refresh and a mismatch triggers a rebuild.
+#
+# Expressions combine columns with & (and), | (or), - (and not), ~ (not)
+# and parentheses. An operand is a vaccine id, short name or name (quoted
+# when it contains spaces or operators), optionally followed by :dose;
+# without a dose it stands for any dose of that vaccine.
+
+# Changes committed late can carry an updated_at slightly before the last
+# refresh; re-reading this window makes the refresh idempotent over them
+REFRESH_OVERLAP = timedelta(seconds=60)
+MIN_REFRESH_SECONDS = 1.0
+
+TOKEN = re.compile(r'\s*(?:(?P<op>[&|~()-])|(?P<vaccine>"[^"]+"|[\w.]+)(?::(?P<dose>\d+))?)')
+
+
+def _words(rows):
+    return np.zeros((rows + 63) // 64, dtype='<u8')
+
+
+def _bits(rows):
+    """Word indexes and single-bit masks of ``rows``"""
+    rows = np.asarray(rows, dtype=np.int64)
+    return rows >> 6, np.left_shift(np.uint64(1), (rows & 63).astype(np.uint64))
+
+
+def pack(mask):
+    """Pack a boolean row mask into uint64 words"""
+    packed = np.packbits(mask, bitorder='little')
+    padded = np.zeros(((len(packed) + 7) // 8) * 8, dtype=np.uint8)
+    padded[:len(packed)] = packed
+    return padded.view('<u8')
+
+
+def unpack(words, rows):
+    """Row indexes of the set bits of ``words``"""
+    return np.flatnonzero(np.unpackbits(words.view(np.uint8), bitorder='little')[:rows])
+
+
+class CoverageMatrix:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.patient_ids = np.empty(0, dtype=np.int64)
+        self.owners = np.empty(0, dtype=np.int64)
+        self.columns = {}
+        self.vaccines = {}
+        self.universes = {}
+        self.watermark = None
+        self.refreshed = 0.0
+
+    @property
+    def size(self):
+        return len(self.patient_ids)
+
+    def _column(self, key):
+        if key not in self.columns:
+            self.columns[key] = _words(self.size)
+        return self.columns[key]
+
+    def _set(self, rows, vaccine_ids, doses):
+        """Set the bits of administered ``(row, vaccine_id, dose)`` cells"""
+        if not len(rows):
+            return
+        keys = np.stack([vaccine_ids, doses], axis=1)
+        for vaccine_id, dose in np.unique(keys, axis=0):
+            selected = rows[(vaccine_ids == vaccine_id) & (doses == dose)]
+            index, bit = _bits(selected)
+            np.bitwise_or.at(self._column((int(vaccine_id), int(dose))), index, bit)
+
+    def _load_vaccines(self):
+        self.vaccines = {
+            pk: (name, short_name) for pk, name, short_name in Vaccine.objects.values_list('pk', 'name', 'short_name')
+        }
+
+    def rebuild(self):
+        """Read every patient and administered record"""
+        with self.lock:
+            started = timezone.now()
+            patients = np.array(Patient.objects.order_by('pk').values_list('pk', 'user_id'), dtype=np.int64).reshape(-1, 2)
+            self.patient_ids, self.owners = patients[:, 0].copy(), patients[:, 1].copy()
+            self.columns = {}
+            self.universes = {}
+            records = np.array(
+                VaccinationRecord.objects.filter(status='administered').order_by().values_list(
+                    'patient_id', 'vaccine_id', 'dose_number'
+                ),
+                dtype=np.int64,
+            ).reshape(-1, 3)
+            self._set(np.searchsorted(self.patient_ids, records[:, 0]), records[:, 1], records[:, 2])
+            self._load_vaccines()
+            self.watermark = started
+            self.refreshed = time.monotonic()
+
+    def _append_patients(self, ids, owners):
+        """Add rows for new patients, growing every column"""
+        self.patient_ids = np.concatenate([self.patient_ids, ids])
+        self.owners = np.concatenate([self.owners, owners])
+        self.universes = {}
+        words = (self.size + 63) // 64
+        for key, column in self.columns.items():
+            if len(column) < words:
+                self.columns[key] = np.concatenate([column, np.zeros(words - len(column), dtype='<u8')])
+
+    def refresh(self):
+        """Apply the changes since the last refresh; rebuild when they cannot be applied"""
+        with self.lock:
+            if self.watermark is None:
+                return self.rebuild()
+            started = timezone.now()
+            since = self.watermark - REFRESH_OVERLAP
+
+            changed = np.array(
+                Patient.objects.filter(updated_at__gte=since).order_by('pk').values_list('pk', 'user_id'), dtype=np.int64
+            ).reshape(-1, 2)
+            rows = np.searchsorted(self.patient_ids, changed[:, 0])
+            known = (rows < self.size) & (self.patient_ids[np.minimum(rows, self.size - 1)] == changed[:, 0]) \
+                if self.size else np.zeros(len(changed), dtype=bool)
+            if known.any():
+                self.owners[rows[known]] = changed[known, 1]
+                self.universes = {}
+            new = changed[~known]
+            if len(new):
+                if self.size and new[0, 0] < self.patient_ids[-1]:
+                    # Rows are kept in pk order; an older pk cannot be appended
+                    return self.rebuild()
+                self._append_patients(new[:, 0], new[:, 1])
+
+            touched = list(VaccinationRecord.objects.filter(updated_at__gte=since).values_list('patient_id', flat=True).distinct())
+            if touched:
+                records = np.array(
+                    VaccinationRecord.objects.filter(patient_id__in=touched, status='administered').order_by().values_list(
+                        'patient_id', 'vaccine_id', 'dose_number'
+                    ),
+                    dtype=np.int64,
+                ).reshape(-1, 3)
+                touched_rows = np.searchsorted(self.patient_ids, np.array(touched, dtype=np.int64))
+                if (touched_rows >= self.size).any() or (self.patient_ids[touched_rows] != touched).any():
+                    return self.rebuild()
+                index, bit = _bits(touched_rows)
+                for column in self.columns.values():
+                    np.bitwise_and.at(column, index, ~bit)
+                self._set(np.searchsorted(self.patient_ids, records[:, 0]), records[:, 1], records[:, 2])
+
+            self._load_vaccines()
+            self.watermark = started
+            self.refreshed = time.monotonic()
+
+            counters = counter_values('patients', 'records:administered')
+            if counters['patients'] != self.size or counters['records:administered'] != self.cell_count():
+                return self.rebuild()
+
+    def cell_count(self):
+        return sum(int(np.bitwise_count(column).sum()) for column in self.columns.values())
+
+    def universe(self, owner_id=None):
+        """Words with the bits of every patient, or of ``owner_id``'s patients"""
+        if owner_id not in self.universes:
+            mask = np.ones(self.size, dtype=bool) if owner_id is None else self.owners == owner_id
+            self.universes[owner_id] = pack(mask)
+        return self.universes[owner_id]
+
+    def resolve(self, name, dose=None):
+        """Column words for a vaccine (id, short name or name) and optional dose"""
+        name = name.strip('"')
+        matches = [
+            pk for pk, (vaccine_name, short_name) in self.vaccines.items()
+            if str(pk) == name or name.lower() in (vaccine_name.lower(), (short_name or '').lower())
+        ]
+        if not matches:
+            raise ValueError(f"Unknown vaccine {name!r}")
+        result = _words(self.size)
+        for (vaccine_id, column_dose), column in self.columns.items():
+            if vaccine_id in matches and (dose is None or column_dose == dose):
+                result |= column
+        return result
+
+    def evaluate(self, expression, owner_id=None):
+        """Rows matching ``expression`` among all patients, or ``owner_id``'s
+
+        Returns the result words. Raises ValueError for a malformed
+        expression or an unknown vaccine.
+        """
+        with self.lock:
+            universe = self.universe(owner_id)
+            return _Parser(self, expression, universe).parse() & universe
+
+    def patients(self, words, limit=None):
+        """Patient ids of the set bits of ``words``, in pk order"""
+        rows = unpack(words, self.size)
+        return self.patient_ids[rows[:limit] if limit is not None else rows].tolist()
+
+    @staticmethod
+    def count(words):
+        return int(np.bitwise_count(words).sum())
+
+
+class _Parser:
+    """Recursive descent over the expression grammar
+
+        expression := term (('|' | '-') term)*
+        term       := factor ('&' factor)*
+        factor     := '~' factor | '(' expression ')' | operand
+    """
+
+    def __init__(self, matrix, expression, universe):
+        self.matrix = matrix
+        self.universe = universe
+        self.tokens = []
+        position = 0
+        expression = expression.strip()
+        while position < len(expression):
+            match = TOKEN.match(expression, position)
+            if not match or match.end() == position:
+                raise ValueError(f"Unexpected character at position {position}: {expression[position]!r}")
+            self.tokens.append(match)
+            position = match.end()
+            while position < len(expression) and expression[position].isspace():
+                position += 1
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position].group('op')
+        return None
+
+    def parse(self):
+        if not self.tokens:
+            raise ValueError("The expression is empty")
+        result = self.expression()
+        if self.position != len(self.tokens):
+            raise ValueError(f"Unexpected {self.tokens[self.position].group().strip()!r}")
+        return result
+
+    def expression(self):
+        result = self.term()
+        while self.peek() in ('|', '-'):
+            op = self.peek()
+            self.position += 1
+            right = self.term()
+            result = result | right if op == '|' else result & ~right
+        return result
+
+    def term(self):
+        result = self.factor()
+        while self.peek() == '&':
+            self.position += 1
+            result = result & self.factor()
+        return result
+
+    def factor(self):
+        if self.position >= len(self.tokens):
+            raise ValueError("The expression ends unexpectedly")
+        token = self.tokens[self.position]
+        self.position += 1
+        op = token.group('op')
+        if op == '~':
+            return self.universe & ~self.factor()
+        if op == '(':
+            result = self.expression()
+            if self.peek() != ')':
+                raise ValueError("Missing closing parenthesis")
+            self.position += 1
+            return result
+        if op:
+            raise ValueError(f"Unexpected {op!r}")
+        dose = token.group('dose')
+        return self.matrix.resolve(token.group('vaccine'), int(dose) if dose else None)
+
+
+_matrix = CoverageMatrix()
+
+
+def get_matrix():
+    """Return the process-wide matrix, refreshed at most every MIN_REFRESH_SECONDS"""
+    with _matrix.lock:
+        if time.monotonic() - _matrix.refreshed >= MIN_REFRESH_SECONDS:
+            _matrix.refresh()
+    return _matrix
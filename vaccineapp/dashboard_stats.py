@@ -0,0 +1,237 @@
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db.models import Count, Exists, IntegerField, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Patient, Vaccine, VaccinationRecord, Appointment, VaccineInventory, DailyVaccinationCount
+from .rollups import counter_values
+from .caching import get_or_refresh
+from .cohorts import DASHBOARD_BANDS, cohort_counts
+
+# =============================================
+# DASHBOARD STATISTICS SERVICE
+# =============================================
+# Every section below is filled by a single conditional-aggregation query,
+# so adding a metric adds a column to an existing SELECT instead of a new
+# round trip to the database. Totals that would otherwise scan every record
+# are read from the rollup tables maintained by vaccineapp.rollups.
+
+
+@dataclass(frozen=True)
+class UserStats:
+    """Counts scoped to the patients owned by one user"""
+    patients_count: int = 0
+    appointments_count: int = 0
+    vaccination_records_count: int = 0
+
+
+@dataclass(frozen=True)
+class PatientStats:
+    """System-wide patient counts"""
+    total_patients: int = 0
+    patients_vaccinated: int = 0
+
+    @property
+    def vaccine_coverage(self):
+        """Percentage of patients with at least one administered dose"""
+        if self.total_patients > 0:
+            return round((self.patients_vaccinated / self.total_patients) * 100, 1)
+        return 0
+
+
+@dataclass(frozen=True)
+class VaccinationStats:
+    """System-wide vaccination record counts relative to ``today``"""
+    administered_total: int = 0
+    administered_last_30_days: int = 0
+    administered_this_month: int = 0
+    administered_this_week: int = 0
+    administered_today: int = 0
+    due_today: int = 0
+    overdue: int = 0
+
+
+@dataclass(frozen=True)
+class InventoryStats:
+    """Aggregates over every vaccine inventory lot"""
+    total_lots: int = 0
+    total_doses: int = 0
+    low_stock_count: int = 0
+    expiring_soon_count: int = 0
+    expired_count: int = 0
+    vaccine_types: int = 0
+
+
+@dataclass(frozen=True)
+class CatalogStats:
+    """Aggregates over the active vaccine catalog"""
+    vaccine_types: int = 0
+    type_distribution: dict = field(default_factory=dict)
+
+
+@dataclass(frozen=True)
+class DashboardStats:
+    """Header statistics rendered with the dashboard page
+
+    Chart datasets (age distribution, vaccine types, coverage) are served
+    separately by the chart API endpoints.
+    """
+    user: UserStats
+    vaccinations: VaccinationStats
+    inventory: InventoryStats
+
+    def as_context(self):
+        """Flatten into the template context keys used by dashboard.html"""
+        return {
+            'patients_count': self.user.patients_count,
+            'appointments_count': self.user.appointments_count,
+            'vaccination_records_count': self.user.vaccination_records_count,
+            'total_vaccines': self.inventory.total_lots,
+            'total_doses': self.inventory.total_doses,
+            'low_stock_count': self.inventory.low_stock_count,
+            'vaccine_types': self.inventory.vaccine_types,
+            'total_administered': self.vaccinations.administered_last_30_days,
+            'todays_vaccinations': self.vaccinations.administered_today,
+            'vaccinations_due': self.vaccinations.due_today,
+            'overdue_vaccinations': self.vaccinations.overdue,
+        }
+
+
+def _count_subquery(queryset, group_by):
+    """Correlated COUNT(*) subquery for ``queryset`` grouped on ``group_by``"""
+    counts = queryset.order_by().values(group_by).annotate(n=Count('pk')).values('n')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def get_user_stats(user):
+    """Patient, appointment and record counts for one user in a single query"""
+    row = User.objects.filter(pk=user.pk).annotate(
+        patients_count=_count_subquery(
+            Patient.objects.filter(user=OuterRef('pk')), 'user'
+        ),
+        appointments_count=_count_subquery(
+            Appointment.objects.filter(patient__user=OuterRef('pk'), status='scheduled'),
+            'patient__user',
+        ),
+        vaccination_records_count=_count_subquery(
+            VaccinationRecord.objects.filter(patient__user=OuterRef('pk')),
+            'patient__user',
+        ),
+    ).values('patients_count', 'appointments_count', 'vaccination_records_count').first()
+    return UserStats(**row) if row else UserStats()
+
+
+def get_patient_stats(today=None):
+    """Patient totals and coverage from the rollup counters"""
+    counters = counter_values('patients', 'patients_vaccinated')
+    return PatientStats(
+        total_patients=counters['patients'],
+        patients_vaccinated=counters['patients_vaccinated'],
+    )
+
+
+def get_age_distribution(today=None):
+    """Patient counts per exact-age bucket in a single query"""
+    counts = cohort_counts(DASHBOARD_BANDS, as_of=today or timezone.now().date())
+    return {band.label: count for band, count in zip(counts.bands, counts.totals)}
+
+
+def get_vaccination_stats(today=None):
+    """Vaccination record counts for the dashboard windows in a single query"""
+    today = today or timezone.now().date()
+    administered = Q(status='administered')
+    scheduled = Q(status='scheduled')
+
+    def total(condition):
+        return Coalesce(Sum('count', filter=condition), 0)
+
+    row = DailyVaccinationCount.objects.order_by().aggregate(
+        administered_total=total(administered),
+        administered_last_30_days=total(administered & Q(day__gte=today - timedelta(days=30))),
+        administered_this_month=total(administered & Q(day__gte=today.replace(day=1))),
+        administered_this_week=total(administered & Q(day__gte=today - timedelta(days=today.weekday()))),
+        administered_today=total(administered & Q(day=today)),
+        due_today=total(scheduled & Q(day=today)),
+        overdue=total(scheduled & Q(day__lt=today)),
+    )
+    return VaccinationStats(**row)
+
+
+def get_inventory_stats(today=None):
+    """Stock totals from the rollups plus expiry counts from the indexed expiry windows
+
+    Expiring lots are those of ``expiring_within(30)``, as in the expiry API;
+    expired lots are counted apart.
+    """
+    today = today or timezone.now().date()
+
+    windows = VaccineInventory.objects.expiry_windows(today)
+    vaccine_types = Vaccine.objects.filter(
+        Exists(VaccineInventory.objects.filter(vaccine=OuterRef('pk')))
+    ).order_by().values('vaccine_type').distinct().count()
+    statuses = [f'inventory:{status}' for status, _ in VaccineInventory.STATUS_CHOICES]
+    counters = counter_values('inventory:doses', *statuses)
+
+    return InventoryStats(
+        total_lots=sum(counters[name] for name in statuses),
+        total_doses=counters['inventory:doses'],
+        low_stock_count=counters['inventory:low_stock'] + counters['inventory:critical'],
+        expiring_soon_count=windows['within_30_days_lots'],
+        expired_count=windows['expired_lots'],
+        vaccine_types=vaccine_types,
+    )
+
+
+def get_catalog_stats():
+    """Vaccine type distribution of the active catalog in a single query"""
+    aggregates = {
+        vaccine_type: Count('pk', filter=Q(vaccine_type=vaccine_type, is_active=True))
+        for vaccine_type, _ in Vaccine.VACCINE_TYPE_CHOICES
+    }
+    row = Vaccine.objects.order_by().aggregate(
+        distinct_types=Count('vaccine_type', distinct=True),
+        **aggregates,
+    )
+
+    return CatalogStats(
+        vaccine_types=row['distinct_types'],
+        type_distribution={
+            vaccine_type: {'count': row[vaccine_type], 'display_name': display_name}
+            for vaccine_type, display_name in Vaccine.VACCINE_TYPE_CHOICES
+        },
+    )
+
+
+# System-wide sections shared by every user, keyed by name
+SECTIONS = {
+    'patients': get_patient_stats,
+    'ages': get_age_distribution,
+    'vaccinations': get_vaccination_stats,
+    'inventory': get_inventory_stats,
+    'catalog': lambda today: get_catalog_stats(),
+}
+
+
+def get_cached_section(name, today=None, fresh=None):
+    """Return one system-wide section through the stale-while-revalidate cache"""
+    today = today or timezone.now().date()
+    return get_or_refresh(f'dashboard:{name}:{today.isoformat()}', lambda: SECTIONS[name](today), fresh=fresh)
+
+
+def get_dashboard_stats(user, today=None, use_cache=True):
+    """Compute the dashboard header statistics for ``user`` in a handful of queries
+
+    The system-wide sections are served through the stale-while-revalidate
+    cache unless ``use_cache`` is False; only the per-user counts are
+    computed on every request.
+    """
+    today = today or timezone.now().date()
+    names = ('vaccinations', 'inventory')
+    if use_cache:
+        sections = {name: get_cached_section(name, today) for name in names}
+    else:
+        sections = {name: SECTIONS[name](today) for name in names}
+    return DashboardStats(user=get_user_stats(user), **sections)
@@ -0,0 +1,279 @@
+from dataclasses import dataclass
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Vaccine, VaccineInventory, Appointment, DailyVaccinationCount, MonthlyVaccinationCount
+from .caching import get_or_refresh
+
+# =============================================
+# CONSUMPTION FORECASTING
+# =============================================
+# Administered doses per vaccine are read from the rollup tables into two
+# matrices: whole calendar months from MonthlyVaccinationCount (years of
+# history in a few rows per vaccine) and the most recent days from
+# DailyVaccinationCount. Booked demand (scheduled records and vaccination
+# appointments) fills a (vaccines x horizon days) matrix. Every statistic
+# below is an array operation over all vaccines at once:
+#   seasonality  doses per day in each calendar month relative to the overall
+#                daily average, shrunk towards 1 for short histories
+#   rate         exponentially weighted daily consumption with the seasonal
+#                effect of each recent day removed
+#   demand       max(rate x seasonality, booked doses) for each future day
+#   stock-out    first future day where cumulative demand reaches the stock
+#   reorder      demand over the lead time plus safety stock
+
+DEFAULTS = {
+    'HISTORY_MONTHS': 36,
+    'RECENT_DAYS': 91,
+    'HORIZON_DAYS': 180,
+    'LEAD_TIME_DAYS': 14,
+    'REVIEW_DAYS': 30,
+    'SMOOTHING_DAYS': 28,       # half-life of the exponentially weighted rate
+    'SERVICE_LEVEL_Z': 1.65,    # safety stock for a ~95% service level
+    'CACHE_SECONDS': 300,
+}
+
+
+def get_config():
+    """Return the forecast settings merged over the defaults"""
+    return {**DEFAULTS, **getattr(settings, 'FORECAST', {})}
+
+
+@dataclass(frozen=True)
+class VaccineForecast:
+    """Projected consumption and reorder suggestion for one vaccine"""
+    vaccine_id: int
+    vaccine_name: str
+    stock: int
+    min_stock_level: int
+    daily_rate: float
+    seasonal_index: float
+    booked_doses: int
+    days_of_cover: float
+    stockout_date: object
+    reorder_point: int
+    reorder_quantity: int
+    needs_reorder: bool
+
+    def as_dict(self):
+        return {
+            'vaccine_id': self.vaccine_id,
+            'vaccine_name': self.vaccine_name,
+            'stock': self.stock,
+            'min_stock_level': self.min_stock_level,
+            'daily_rate': round(self.daily_rate, 2),
+            'seasonal_index': round(self.seasonal_index, 2),
+            'booked_doses': self.booked_doses,
+            'days_of_cover': None if np.isinf(self.days_of_cover) else round(self.days_of_cover, 1),
+            'stockout_date': self.stockout_date.isoformat() if self.stockout_date else None,
+            'suggested_min_stock_level': self.reorder_point,
+            'reorder_quantity': self.reorder_quantity,
+            'needs_reorder': self.needs_reorder,
+        }
+
+
+def _scatter(rows, index, columns, width):
+    """Sum ``(vaccine_id, column, count)`` rows into a (vaccines x width) matrix
+
+    ``columns`` maps each row's second value to its column number. Rows for
+    vaccines missing from ``index`` are dropped.
+    """
+    matrix = np.zeros((len(index), width))
+    rows = [row for row in rows if row[0] in index]
+    if rows:
+        vaccine_ids, keys, counts = zip(*rows)
+        positions = np.array([index[vaccine_id] for vaccine_id in vaccine_ids])
+        offsets = np.array([columns(key) for key in keys])
+        inside = (offsets >= 0) & (offsets < width)
+        np.add.at(matrix, (positions[inside], offsets[inside]), np.array(counts, dtype=float)[inside])
+    return matrix
+
+
+def _days_from(start):
+    return lambda day: (day - start).days
+
+
+def _calendar_months(start, count):
+    """Calendar month (0-11) of ``count`` consecutive days or months from ``start``
+
+    ``start`` is a ``datetime64`` whose unit, day or month, sets the step.
+    """
+    return (start + np.arange(count)).astype('datetime64[M]').astype(int) % 12
+
+
+def load_inputs(today, config):
+    """Read the vaccines, history, booked demand and stock for the forecast
+
+    Returns ``(vaccines, monthly, recent, booked, stock, minimum)`` where
+    ``monthly`` covers the HISTORY_MONTHS whole months before the current
+    one and ``recent`` the RECENT_DAYS days before ``today``.
+    """
+    history_months, recent_days, horizon_days = (
+        config['HISTORY_MONTHS'], config['RECENT_DAYS'], config['HORIZON_DAYS']
+    )
+    first_month = (np.datetime64(today, 'M') - history_months).item()
+    recent_start = today - timedelta(days=recent_days)
+    horizon_end = today + timedelta(days=horizon_days - 1)
+
+    vaccines = list(Vaccine.objects.filter(is_active=True).order_by('name', 'pk').values_list('pk', 'name'))
+    index = {vaccine_id: position for position, (vaccine_id, _) in enumerate(vaccines)}
+
+    months = MonthlyVaccinationCount.objects.filter(
+        status='administered', month__gte=first_month, month__lt=today.replace(day=1),
+    ).order_by().values_list('vaccine_id', 'month', 'count')
+    monthly = _scatter(
+        months, index,
+        lambda month: (month.year - first_month.year) * 12 + month.month - first_month.month,
+        history_months,
+    )
+
+    days = DailyVaccinationCount.objects.filter(
+        status='administered', day__gte=recent_start, day__lt=today,
+    ).order_by().values_list('vaccine_id', 'day', 'count')
+    recent = _scatter(days, index, _days_from(recent_start), recent_days)
+
+    scheduled = DailyVaccinationCount.objects.filter(
+        status='scheduled', day__gte=today, day__lte=horizon_end,
+    ).order_by().values_list('vaccine_id', 'day', 'count')
+    appointments = Appointment.objects.filter(
+        status__in=['scheduled', 'confirmed'], vaccine__isnull=False,
+        scheduled_date__date__gte=today, scheduled_date__date__lte=horizon_end,
+    ).annotate(day=TruncDate('scheduled_date')).order_by().values('vaccine_id', 'day').annotate(
+        n=Count('pk')
+    ).values_list('vaccine_id', 'day', 'n')
+    # A booked dose may appear both as a scheduled record and as an
+    # appointment, so take the larger of the two rather than their sum
+    booked = np.maximum(
+        _scatter(scheduled, index, _days_from(today), horizon_days),
+        _scatter(appointments, index, _days_from(today), horizon_days),
+    )
+
+    stock = np.zeros(len(vaccines))
+    minimum = np.zeros(len(vaccines))
+    lots = VaccineInventory.objects.filter(vaccine__is_active=True).order_by().values('vaccine_id').annotate(
+        stock=Sum('current_stock', filter=Q(is_usable=True, expiration_date__gte=today), default=0),
+        minimum=Sum('min_stock_level', default=0),
+    )
+    for row in lots:
+        stock[index[row['vaccine_id']]] = row['stock']
+        minimum[index[row['vaccine_id']]] = row['minimum']
+
+    return vaccines, monthly, recent, booked, stock, minimum
+
+
+def compute_forecast(monthly, recent, booked, stock, today, config):
+    """Vectorized forecast over all vaccines
+
+    ``monthly`` holds doses per whole month for the months before the current
+    one, ``recent`` doses per day for the days before ``today``, ``booked``
+    booked doses per day from ``today`` and ``stock`` the usable doses, one
+    row or entry per vaccine. Returns a dict of arrays, one entry per vaccine.
+    """
+    vaccine_count, history_months = monthly.shape
+    recent_days = recent.shape[1]
+    horizon_days = booked.shape[1]
+    lead_time = min(config['LEAD_TIME_DAYS'], horizon_days)
+    review = min(lead_time + config['REVIEW_DAYS'], horizon_days)
+
+    # Seasonal index per calendar month: doses per day in that month over
+    # the overall doses per day, trusted in proportion to the number of
+    # complete years of history behind it
+    first_month = np.datetime64(today, 'M') - history_months
+    month_starts = first_month + np.arange(history_months + 1)
+    month_lengths = np.diff(month_starts.astype('datetime64[D]')).astype(float)
+    one_hot = np.eye(12)[_calendar_months(first_month, history_months)]
+    # Skip the months before a vaccine was first used, and the first month
+    # itself, which is usually only partly covered
+    started = np.cumsum(monthly, axis=1) > 0
+    active = np.zeros_like(started)
+    active[:, 1:] = started[:, :-1]
+    monthly = monthly * active
+    active_days = (active * month_lengths) @ one_hot
+    with np.errstate(divide='ignore', invalid='ignore'):
+        per_month = (monthly @ one_hot) / active_days
+        overall = monthly.sum(axis=1, keepdims=True) / active_days.sum(axis=1, keepdims=True)
+        raw_index = np.where((active_days > 0) & (overall > 0), per_month / overall, 1.0)
+    confidence = np.minimum(active.sum(axis=1, keepdims=True) / 24, 1.0)
+    seasonal = 1 + (raw_index - 1) * confidence
+
+    # Exponentially weighted daily rate with each day's seasonal effect removed
+    recent_months = _calendar_months(np.datetime64(today - timedelta(days=recent_days), 'D'), recent_days)
+    weights = 0.5 ** (np.arange(recent_days)[::-1] / config['SMOOTHING_DAYS'])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        deseasonalized = np.where(seasonal[:, recent_months] > 0, recent / seasonal[:, recent_months], 0.0)
+    rate = deseasonalized @ (weights / weights.sum()) if recent_days else np.zeros(vaccine_count)
+
+    future_months = _calendar_months(np.datetime64(today, 'D'), horizon_days)
+    demand = np.maximum(rate[:, None] * seasonal[:, future_months], booked)
+    cumulative = np.cumsum(demand, axis=1)
+
+    runs_out = cumulative >= stock[:, None]
+    stockout_day = np.where(runs_out.any(axis=1), runs_out.argmax(axis=1), -1)
+    daily_demand = cumulative[:, -1] / horizon_days
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days_of_cover = np.where(daily_demand > 0, stock / daily_demand, np.inf)
+
+    # Safety stock from the day-to-day variability of recent consumption
+    sigma = recent.std(axis=1) if recent_days else np.zeros(vaccine_count)
+    safety = config['SERVICE_LEVEL_Z'] * sigma * np.sqrt(lead_time)
+    reorder_point = np.ceil(cumulative[:, lead_time - 1] + safety) if lead_time else np.ceil(safety)
+    target = cumulative[:, review - 1] + safety if review else safety
+    reorder_quantity = np.maximum(np.ceil(target - stock), 0)
+
+    return {
+        'rate': rate,
+        'seasonal_index': seasonal[:, future_months[0]] if horizon_days else np.ones(vaccine_count),
+        'booked': booked.sum(axis=1),
+        'days_of_cover': days_of_cover,
+        'stockout_day': stockout_day,
+        'reorder_point': reorder_point,
+        'reorder_quantity': reorder_quantity,
+        'needs_reorder': (stock <= reorder_point) & (reorder_quantity > 0),
+    }
+
+
+def forecast_all(today=None):
+    """Forecast every active vaccine, most urgent first"""
+    today = today or timezone.now().date()
+    config = get_config()
+    vaccines, monthly, recent, booked, stock, minimum = load_inputs(today, config)
+    if not vaccines:
+        return []
+    result = compute_forecast(monthly, recent, booked, stock, today, config)
+
+    forecasts = [
+        VaccineForecast(
+            vaccine_id=vaccine_id,
+            vaccine_name=name,
+            stock=int(stock[i]),
+            min_stock_level=int(minimum[i]),
+            daily_rate=float(result['rate'][i]),
+            seasonal_index=float(result['seasonal_index'][i]),
+            booked_doses=int(result['booked'][i]),
+            days_of_cover=float(result['days_of_cover'][i]),
+            stockout_date=today + timedelta(days=int(result['stockout_day'][i])) if result['stockout_day'][i] >= 0 else None,
+            reorder_point=int(result['reorder_point'][i]),
+            reorder_quantity=int(result['reorder_quantity'][i]),
+            needs_reorder=bool(result['needs_reorder'][i]),
+        )
+        for i, (vaccine_id, name) in enumerate(vaccines)
+    ]
+    forecasts.sort(key=lambda forecast: (not forecast.needs_reorder, forecast.days_of_cover, forecast.vaccine_name))
+    return forecasts
+
+
+def get_cached_forecast(today=None):
+    """Return forecast_all() through the stale-while-revalidate cache"""
+    today = today or timezone.now().date()
+    config = get_config()
+    return get_or_refresh(
+        f'forecast:{today.isoformat()}',
+        lambda: forecast_all(today),
+        fresh=config['CACHE_SECONDS'],
+        stale=config['CACHE_SECONDS'] * 4,
+    )
@@ -283,4 +283,17 @@ class VaccineInventoryForm(forms.ModelForm):
         if commit:
             instance.save()
         
-        return instance
\ No newline at end of file
+        return instance
+
+class StockAdjustmentForm(forms.Form):
+    """Doses added to (or, when negative, removed from) each selected lot"""
+    delta = forms.IntegerField(
+        label='Doses to add',
+        help_text='Use a negative number to remove doses.'
+    )
+
+    def clean_delta(self):
+        delta = self.cleaned_data['delta']
+        if delta == 0:
+            raise ValidationError("Enter a non-zero number of doses.")
+        return delta
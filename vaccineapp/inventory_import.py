@@ -0,0 +1,218 @@
+import csv
+import json
+from dataclasses import dataclass, field
+from itertools import islice
+
+from django.db import transaction
+
+from .forms import VaccineInventoryForm
+from .models import Vaccine, VaccineInventory, stock_status
+from .signals import stock_recounted
+from .ledger import record_receipts
+from .search import index_objects
+
+# =============================================
+# BULK INVENTORY IMPORT
+# =============================================
+# Rows are read lazily from CSV (with a header line) or JSON lines, using the
+# VaccineInventoryForm field names. Each chunk of rows costs one query to
+# resolve vaccine ids, one to find vaccines by name, one bulk insert for new
+# vaccines and one bulk insert for the lots, all inside a single transaction.
+# Invalid rows are reported with their line number and skipped.
+
+FORMATS = ('csv', 'jsonl')
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+
+@dataclass
+class ImportResult:
+    """Outcome of an import; ``errors`` holds ``(line, {field: [messages]})``"""
+    created: int = 0
+    vaccines_created: int = 0
+    failed: int = 0
+    errors: list = field(default_factory=list)
+
+    def add_error(self, line, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, errors))
+
+
+def guess_format(filename):
+    """Return 'jsonl' for .json/.jsonl/.ndjson file names and 'csv' otherwise"""
+    if filename and filename.lower().rsplit('.', 1)[-1] in ('json', 'jsonl', 'ndjson'):
+        return 'jsonl'
+    return 'csv'
+
+
+def iter_rows(lines, fmt='csv'):
+    """Yield ``(line_number, row)`` from an iterable of text lines
+
+    ``row`` is a dict, or an error message when the line cannot be parsed.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, {key.strip(): value for key, value in row.items() if key}
+    elif fmt == 'jsonl':
+        for number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield number, f"Invalid JSON: {e}"
+                continue
+            yield number, row if isinstance(row, dict) else "Each line must be a JSON object."
+
+
+class ImportRowForm(VaccineInventoryForm):
+    """VaccineInventoryForm without the model instance round trip
+
+    The generated form fields already carry the model field validators, so
+    skipping ``_post_clean()`` keeps the same rules at half the cost per row.
+    """
+
+    def _post_clean(self):
+        pass
+
+
+# Lot fields taken from the cleaned data; ``vaccine`` is resolved in bulk
+LOT_FIELDS = [name for name in VaccineInventoryForm._meta.fields if name != 'vaccine']
+
+
+class RowValidator:
+    """Validate rows with the rules of VaccineInventoryForm
+
+    One form is bound to each row in turn, which avoids rebuilding its
+    fields for every row of a large import.
+    """
+
+    def __init__(self):
+        self.form = ImportRowForm(data={})
+        self.invalid_vaccine = self.form.fields['vaccine'].error_messages['invalid_choice'] % {'value': ''}
+
+    def validate(self, row):
+        """Return ``(lot, None)`` for a valid row or ``(None, errors)``"""
+        form = self.form
+        form.data = row
+        form._errors = None
+        if not form.is_valid():
+            return None, form.errors.get_json_data()
+        return VaccineInventory(**{name: form.cleaned_data[name] for name in LOT_FIELDS}), None
+
+
+def _normalize(row, vaccine_names):
+    """Prepare a raw row for the form, replacing a vaccine id by its name
+
+    Returns ``(data, vaccine_id)``; ``vaccine_id`` is False for an unknown id.
+    """
+    data = {key: value for key, value in row.items() if value not in (None, '')}
+    age_groups = data.get('age_groups')
+    if isinstance(age_groups, str):
+        data['age_groups'] = [group.strip() for group in age_groups.split(',') if group.strip()]
+
+    vaccine_id = data.pop('vaccine', None)
+    if vaccine_id is None:
+        return data, None
+    try:
+        vaccine_id = int(vaccine_id)
+    except (TypeError, ValueError):
+        return data, False
+    if vaccine_id not in vaccine_names:
+        return data, False
+    # Same as VaccineInventoryForm.clean() for a selected vaccine
+    data['vaccine_name'] = vaccine_names[vaccine_id]
+    return data, vaccine_id
+
+
+def _resolve_vaccines(lots, result):
+    """Link lots entered by name to a vaccine, creating missing ones in bulk"""
+    by_name = {}
+    for lot in lots:
+        if lot.vaccine_id is None:
+            by_name.setdefault(lot.vaccine_name, []).append(lot)
+    if not by_name:
+        return
+
+    vaccines = {}
+    for vaccine in Vaccine.objects.filter(name__in=by_name).order_by('-pk'):
+        vaccines[vaccine.name] = vaccine  # the oldest vaccine with a name wins, as with .first()
+    missing = [
+        # Same defaults as VaccineInventoryForm.save()
+        Vaccine(
+            name=name,
+            vaccine_type=named_lots[0].vaccine_type or 'single',
+            manufacturer=named_lots[0].manufacturer or '',
+            description=named_lots[0].description or '',
+            target_diseases=named_lots[0].target_diseases or '',
+            age_groups=named_lots[0].age_groups or '',
+            storage_temperature=named_lots[0].storage_temperature or '',
+        )
+        for name, named_lots in by_name.items() if name not in vaccines
+    ]
+    for vaccine in Vaccine.objects.bulk_create(missing):
+        vaccines[vaccine.name] = vaccine
+    result.vaccines_created += len(missing)
+
+    for name, named_lots in by_name.items():
+        for lot in named_lots:
+            lot.vaccine = vaccines[name]
+
+
+def _import_chunk(chunk, validator, result):
+    ids = set()
+    for _, row in chunk:
+        if isinstance(row, dict) and row.get('vaccine') not in (None, ''):
+            try:
+                ids.add(int(row['vaccine']))
+            except (TypeError, ValueError):
+                pass
+    vaccine_names = dict(Vaccine.objects.filter(pk__in=ids, is_active=True).values_list('pk', 'name')) if ids else {}
+
+    lots = []
+    for line, row in chunk:
+        if not isinstance(row, dict):
+            result.add_error(line, {'__all__': [{'message': row, 'code': 'invalid'}]})
+            continue
+        data, vaccine_id = _normalize(row, vaccine_names)
+        if vaccine_id is False:
+            result.add_error(line, {'vaccine': [{'message': validator.invalid_vaccine, 'code': 'invalid_choice'}]})
+            continue
+        lot, errors = validator.validate(data)
+        if errors:
+            result.add_error(line, errors)
+            continue
+        lot.vaccine_id = vaccine_id
+        # bulk_create skips VaccineInventory.save(), so set the status here
+        lot.status = stock_status(lot.current_stock, lot.min_stock_level)
+        lots.append(lot)
+
+    _resolve_vaccines(lots, result)
+    VaccineInventory.objects.bulk_create(lots)
+    record_receipts(lots, notes='Bulk import')
+    index_objects('lot', lots)  # bulk_create sends no post_save
+    result.created += len(lots)
+
+
+def import_lots(lines, fmt='csv', chunk_size=CHUNK_SIZE, dry_run=False):
+    """Import inventory lots from an iterable of CSV or JSON lines
+
+    Valid rows are inserted in chunks of ``chunk_size`` inside one
+    transaction; invalid rows are reported in the returned ImportResult
+    without aborting the import. With ``dry_run`` nothing is saved.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format {fmt!r}, expected one of {', '.join(FORMATS)}.")
+    result = ImportResult()
+    rows = iter_rows(lines, fmt)
+    validator = RowValidator()
+    with transaction.atomic():
+        while chunk := list(islice(rows, chunk_size)):
+            _import_chunk(chunk, validator, result)
+        if dry_run:
+            transaction.set_rollback(True)
+        elif result.created:
+            stock_recounted.send(sender=VaccineInventory)
+    return result
@@ -0,0 +1,149 @@
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import F, Max, Q, Sum
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import VaccineInventory, StockMovement, StockSnapshot
+from .signals import stock_changed
+
+# =============================================
+# STOCK LEDGER
+# =============================================
+# Stock movements are appended from the stock_changed signal (atomic
+# adjustments, batch adjustments, write-offs, transfers) and from full
+# VaccineInventory saves (receipt on creation, adjustment on edit).
+#
+# Stock at a moment T is the latest snapshot taken at or before T plus the
+# movements between that snapshot and T. Snapshots are taken for all lots at
+# once, so a report reads one snapshot and at most one period of movements
+# however long the ledger grows.
+
+KIND_BY_REASON = {
+    'receipt': 'receipt',
+    'administration': 'administration',
+    'reversal': 'administration',
+    'adjustment': 'adjustment',
+    'wastage': 'wastage',
+    'transfer': 'transfer',
+}
+
+
+def record_movements(changes, reason, record=None, records=None):
+    """Append one movement per StockChange whose stock moved
+
+    ``records`` maps lot ids to the records that took one dose each from the
+    lot: each of them gets a movement of its own, linked to it, and whatever
+    is left of the change one more movement.
+    """
+    kind = KIND_BY_REASON.get(reason, 'adjustment')
+    notes = 'Reversal' if reason == 'reversal' else None
+    movements = []
+    for change in changes:
+        quantity = change.new_stock - change.old_stock
+        for linked in (records or {}).get(change.inventory_id, ()):
+            movements.append(StockMovement(
+                inventory_id=change.inventory_id, kind=kind, quantity=-1, record=linked, notes=notes
+            ))
+            quantity += 1
+        if quantity:
+            movements.append(StockMovement(
+                inventory_id=change.inventory_id, kind=kind, quantity=quantity, record=record, notes=notes
+            ))
+    StockMovement.objects.bulk_create(movements, batch_size=1000)
+
+
+def record_receipts(lots, notes=None):
+    """Append a receipt for the initial stock of newly created lots"""
+    StockMovement.objects.bulk_create(
+        [
+            StockMovement(inventory_id=lot.pk, kind='receipt', quantity=lot.current_stock, notes=notes)
+            for lot in lots if lot.current_stock
+        ],
+        batch_size=1000,
+    )
+
+
+# =============================================
+# POINT-IN-TIME STOCK
+# =============================================
+
+def latest_snapshot_time(moment):
+    """Time of the latest snapshot taken at or before ``moment``, or None"""
+    return StockSnapshot.objects.filter(taken_at__lte=moment).aggregate(latest=Max('taken_at'))['latest']
+
+
+def stock_at(moment, lots=None):
+    """Return ``{inventory_id: stock}`` at ``moment`` for lots with stock
+
+    ``lots`` optionally restricts the result to a VaccineInventory queryset.
+    """
+    snapshot_time = latest_snapshot_time(moment)
+    snapshots = StockSnapshot.objects.filter(taken_at=snapshot_time) if snapshot_time else StockSnapshot.objects.none()
+    movements = StockMovement.objects.filter(occurred_at__lte=moment)
+    if snapshot_time:
+        movements = movements.filter(occurred_at__gt=snapshot_time)
+    if lots is not None:
+        snapshots = snapshots.filter(inventory__in=lots)
+        movements = movements.filter(inventory__in=lots)
+
+    stock = dict(snapshots.values_list('inventory_id', 'stock'))
+    for inventory_id, delta in movements.order_by().values('inventory_id').annotate(
+        delta=Sum('quantity')
+    ).values_list('inventory_id', 'delta'):
+        stock[inventory_id] = stock.get(inventory_id, 0) + delta
+    return {inventory_id: value for inventory_id, value in stock.items() if value}
+
+
+def end_of_day(day):
+    """The last moment of ``day`` in the current time zone"""
+    return timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min)) - timedelta(microseconds=1)
+
+
+def take_snapshot(moment=None):
+    """Store the stock of every lot at ``moment`` (now by default)
+
+    The stock is derived from the previous snapshot and the ledger, not read
+    from current_stock, so snapshots stay consistent with the movements.
+    Returns the number of lots stored, or None if the snapshot exists.
+    """
+    moment = moment or timezone.now()
+    with transaction.atomic():
+        if StockSnapshot.objects.filter(taken_at=moment).exists():
+            return None
+        stock = stock_at(moment)
+        StockSnapshot.objects.bulk_create(
+            [StockSnapshot(inventory_id=inventory_id, taken_at=moment, stock=value) for inventory_id, value in stock.items()],
+            batch_size=1000,
+        )
+    return len(stock)
+
+
+def verify():
+    """Lots whose ledger total differs from current_stock, as ``(id, ledger, stored)``"""
+    totals = VaccineInventory.objects.order_by().annotate(ledger=Sum('stock_movements__quantity', default=0))
+    return list(totals.filter(~Q(ledger=F('current_stock'))).values_list('pk', 'ledger', 'current_stock'))
+
+
+# =============================================
+# SIGNAL HANDLERS
+# =============================================
+
+@receiver(stock_changed)
+def append_stock_movements(sender, changes, reason, record=None, records=None, **kwargs):
+    record_movements(changes, reason, record, records)
+
+
+@receiver(post_save, sender=VaccineInventory)
+def append_saved_stock(sender, instance, created, raw=False, **kwargs):
+    """Record the initial stock of a new lot, or the change made by an edit"""
+    if raw:
+        return
+    # Read before the save by models.remember_stored_stock
+    before = getattr(instance, '_stored_stock', None)
+    if created or before is None:
+        record_receipts([instance])
+    elif instance.current_stock != before[1]:
+        StockMovement.objects.create(inventory=instance, kind='adjustment', quantity=instance.current_stock - before[1])
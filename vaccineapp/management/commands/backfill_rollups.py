@@ -0,0 +1,54 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from vaccineapp import rollups
+
+
+def parse_month(value):
+    try:
+        return datetime.strptime(value, '%Y-%m').date()
+    except ValueError:
+        raise CommandError(f"Invalid month {value!r}, expected YYYY-MM")
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the daily and monthly vaccination rollups month by month, "
+        "writing only the rows that differ from the records"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', help="First month to backfill (YYYY-MM), default the oldest record")
+        parser.add_argument('--to', dest='end', help="Last month to backfill (YYYY-MM), default the newest record")
+        parser.add_argument(
+            '--changed-since',
+            help=(
+                "Only backfill months with records updated since this ISO date or datetime, "
+                "and months whose rollup total differs from their record count"
+            ),
+        )
+
+    def handle(self, *args, **options):
+        start = parse_month(options['start']) if options['start'] else None
+        end = parse_month(options['end']) if options['end'] else None
+        changed_since = None
+        if options['changed_since']:
+            try:
+                changed_since = datetime.fromisoformat(options['changed_since'])
+            except ValueError:
+                raise CommandError(f"Invalid --changed-since {options['changed_since']!r}, expected an ISO date or datetime")
+            if timezone.is_naive(changed_since):
+                changed_since = timezone.make_aware(changed_since)
+        if start and end and start > end:
+            raise CommandError("--from must not be after --to")
+
+        months = rollups.backfill_months(start, end, changed_since)
+        total = 0
+        for month in months:
+            written = rollups.backfill_month(month)
+            total += written
+            if written:
+                self.stdout.write(f"{month:%Y-%m}: {written} rows written")
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {len(months)} months, {total} rows written."))
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from vaccineapp import analytics
+
+
+class Command(BaseCommand):
+    help = (
+        "Export the vaccination records, joined with their patients and vaccines, to a columnar "
+        "snapshot queried by the analytics API. Meant to run periodically, e.g. nightly from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--directory', help="Write under this directory instead of ANALYTICS['DIRECTORY']")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        snapshot = analytics.export_snapshot(options['directory'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {snapshot.rows} records to {snapshot.path} in {time.perf_counter() - started:.1f}s."
+        ))
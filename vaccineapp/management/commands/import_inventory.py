@@ -0,0 +1,43 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vaccineapp.inventory_import import CHUNK_SIZE, FORMATS, guess_format, import_lots
+
+
+class Command(BaseCommand):
+    help = "Import vaccine inventory lots from a CSV or JSON lines file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - to read standard input")
+        parser.add_argument(
+            '--format',
+            choices=FORMATS,
+            help="Input format (guessed from the file extension by default)",
+        )
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="Lots inserted per statement")
+        parser.add_argument('--dry-run', action='store_true', help="Validate the rows without saving anything")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or guess_format(path)
+        try:
+            if path == '-':
+                result = import_lots(sys.stdin, fmt, options['chunk_size'], options['dry_run'])
+            else:
+                with open(path, newline='', encoding='utf-8-sig') as lines:
+                    result = import_lots(lines, fmt, options['chunk_size'], options['dry_run'])
+        except OSError as e:
+            raise CommandError(f"Cannot read {path}: {e}")
+
+        for line, errors in result.errors:
+            for field, messages in errors.items():
+                for message in messages:
+                    self.stderr.write(f"Line {line}: {field}: {message['message']}")
+        if result.failed > len(result.errors):
+            self.stderr.write(f"... {result.failed - len(result.errors)} more rows failed.")
+
+        action = "Validated" if options['dry_run'] else "Imported"
+        self.stdout.write(self.style.SUCCESS(
+            f"{action} {result.created} lots ({result.vaccines_created} new vaccines), {result.failed} rows failed."
+        ))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from vaccineapp import rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the statistics rollup tables from the raw tables and verify them"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify-only',
+            action='store_true',
+            help="Only compare the rollups with the raw tables, without rebuilding them",
+        )
+
+    def handle(self, *args, **options):
+        if not options['verify_only']:
+            counters, daily, monthly, flags = rollups.rebuild()
+            self.stdout.write(
+                f"Rebuilt {counters} counters, {daily} daily rows, {monthly} monthly rows "
+                f"and {flags} patient flags."
+            )
+
+        mismatches = rollups.verify()
+        for table, key, stored, expected in mismatches:
+            self.stderr.write(f"{table} {key}: stored {stored}, expected {expected}")
+        if mismatches:
+            raise CommandError(f"{len(mismatches)} rollup values differ from the raw tables.")
+        self.stdout.write(self.style.SUCCESS("Rollups match the raw tables."))
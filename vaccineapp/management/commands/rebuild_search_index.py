@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from vaccineapp import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index of vaccines, lots, patients and vaccination records"
+
+    def handle(self, *args, **options):
+        counts = search.rebuild_index()
+        summary = ', '.join(f"{count} {kind}s" for kind, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f"Indexed {summary}."))
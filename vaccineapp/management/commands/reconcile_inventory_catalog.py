@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from vaccineapp.models import VaccineInventory
+
+
+class Command(BaseCommand):
+    help = "Copy the vaccine catalog fields to every inventory lot that has drifted from its vaccine"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help="Only report how many lots have drifted, failing if there are any",
+        )
+
+    def handle(self, *args, **options):
+        if options['check']:
+            drifted = VaccineInventory.objects.catalog_drift().count()
+            if drifted:
+                raise CommandError(f"{drifted} lots differ from their vaccine's catalog fields.")
+            self.stdout.write(self.style.SUCCESS("All lots match their vaccine's catalog fields."))
+            return
+
+        updated = VaccineInventory.objects.sync_catalog()
+        self.stdout.write(self.style.SUCCESS(f"Updated the catalog fields of {updated} lots."))
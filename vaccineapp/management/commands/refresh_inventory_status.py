@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from vaccineapp.models import VaccineInventory
+
+
+class Command(BaseCommand):
+    help = "Re-derive the status of every inventory lot from its stock levels with a single UPDATE"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help="Only report how many lots have a stale status, without updating them",
+        )
+
+    def handle(self, *args, **options):
+        if options['check']:
+            stale = VaccineInventory.objects.stale_status().count()
+            self.stdout.write(f"{stale} lots have a stale status.")
+            return
+
+        updated = VaccineInventory.objects.refresh_status()
+        self.stdout.write(self.style.SUCCESS(f"Updated the status of {updated} lots."))
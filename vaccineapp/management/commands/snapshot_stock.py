@@ -0,0 +1,44 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from vaccineapp import ledger
+
+
+class Command(BaseCommand):
+    help = (
+        "Store a snapshot of every lot's stock at the end of a day (yesterday by default), "
+        "derived from the stock ledger. Meant to run daily, e.g. from cron after midnight."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help="Snapshot the end of this ISO date instead of yesterday")
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help="Also check that the ledger adds up to every lot's current stock",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            day = date.fromisoformat(options['date']) if options['date'] else timezone.localdate() - timedelta(days=1)
+        except ValueError:
+            raise CommandError(f"Invalid date {options['date']!r}, expected YYYY-MM-DD.")
+
+        moment = ledger.end_of_day(day)
+        if moment > timezone.now():
+            raise CommandError(f"{day} has not ended yet.")
+        stored = ledger.take_snapshot(moment)
+        if stored is None:
+            self.stdout.write(f"A snapshot for {day} already exists.")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Stored the stock of {stored} lots at the end of {day}."))
+
+        if options['verify']:
+            mismatches = ledger.verify()
+            for inventory_id, total, stored_stock in mismatches:
+                self.stderr.write(f"Lot {inventory_id}: ledger {total}, current stock {stored_stock}")
+            if mismatches:
+                raise CommandError(f"{len(mismatches)} lots differ from the ledger.")
+            self.stdout.write(self.style.SUCCESS("The ledger matches the current stock."))
@@ -0,0 +1,48 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from vaccineapp.models import VaccineInventory
+
+
+class Command(BaseCommand):
+    help = (
+        "Write off usable lots past their expiration date: record their remaining doses as "
+        "wastage and mark them unusable. Meant to run nightly, e.g. from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help="Treat this ISO date as today (defaults to the current date)")
+        parser.add_argument('--batch-size', type=int, default=500, help="Lots written off per transaction")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the lots that would be written off")
+
+    def handle(self, *args, **options):
+        try:
+            today = date.fromisoformat(options['date']) if options['date'] else timezone.now().date()
+        except ValueError:
+            raise CommandError(f"Invalid date {options['date']!r}, expected YYYY-MM-DD.")
+        if options['batch_size'] < 1:
+            raise CommandError(f"Invalid batch size {options['batch_size']}, expected at least 1.")
+        expired = VaccineInventory.objects.expired(today).filter(is_usable=True)
+
+        if options['dry_run']:
+            self.stdout.write(f"{expired.count()} lots would be written off.")
+            return
+
+        # Walk the expired lots in primary key order, one batch per transaction,
+        # so memory stays flat and locks are short however many lots expired.
+        lots = doses = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                expired.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:options['batch_size']]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1]
+            written_off, wasted = VaccineInventory.objects.filter(pk__in=batch).write_off('expired')
+            lots += written_off
+            doses += wasted
+
+        self.stdout.write(self.style.SUCCESS(f"Wrote off {lots} expired lots ({doses} doses)."))
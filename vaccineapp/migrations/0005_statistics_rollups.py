@@ -0,0 +1,101 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:53
+
+from collections import Counter
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_rollups(apps, schema_editor):
+    # Count the existing rows the way rollups.rebuild() does, so the
+    # dashboard and the deltas applied from now on start from the truth
+    Patient = apps.get_model('vaccineapp', 'Patient')
+    VaccinationRecord = apps.get_model('vaccineapp', 'VaccinationRecord')
+    VaccineInventory = apps.get_model('vaccineapp', 'VaccineInventory')
+    Appointment = apps.get_model('vaccineapp', 'Appointment')
+    StatisticCounter = apps.get_model('vaccineapp', 'StatisticCounter')
+    DailyVaccinationCount = apps.get_model('vaccineapp', 'DailyVaccinationCount')
+    PatientVaccinationFlag = apps.get_model('vaccineapp', 'PatientVaccinationFlag')
+
+    flags = dict(
+        VaccinationRecord.objects.filter(status='administered').order_by()
+        .values('patient_id').annotate(n=models.Count('pk')).values_list('patient_id', 'n')
+    )
+    counters = Counter({'patients': Patient.objects.count(), 'patients_vaccinated': len(flags)})
+    daily = Counter()
+    records = VaccinationRecord.objects.order_by().values('date_administered', 'vaccine_id', 'status')
+    for row in records.annotate(n=models.Count('pk')).iterator():
+        counters[f"records:{row['status']}"] += row['n']
+        counters[f"records:{row['status']}:vaccine:{row['vaccine_id']}"] += row['n']
+        daily[(row['date_administered'], row['vaccine_id'], row['status'])] += row['n']
+    inventory = VaccineInventory.objects.order_by().values('status').annotate(
+        lots=models.Count('pk'), doses=models.Sum('current_stock')
+    )
+    for row in inventory:
+        counters[f"inventory:{row['status']}"] += row['lots']
+        counters['inventory:doses'] += row['doses'] or 0
+    for row in Appointment.objects.order_by().values('status').annotate(n=models.Count('pk')):
+        counters[f"appointments:{row['status']}"] += row['n']
+
+    StatisticCounter.objects.bulk_create(
+        [StatisticCounter(name=name, value=value) for name, value in counters.items() if value],
+        batch_size=1000,
+    )
+    DailyVaccinationCount.objects.bulk_create(
+        [
+            DailyVaccinationCount(day=day, vaccine_id=vaccine_id, status=status, count=count)
+            for (day, vaccine_id, status), count in daily.items()
+        ],
+        batch_size=1000,
+    )
+    PatientVaccinationFlag.objects.bulk_create(
+        [PatientVaccinationFlag(patient_id=patient_id, administered_count=n) for patient_id, n in flags.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vaccineapp', '0004_vaccine_age_groups_vaccineinventory_age_groups_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatisticCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('value', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='PatientVaccinationFlag',
+            fields=[
+                ('patient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='vaccination_flag', serialize=False, to='vaccineapp.patient')),
+                ('administered_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['administered_count'], name='vaccineapp__adminis_e3dde9_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyVaccinationCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('status', models.CharField(choices=[('scheduled', 'Scheduled'), ('administered', 'Administered'), ('missed', 'Missed'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('count', models.IntegerField(default=0)),
+                ('vaccine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_counts', to='vaccineapp.vaccine')),
+            ],
+            options={
+                'ordering': ['-day'],
+                'unique_together': {('day', 'vaccine', 'status')},
+            },
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def mark_deducted_stock(apps, schema_editor):
+    # Administered records have already taken their dose out of stock
+    VaccinationRecord = apps.get_model('vaccineapp', 'VaccinationRecord')
+    VaccinationRecord.objects.filter(status='administered', inventory_used__isnull=False).update(
+        stock_deducted_from=models.F('inventory_used')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vaccineapp', '0005_statistics_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vaccinationrecord',
+            name='stock_deducted_from',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='vaccineapp.vaccineinventory'),
+        ),
+        migrations.RunPython(mark_deducted_stock, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:08
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vaccineapp', '0006_vaccinationrecord_stock_deducted_from'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WastageRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lot_number', models.CharField(blank=True, max_length=100, null=True)),
+                ('doses', models.IntegerField(validators=[django.core.validators.MinValueValidator(1)])),
+                ('reason', models.CharField(choices=[('expired', 'Expired'), ('damaged', 'Damaged'), ('cold_chain', 'Cold Chain Failure'), ('other', 'Other')], default='expired', max_length=20)),
+                ('notes', models.TextField(blank=True, null=True)),
+                ('recorded_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-recorded_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='vaccineinventory',
+            name='is_usable',
+            field=models.BooleanField(default=True, help_text='Cleared when the lot is written off, e.g. after expiry'),
+        ),
+        migrations.AddIndex(
+            model_name='vaccineinventory',
+            index=models.Index(fields=['expiration_date'], name='inventory_expiry_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vaccineinventory',
+            index=models.Index(fields=['is_usable', 'expiration_date'], name='inventory_usable_expiry_idx'),
+        ),
+        migrations.AddField(
+            model_name='wastagerecord',
+            name='inventory',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='wastage_records', to='vaccineapp.vaccineinventory'),
+        ),
+        migrations.AddField(
+            model_name='wastagerecord',
+            name='vaccine',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='wastage_records', to='vaccineapp.vaccine'),
+        ),
+    ]
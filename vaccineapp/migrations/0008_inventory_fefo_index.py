@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vaccineapp', '0007_inventory_expiry_wastage'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='vaccineinventory',
+            index=models.Index(fields=['vaccine', 'is_usable', 'expiration_date'], name='inventory_fefo_idx'),
+        ),
+    ]
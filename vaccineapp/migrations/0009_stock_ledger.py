@@ -0,0 +1,58 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:12
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def open_ledger(apps, schema_editor):
+    # The ledger starts with the stock each lot holds when it is introduced
+    VaccineInventory = apps.get_model('vaccineapp', 'VaccineInventory')
+    StockMovement = apps.get_model('vaccineapp', 'StockMovement')
+    StockMovement.objects.bulk_create(
+        [
+            StockMovement(inventory_id=pk, kind='receipt', quantity=stock, notes='Opening balance')
+            for pk, stock in VaccineInventory.objects.exclude(current_stock=0).values_list('pk', 'current_stock').iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vaccineapp', '0008_inventory_fefo_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('receipt', 'Receipt'), ('administration', 'Administration'), ('adjustment', 'Adjustment'), ('wastage', 'Wastage'), ('transfer', 'Transfer')], max_length=20)),
+                ('quantity', models.IntegerField(help_text='Signed change in doses')),
+                ('notes', models.CharField(blank=True, max_length=200, null=True)),
+                ('occurred_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('inventory', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='vaccineapp.vaccineinventory')),
+                ('record', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='vaccineapp.vaccinationrecord')),
+            ],
+            options={
+                'ordering': ['-occurred_at', '-pk'],
+                'indexes': [models.Index(fields=['occurred_at'], name='movement_occurred_idx'), models.Index(fields=['inventory', 'occurred_at'], name='movement_inventory_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taken_at', models.DateTimeField()),
+                ('stock', models.IntegerField()),
+                ('inventory', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_snapshots', to='vaccineapp.vaccineinventory')),
+            ],
+            options={
+                'ordering': ['-taken_at'],
+                'unique_together': {('taken_at', 'inventory')},
+            },
+        ),
+        migrations.RunPython(open_ledger, migrations.RunPython.noop),
+    ]
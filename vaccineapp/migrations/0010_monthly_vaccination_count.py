@@ -0,0 +1,49 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:17
+
+from collections import Counter
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_monthly_counts(apps, schema_editor):
+    # Sum the existing daily rollup rows into calendar months
+    DailyVaccinationCount = apps.get_model('vaccineapp', 'DailyVaccinationCount')
+    MonthlyVaccinationCount = apps.get_model('vaccineapp', 'MonthlyVaccinationCount')
+    months = Counter()
+    for day, vaccine_id, status, count in DailyVaccinationCount.objects.values_list(
+        'day', 'vaccine_id', 'status', 'count'
+    ).iterator():
+        months[(day.replace(day=1), vaccine_id, status)] += count
+    MonthlyVaccinationCount.objects.bulk_create(
+        [
+            MonthlyVaccinationCount(month=month, vaccine_id=vaccine_id, status=status, count=count)
+            for (month, vaccine_id, status), count in months.items() if count
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vaccineapp', '0009_stock_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyVaccinationCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('status', models.CharField(choices=[('scheduled', 'Scheduled'), ('administered', 'Administered'), ('missed', 'Missed'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('count', models.IntegerField(default=0)),
+                ('vaccine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_counts', to='vaccineapp.vaccine')),
+            ],
+            options={
+                'ordering': ['-month'],
+                'unique_together': {('month', 'vaccine', 'status')},
+            },
+        ),
+        migrations.RunPython(fill_monthly_counts, migrations.RunPython.noop),
+    ]
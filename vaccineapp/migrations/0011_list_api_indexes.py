@@ -0,0 +1,47 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:24
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vaccineapp', '0010_monthly_vaccination_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['scheduled_date'], name='appointment_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['created_at'], name='appointment_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['user', 'created_at'], name='patient_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['user', 'last_name'], name='patient_user_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['user', 'date_of_birth'], name='patient_user_birth_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vaccinationrecord',
+            index=models.Index(fields=['date_administered'], name='record_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vaccinationrecord',
+            index=models.Index(fields=['created_at'], name='record_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vaccineinventory',
+            index=models.Index(fields=['updated_at'], name='inventory_updated_idx'),
+        ),
+    ]
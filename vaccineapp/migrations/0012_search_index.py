@@ -0,0 +1,68 @@
+from django.db import migrations
+
+TABLE = 'vaccineapp_search_index'
+KINDS = ('vaccine', 'lot', 'patient', 'record')
+
+
+def _join(*values):
+    return ' '.join(str(value) for value in values if value)
+
+
+def create_search_index(apps, schema_editor):
+    # The FTS5 index only exists on SQLite; other databases use the
+    # icontains search backend
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE {TABLE} USING fts5("
+        "owner_id UNINDEXED, title, body, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+
+    Vaccine = apps.get_model('vaccineapp', 'Vaccine')
+    VaccineInventory = apps.get_model('vaccineapp', 'VaccineInventory')
+    Patient = apps.get_model('vaccineapp', 'Patient')
+    VaccinationRecord = apps.get_model('vaccineapp', 'VaccinationRecord')
+    documents = {
+        'vaccine': (
+            (v.pk, None, _join(v.name, v.short_name), _join(v.target_diseases, v.manufacturer, v.description))
+            for v in Vaccine.objects.iterator()
+        ),
+        'lot': (
+            (l.pk, None, _join(l.vaccine_name, 'Lot', l.lot_number), _join(l.target_diseases, l.manufacturer, l.notes))
+            for l in VaccineInventory.objects.iterator()
+        ),
+        'patient': (
+            (p.pk, p.user_id, _join(p.first_name, p.last_name), _join(p.patient_email, p.patient_phone))
+            for p in Patient.objects.iterator()
+        ),
+        'record': (
+            (
+                r.pk, r.patient.user_id,
+                _join(r.vaccine.name, 'dose', r.dose_number, '-', r.patient.first_name, r.patient.last_name),
+                _join(r.notes, r.reaction_notes, r.lot_number, r.administered_by, r.administering_facility),
+            )
+            for r in VaccinationRecord.objects.select_related('patient', 'vaccine').iterator(chunk_size=2000)
+        ),
+    }
+    with schema_editor.connection.cursor() as cursor:
+        for kind, rows in documents.items():
+            cursor.executemany(
+                f'INSERT INTO {TABLE} (rowid, owner_id, title, body) VALUES (%s, %s, %s, %s)',
+                [(pk * len(KINDS) + KINDS.index(kind), owner_id, title, body) for pk, owner_id, title, body in rows],
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vaccineapp', '0011_list_api_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
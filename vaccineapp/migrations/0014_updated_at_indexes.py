@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vaccineapp', '0013_patient_birth_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['updated_at'], name='patient_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vaccinationrecord',
+            index=models.Index(fields=['updated_at'], name='record_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,88 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:42
+
+from collections import Counter
+
+from django.db import migrations, models
+
+
+def split_counts_by_reaction(apps, schema_editor):
+    # Existing rows lump every reaction under 'none'; recount from the records
+    VaccinationRecord = apps.get_model('vaccineapp', 'VaccinationRecord')
+    DailyVaccinationCount = apps.get_model('vaccineapp', 'DailyVaccinationCount')
+    MonthlyVaccinationCount = apps.get_model('vaccineapp', 'MonthlyVaccinationCount')
+    days, months = Counter(), Counter()
+    rows = VaccinationRecord.objects.order_by().values('date_administered', 'vaccine_id', 'status', 'reaction')
+    for row in rows.annotate(n=models.Count('pk')).iterator():
+        key = (row['vaccine_id'], row['status'], row['reaction'])
+        days[(row['date_administered'], *key)] += row['n']
+        months[(row['date_administered'].replace(day=1), *key)] += row['n']
+    DailyVaccinationCount.objects.all().delete()
+    MonthlyVaccinationCount.objects.all().delete()
+    DailyVaccinationCount.objects.bulk_create(
+        [
+            DailyVaccinationCount(day=day, vaccine_id=vaccine_id, status=status, reaction=reaction, count=count)
+            for (day, vaccine_id, status, reaction), count in days.items()
+        ],
+        batch_size=1000,
+    )
+    MonthlyVaccinationCount.objects.bulk_create(
+        [
+            MonthlyVaccinationCount(month=month, vaccine_id=vaccine_id, status=status, reaction=reaction, count=count)
+            for (month, vaccine_id, status, reaction), count in months.items()
+        ],
+        batch_size=1000,
+    )
+
+
+def merge_reactions(apps, schema_editor):
+    # The previous unique_together allows one row per day, vaccine and status
+    for name, period in (('DailyVaccinationCount', 'day'), ('MonthlyVaccinationCount', 'month')):
+        model = apps.get_model('vaccineapp', name)
+        totals = Counter()
+        for key_period, vaccine_id, status, count in model.objects.values_list(period, 'vaccine_id', 'status', 'count'):
+            totals[(key_period, vaccine_id, status)] += count
+        model.objects.all().delete()
+        model.objects.bulk_create(
+            [
+                model(**{period: key_period}, vaccine_id=vaccine_id, status=status, count=count)
+                for (key_period, vaccine_id, status), count in totals.items()
+            ],
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vaccineapp', '0014_updated_at_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='dailyvaccinationcount',
+            unique_together=set(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='monthlyvaccinationcount',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='dailyvaccinationcount',
+            name='reaction',
+            field=models.CharField(choices=[('none', 'No Reaction'), ('mild', 'Mild Reaction'), ('moderate', 'Moderate Reaction'), ('severe', 'Severe Reaction')], default='none', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='monthlyvaccinationcount',
+            name='reaction',
+            field=models.CharField(choices=[('none', 'No Reaction'), ('mild', 'Mild Reaction'), ('moderate', 'Moderate Reaction'), ('severe', 'Severe Reaction')], default='none', max_length=20),
+        ),
+        migrations.RunPython(split_counts_by_reaction, merge_reactions),
+        migrations.AlterUniqueTogether(
+            name='dailyvaccinationcount',
+            unique_together={('day', 'vaccine', 'status', 'reaction')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='monthlyvaccinationcount',
+            unique_together={('month', 'vaccine', 'status', 'reaction')},
+        ),
+    ]
@@ -1,11 +1,20 @@
 # models.py
-from django.db import models
+import logging
+
+from django.db import models, transaction
+from django.db.models import Case, Count, Exists, ExpressionWrapper, F, Max, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, NullIf
+from django.db.models.lookups import Exact, LessThanOrEqual
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
-from datetime import date
+from datetime import date, timedelta
 from django.utils import timezone
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
+from .signals import StockChange, lots_updated, rows_updated, stock_changed, stock_recounted
+
+logger = logging.getLogger(__name__)
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -39,6 +48,43 @@ class UserProfile(models.Model):
         return None
 
 
+class PatientQuerySet(models.QuerySet):
+    def with_vaccination_status(self):
+        """Annotate each patient's vaccination status in the same query
+        
+        ``dose_count`` and ``last_vaccination`` cover administered doses.
+        ``started_series`` counts vaccines with an administered dose and
+        ``completed_series`` those whose final dose was administered, with
+        ``series_completion`` the percentage (NULL before the first dose).
+        ``next_due_date`` is the earliest scheduled record or the
+        ``next_due_date`` of the latest dose of an unfinished series.
+        """
+        administered = Q(vaccination_records__status='administered')
+        completing = administered & Q(vaccination_records__dose_number__gte=F('vaccination_records__total_doses'))
+        later_dose = VaccinationRecord.objects.filter(
+            patient_id=OuterRef('patient_id'),
+            vaccine_id=OuterRef('vaccine_id'),
+            status='administered',
+            dose_number__gt=OuterRef('dose_number'),
+        )
+        due = VaccinationRecord.objects.filter(patient_id=OuterRef('pk')).filter(
+            Q(status='scheduled')
+            | Q(status='administered', next_due_date__isnull=False, dose_number__lt=F('total_doses')) & ~Exists(later_dose)
+        ).annotate(
+            due=Case(When(status='scheduled', then=F('date_administered')), default=F('next_due_date'))
+        ).order_by('due').values('due')[:1]
+        return self.annotate(
+            dose_count=Count('vaccination_records', filter=administered),
+            last_vaccination=Max('vaccination_records__date_administered', filter=administered),
+            started_series=Count('vaccination_records__vaccine', filter=administered, distinct=True),
+            completed_series=Count('vaccination_records__vaccine', filter=completing, distinct=True),
+            series_completion=ExpressionWrapper(
+                F('completed_series') * 100.0 / NullIf(F('started_series'), 0), output_field=models.FloatField()
+            ),
+            next_due_date=Subquery(due, output_field=models.DateField()),
+        )
+
+
 class Patient(models.Model):
     GENDER_CHOICES = [
         ('M', 'Male'),
@@ -80,8 +126,20 @@ class Patient(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = PatientQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-created_at']
+        # Sort columns of the patient list API, within one user's patients
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='patient_user_created_idx'),
+            models.Index(fields=['user', 'last_name'], name='patient_user_name_idx'),
+            models.Index(fields=['user', 'date_of_birth'], name='patient_user_birth_idx'),
+            # Age cohorts over every patient are birth-date ranges
+            models.Index(fields=['date_of_birth'], name='patient_birth_idx'),
+            # Incremental refresh of the coverage matrix
+            models.Index(fields=['updated_at'], name='patient_updated_idx'),
+        ]
     
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
@@ -147,6 +205,294 @@ class Vaccine(models.Model):
     def get_administered_count(self):
         """Get total number of times this vaccine has been administered"""
         return VaccinationRecord.objects.filter(vaccine=self, status='administered').count()
+    
+    def push_catalog_to_inventory(self, fields=None):
+        """Copy catalog fields to every lot of this vaccine with a single UPDATE
+
+        ``fields`` limits the copy to those inventory fields (see
+        INVENTORY_CATALOG_FIELDS). Returns the number of lots updated.
+        """
+        fields = INVENTORY_CATALOG_FIELDS if fields is None else fields
+        if not fields:
+            return 0
+        updated = self.inventory.update_lots(
+            **{field: getattr(self, INVENTORY_CATALOG_FIELDS[field]) for field in fields}
+        )
+        if updated:
+            lots_updated.send(sender=VaccineInventory, lots=self.inventory.all(), fields=list(fields))
+        return updated
+
+
+class InsufficientStock(ValidationError):
+    """Raised when a lot has fewer doses left than an adjustment takes out"""
+
+
+def stock_status(current_stock, min_stock_level):
+    """Stock status for the given levels (mirrors stock_status_expression)"""
+    if current_stock <= 0:
+        return 'out_of_stock'
+    if current_stock * 5 <= min_stock_level:  # at most 20% of the minimum
+        return 'critical'
+    if current_stock * 2 <= min_stock_level:  # at most 50% of the minimum
+        return 'low_stock'
+    return 'in_stock'
+
+
+# Expiry windows in days reported by VaccineInventoryQuerySet.expiry_windows()
+EXPIRY_WINDOWS = (7, 30, 90)
+
+# Inventory fields copied from the linked Vaccine: {inventory field: vaccine field}
+INVENTORY_CATALOG_FIELDS = {
+    'vaccine_name': 'name',
+    'vaccine_type': 'vaccine_type',
+    'target_diseases': 'target_diseases',
+    'age_groups': 'age_groups',
+    'storage_temperature': 'storage_temperature',
+    'manufacturer': 'manufacturer',
+}
+
+
+def _as_expression(value):
+    return value if hasattr(value, 'resolve_expression') else Value(value)
+
+
+def stock_status_expression(stock=F('current_stock'), minimum=F('min_stock_level')):
+    """Database expression computing the stock status from ``stock`` and ``minimum``
+
+    Pass the new values as expressions when updating them in the same
+    statement, because SQL evaluates the right-hand side against the old row.
+    """
+    return Case(
+        When(LessThanOrEqual(stock, 0), then=Value('out_of_stock')),
+        When(LessThanOrEqual(stock * 5, minimum), then=Value('critical')),
+        When(LessThanOrEqual(stock * 2, minimum), then=Value('low_stock')),
+        default=Value('in_stock'),
+        output_field=models.CharField(),
+    )
+
+
+class VaccineInventoryQuerySet(models.QuerySet):
+    BULK_ADJUSTABLE_FIELDS = (
+        'current_stock', 'min_stock_level', 'expiration_date', 'storage_temperature', 'lot_number', 'notes',
+    )
+    BULK_ADJUST_CHUNK_SIZE = 500
+    
+    def update_lots(self, **kwargs):
+        """Update the lots with a single UPDATE, recomputing ``status`` in it
+        
+        Changing ``current_stock`` or ``min_stock_level`` without passing
+        ``status`` derives the status from the new values in SQL, so bulk
+        updates can never leave a stale status behind. ``updated_at`` is
+        stamped like ``save()`` would, so it can serve as a validator for API
+        responses. Nothing is read or reported: callers that move stock send
+        ``stock_changed`` with the old and new values (see adjust_stock() and
+        bulk_adjust()), callers that only change statuses send
+        ``stock_recounted``.
+        """
+        kwargs.setdefault('updated_at', timezone.now())
+        if 'status' not in kwargs and kwargs.keys() & {'current_stock', 'min_stock_level'}:
+            kwargs['status'] = stock_status_expression(
+                _as_expression(kwargs.get('current_stock', F('current_stock'))),
+                _as_expression(kwargs.get('min_stock_level', F('min_stock_level'))),
+            )
+        return self.update(**kwargs)
+    
+    def with_computed_status(self):
+        """Annotate each lot with ``computed_status``, derived from its stock in SQL"""
+        return self.annotate(computed_status=stock_status_expression())
+    
+    def stale_status(self):
+        """Lots whose stored status disagrees with their stock levels"""
+        return self.exclude(status=stock_status_expression())
+    
+    def refresh_status(self):
+        """Re-derive the status of every stale lot with a single UPDATE
+        
+        The lots per status change, so the rollups are told to recount.
+        """
+        updated = self.stale_status().update_lots(status=stock_status_expression())
+        if updated:
+            stock_recounted.send(sender=self.model)
+        return updated
+    
+    def catalog_drift(self):
+        """Lots whose copied catalog fields disagree with their vaccine
+
+        Empty and missing values compare equal.
+        """
+        differs = Q()
+        for field, source in INVENTORY_CATALOG_FIELDS.items():
+            differs |= ~Q(Exact(Coalesce(field, Value('')), Coalesce(f'vaccine__{source}', Value(''))))
+        return self.filter(vaccine__isnull=False).filter(differs)
+    
+    def sync_catalog(self):
+        """Copy the catalog fields of every drifted lot from its vaccine with a single UPDATE"""
+        # The drifted lots no longer match catalog_drift() once updated, so
+        # their ids are read first to tell lots_updated receivers
+        pks = list(self.catalog_drift().values_list('pk', flat=True))
+        if not pks:
+            return 0
+        lots = self.model.objects.filter(pk__in=pks)
+        vaccine = Vaccine.objects.filter(pk=OuterRef('vaccine_id'))
+        updated = lots.update_lots(
+            **{field: Subquery(vaccine.values(source)[:1]) for field, source in INVENTORY_CATALOG_FIELDS.items()}
+        )
+        lots_updated.send(sender=self.model, lots=lots, fields=list(INVENTORY_CATALOG_FIELDS))
+        return updated
+    
+    def transfer_stock(self, source_pk, destination_pk, quantity):
+        """Move ``quantity`` doses from one lot to another in one transaction"""
+        if quantity <= 0:
+            raise ValidationError("The quantity to transfer must be positive.")
+        with transaction.atomic(using=self.db):
+            self.adjust_stock(source_pk, -quantity, reason='transfer')
+            return self.adjust_stock(destination_pk, quantity, reason='transfer')
+    
+    def expired(self, today=None):
+        """Lots past their expiration date"""
+        today = today or timezone.now().date()
+        return self.filter(expiration_date__lt=today)
+    
+    def expiring_within(self, days, today=None):
+        """Lots expiring between today and ``days`` days from now, inclusive"""
+        today = today or timezone.now().date()
+        return self.filter(expiration_date__gte=today, expiration_date__lte=today + timedelta(days=days))
+    
+    def expiry_windows(self, today=None):
+        """Lot and dose counts per expiry window in one indexed range query
+        
+        Only rows up to the widest window are read, through the index on
+        expiration_date. Windows are cumulative and exclude expired lots.
+        """
+        today = today or timezone.now().date()
+        aggregates = {
+            'expired_lots': Count('pk', filter=Q(expiration_date__lt=today)),
+            'expired_doses': Coalesce(Sum('current_stock', filter=Q(expiration_date__lt=today)), 0),
+        }
+        for days in EXPIRY_WINDOWS:
+            window = Q(expiration_date__gte=today, expiration_date__lte=today + timedelta(days=days))
+            aggregates[f'within_{days}_days_lots'] = Count('pk', filter=window)
+            aggregates[f'within_{days}_days_doses'] = Coalesce(Sum('current_stock', filter=window), 0)
+        horizon = today + timedelta(days=max(EXPIRY_WINDOWS))
+        return self.filter(expiration_date__lte=horizon).order_by().aggregate(**aggregates)
+    
+    def write_off(self, reason='expired', notes=None):
+        """Record the remaining stock of these lots as wastage and retire them
+        
+        Usable lots are locked, their doses copied into WastageRecord rows,
+        and they are zeroed and marked unusable with one UPDATE. Returns
+        ``(lots, doses)`` written off.
+        """
+        with transaction.atomic(using=self.db):
+            lots = list(self.select_for_update().filter(is_usable=True).order_by().values_list(
+                'pk', 'vaccine_id', 'lot_number', 'current_stock', 'status'
+            ))
+            if not lots:
+                return 0, 0
+            WastageRecord.objects.bulk_create([
+                WastageRecord(inventory_id=pk, vaccine_id=vaccine_id, lot_number=lot_number, doses=stock, reason=reason, notes=notes)
+                for pk, vaccine_id, lot_number, stock, _ in lots if stock > 0
+            ])
+            self.model.objects.filter(pk__in=[lot[0] for lot in lots]).update_lots(
+                is_usable=False,
+                current_stock=0,
+                status='out_of_stock',
+            )
+            stock_changed.send(
+                sender=self.model,
+                changes=[StockChange(pk, stock, 0, status, 'out_of_stock') for pk, _, _, stock, status in lots],
+                reason='wastage',
+                record=None,
+            )
+        return len(lots), sum(lot[3] for lot in lots)
+    
+    def adjust_stock(self, pk, delta, reason='adjustment', record=None):
+        """Atomically add ``delta`` to a lot's stock and recompute its status
+
+        The change is a single conditional UPDATE, so concurrent adjustments
+        never lose updates and stock never drops below zero. Returns the new
+        stock level. Raises InsufficientStock (a ValidationError) when there
+        is not enough stock and VaccineInventory.DoesNotExist when the lot is
+        gone.
+        """
+        with transaction.atomic(using=self.db):
+            new_stock = F('current_stock') + delta
+            updated = self.filter(pk=pk, current_stock__gte=max(-delta, 0)).update_lots(current_stock=new_stock)
+            row = self.filter(pk=pk).values_list('current_stock', 'min_stock_level', 'status').first()
+            if row is None:
+                raise self.model.DoesNotExist(f"Vaccine inventory {pk} does not exist.")
+            if not updated:
+                raise InsufficientStock(f"Not enough stock in vaccine inventory {pk} ({row[0]} doses left).")
+            
+            current_stock, min_stock_level, status = row
+            old_stock = current_stock - delta
+            stock_changed.send(
+                sender=self.model,
+                changes=[StockChange(pk, old_stock, current_stock, stock_status(old_stock, min_stock_level), status)],
+                reason=reason,
+                record=record,
+            )
+        return current_stock
+    
+    def bulk_adjust(self, changes, reason='adjustment', records=None):
+        """Apply many lot changes in one transaction with set-based UPDATEs
+        
+        ``changes`` maps lot ids to ``{field: value}`` dictionaries using
+        BULK_ADJUSTABLE_FIELDS, where ``delta`` may replace ``current_stock``.
+        The lots are read and locked once, then each chunk of lots is written
+        by a single UPDATE with one CASE per field, status included. Returns
+        ``{pk: StockChange}`` for applied changes and ``{pk: message}`` for
+        lots that were missing or would go below zero. ``records`` is passed
+        on with ``stock_changed`` (see vaccineapp.signals).
+        """
+        results = {}
+        with transaction.atomic(using=self.db):
+            current = {
+                pk: (stock, minimum, status)
+                for pk, stock, minimum, status in self.select_for_update().filter(pk__in=changes).values_list(
+                    'pk', 'current_stock', 'min_stock_level', 'status'
+                )
+            }
+            applied = {}
+            for pk, change in changes.items():
+                if pk not in current:
+                    results[pk] = f"Vaccine inventory {pk} does not exist."
+                    continue
+                old_stock, minimum, old_status = current[pk]
+                change = dict(change)
+                if 'delta' in change:
+                    change['current_stock'] = old_stock + change.pop('delta')
+                new_stock = change.get('current_stock', old_stock)
+                if new_stock < 0:
+                    results[pk] = f"Not enough stock in vaccine inventory {pk} ({old_stock} doses left)."
+                    continue
+                # The rows are locked, so the new status can be computed here
+                change['status'] = stock_status(new_stock, change.get('min_stock_level', minimum))
+                applied[pk] = change
+                results[pk] = StockChange(pk, old_stock, new_stock, old_status, change['status'])
+            
+            pks = list(applied)
+            for start in range(0, len(pks), self.BULK_ADJUST_CHUNK_SIZE):
+                chunk = pks[start:start + self.BULK_ADJUST_CHUNK_SIZE]
+                values = {}
+                for name in (*self.BULK_ADJUSTABLE_FIELDS, 'status'):
+                    whens = [When(pk=pk, then=Value(applied[pk][name])) for pk in chunk if name in applied[pk]]
+                    if whens:
+                        values[name] = Case(*whens, default=F(name), output_field=self.model._meta.get_field(name))
+                self.filter(pk__in=chunk).update_lots(**values)
+            
+            edited = {name for change in applied.values() for name in change} - {'current_stock', 'min_stock_level', 'status'}
+            if edited:
+                lots_updated.send(sender=self.model, lots=self.model.objects.filter(pk__in=pks), fields=sorted(edited))
+            
+            moved = [
+                change for change in results.values()
+                if isinstance(change, StockChange)
+                and (change.old_stock != change.new_stock or change.old_status != change.new_status)
+            ]
+            if moved:
+                stock_changed.send(sender=self.model, changes=moved, reason=reason, record=None, records=records)
+        return results
 
 
 class VaccineInventory(models.Model):
@@ -182,6 +528,7 @@ class VaccineInventory(models.Model):
     
     # Status
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='in_stock')
+    is_usable = models.BooleanField(default=True, help_text="Cleared when the lot is written off, e.g. after expiry")
     
     # Additional Information
     notes = models.TextField(blank=True, null=True)
@@ -189,9 +536,17 @@ class VaccineInventory(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = VaccineInventoryQuerySet.as_manager()
+    
     class Meta:
         ordering = ['vaccine__name', 'expiration_date']
         verbose_name_plural = "Vaccine Inventories"
+        indexes = [
+            models.Index(fields=['expiration_date'], name='inventory_expiry_idx'),
+            models.Index(fields=['is_usable', 'expiration_date'], name='inventory_usable_expiry_idx'),
+            models.Index(fields=['vaccine', 'is_usable', 'expiration_date'], name='inventory_fefo_idx'),
+            models.Index(fields=['updated_at'], name='inventory_updated_idx'),
+        ]
     
     def __str__(self):
         if self.vaccine:
@@ -201,25 +556,13 @@ class VaccineInventory(models.Model):
     def save(self, *args, **kwargs):
         # Auto-update status based on stock levels
         if self.min_stock_level > 0:
-            stock_percentage = (self.current_stock / self.min_stock_level) * 100
-            
-            if self.current_stock == 0:
-                self.status = 'out_of_stock'
-            elif stock_percentage <= 20:
-                self.status = 'critical'
-            elif stock_percentage <= 50:
-                self.status = 'low_stock'
-            else:
-                self.status = 'in_stock'
+            self.status = stock_status(self.current_stock, self.min_stock_level)
         
-        # If vaccine is linked, copy some information
+        # If vaccine is linked, copy some information; later catalog edits
+        # reach the lot through Vaccine.push_catalog_to_inventory()
         if self.vaccine and not self.vaccine_name:
-            self.vaccine_name = self.vaccine.name
-            self.vaccine_type = self.vaccine.vaccine_type
-            self.target_diseases = self.vaccine.target_diseases
-            self.age_groups = self.vaccine.age_groups
-            self.storage_temperature = self.vaccine.storage_temperature
-            self.manufacturer = self.vaccine.manufacturer
+            for field, source in INVENTORY_CATALOG_FIELDS.items():
+                setattr(self, field, getattr(self.vaccine, source))
         
         super().save(*args, **kwargs)
     
@@ -241,6 +584,85 @@ class VaccineInventory(models.Model):
         return self.vaccine.name if self.vaccine else self.vaccine_name
 
 
+class WastageRecord(models.Model):
+    REASON_CHOICES = [
+        ('expired', 'Expired'),
+        ('damaged', 'Damaged'),
+        ('cold_chain', 'Cold Chain Failure'),
+        ('other', 'Other'),
+    ]
+    
+    # Lot and vaccine are kept nullable so wastage history survives their deletion
+    inventory = models.ForeignKey(VaccineInventory, on_delete=models.SET_NULL, null=True, blank=True, related_name='wastage_records')
+    vaccine = models.ForeignKey(Vaccine, on_delete=models.SET_NULL, null=True, blank=True, related_name='wastage_records')
+    lot_number = models.CharField(max_length=100, blank=True, null=True)
+    doses = models.IntegerField(validators=[MinValueValidator(1)])
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES, default='expired')
+    notes = models.TextField(blank=True, null=True)
+    
+    recorded_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-recorded_at']
+    
+    def __str__(self):
+        return f"{self.doses} doses of lot {self.lot_number} ({self.get_reason_display()})"
+
+
+class VaccinationRecordQuerySet(models.QuerySet):
+    UPDATE_CHUNK_SIZE = 500
+    
+    def set_status(self, status):
+        """Move these records to ``status`` with set-based UPDATEs
+        
+        Records entering 'administered' take a dose from ``inventory_used``
+        and records leaving it put theirs back, with one bulk_adjust() over
+        all the lots involved. Records whose lot is missing or cannot cover
+        all of its doses keep their status. Rollups are told through
+        ``rows_updated``.
+        Returns ``(updated, skipped)`` record counts.
+        """
+        with transaction.atomic(using=self.db):
+            rows = list(self.select_for_update().exclude(status=status).order_by().values_list(
+                'pk', 'status', 'date_administered', 'vaccine_id', 'patient_id', 'reaction',
+                'inventory_used_id', 'stock_deducted_from_id'
+            ))
+            deltas = {}
+            for pk, _, _, _, _, _, inventory_used, deducted in rows:
+                target = inventory_used if status == 'administered' else None
+                if target == deducted:
+                    continue
+                if deducted:
+                    deltas[deducted] = deltas.get(deducted, 0) + 1
+                if target:
+                    deltas[target] = deltas.get(target, 0) - 1
+            
+            failed = set()
+            if deltas:
+                reason = 'administration' if status == 'administered' else 'reversal'
+                results = VaccineInventory.objects.bulk_adjust(
+                    {pk: {'delta': delta} for pk, delta in deltas.items()}, reason=reason
+                )
+                # A dose put back into a deleted lot is dropped, as in restore_deducted_stock()
+                failed = {pk for pk, result in results.items() if not isinstance(result, StockChange) and deltas[pk] < 0}
+            
+            skipped = {row[0] for row in rows if status == 'administered' and row[6] in failed and row[6] != row[7]}
+            rows = [row for row in rows if row[0] not in skipped]
+            pks = [row[0] for row in rows]
+            for start in range(0, len(pks), self.UPDATE_CHUNK_SIZE):
+                self.model.objects.filter(pk__in=pks[start:start + self.UPDATE_CHUNK_SIZE]).update(
+                    status=status,
+                    stock_deducted_from=F('inventory_used') if status == 'administered' else None,
+                    updated_at=timezone.now(),
+                )
+            if rows:
+                rows_updated.send(sender=self.model, changes=[
+                    ((old_status, day, vaccine_id, patient_id, reaction), (status, day, vaccine_id, patient_id, reaction))
+                    for _, old_status, day, vaccine_id, patient_id, reaction, _, _ in rows
+                ])
+        return len(rows), len(skipped)
+
+
 class VaccinationRecord(models.Model):
     STATUS_CHOICES = [
         ('scheduled', 'Scheduled'),
@@ -259,6 +681,8 @@ class VaccinationRecord(models.Model):
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='vaccination_records')
     vaccine = models.ForeignKey(Vaccine, on_delete=models.CASCADE, related_name='vaccination_records')
     inventory_used = models.ForeignKey(VaccineInventory, on_delete=models.SET_NULL, null=True, blank=True, related_name='vaccination_records')
+    # Lot this record's dose has been taken out of, so stock moves exactly once
+    stock_deducted_from = models.ForeignKey(VaccineInventory, on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='+')
     
     # Dose Information
     dose_number = models.IntegerField(default=1, help_text="Which dose in the series")
@@ -285,21 +709,93 @@ class VaccinationRecord(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = VaccinationRecordQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-date_administered']
         unique_together = ['patient', 'vaccine', 'dose_number']
+        indexes = [
+            models.Index(fields=['date_administered'], name='record_date_idx'),
+            models.Index(fields=['created_at'], name='record_created_idx'),
+            models.Index(fields=['updated_at'], name='record_updated_idx'),
+        ]
     
     def __str__(self):
         return f"{self.patient} - {self.vaccine} (Dose {self.dose_number})"
     
     def save(self, *args, **kwargs):
-        # Update inventory stock when vaccine is administered
-        if self.status == 'administered' and self.inventory_used:
-            if self.inventory_used.current_stock > 0:
-                self.inventory_used.current_stock -= 1
-                self.inventory_used.save()
+        with transaction.atomic():
+            if self._state.adding:
+                # Insert first so stock movements can reference the new record
+                super().save(*args, **kwargs)
+                try:
+                    changed = self.sync_stock(adding=True)
+                except Exception:
+                    # The insert is rolled back with the transaction
+                    self.pk, self._state.adding = None, True
+                    raise
+                if changed:
+                    VaccinationRecord.objects.filter(pk=self.pk).update(stock_deducted_from=self.stock_deducted_from_id)
+                return
+            
+            self.sync_stock()
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'stock_deducted_from'}
+            super().save(*args, **kwargs)
+    
+    def clean(self):
+        super().clean()
+        if self.status != 'administered' or not self.inventory_used_id:
+            return
+        if self.inventory_used_id == self.stock_deducted_from_id:
+            return
+        lot = VaccineInventory.objects.filter(pk=self.inventory_used_id).values('current_stock', 'is_usable').first()
+        if lot and not lot['is_usable']:
+            raise ValidationError({'inventory_used': "This inventory lot has been written off."})
+        if lot and lot['current_stock'] <= 0:
+            raise ValidationError({'inventory_used': "This inventory lot is out of stock."})
+    
+    def sync_stock(self, adding=False):
+        """Take a dose out of ``inventory_used`` when entering 'administered'
         
-        super().save(*args, **kwargs)
+        The lot a dose was taken from is stored in ``stock_deducted_from`` and
+        read back under a row lock, so repeated saves never deduct twice.
+        Leaving 'administered' (or switching lots) puts the dose back. A dose
+        already taken out by vaccineapp.allocation is not deducted again.
+        
+        A lot without stock is left alone and the save goes ahead, as it did
+        before decrements were atomic: clean() is what refuses empty lots.
+        The skip is logged and ``stock_deducted_from`` stays empty, so a later
+        save takes the dose once the lot is restocked. vaccineapp.allocation
+        sets ``_stock_required`` to get InsufficientStock raised instead.
+        Returns True when ``stock_deducted_from`` changed.
+        """
+        preallocated = self.__dict__.pop('_stock_preallocated', None)
+        required = self.__dict__.pop('_stock_required', False)
+        deducted = None
+        if not adding:
+            deducted = VaccinationRecord.objects.select_for_update().filter(pk=self.pk).values_list(
+                'stock_deducted_from', flat=True
+            ).first()
+        target = self.inventory_used_id if self.status == 'administered' else None
+        if target == deducted:
+            return False
+        
+        if deducted:
+            restore_deducted_stock(deducted, self)
+        if target and target != preallocated:
+            try:
+                VaccineInventory.objects.adjust_stock(target, -1, reason='administration', record=self)
+            except InsufficientStock:
+                if required:
+                    raise
+                logger.warning("No dose deducted for vaccination record %s: inventory %s is out of stock", self.pk, target)
+                target = None
+        if target == deducted:
+            return False
+        self.stock_deducted_from_id = target
+        return True
     
     def is_complete(self):
         return self.dose_number >= self.total_doses
@@ -310,6 +806,28 @@ class VaccinationRecord(models.Model):
         return False
 
 
+class AppointmentQuerySet(models.QuerySet):
+    UPDATE_CHUNK_SIZE = 500
+    
+    def set_status(self, status):
+        """Move these appointments to ``status`` with set-based UPDATEs
+        
+        Rollups are told through ``rows_updated``. Returns ``(updated,
+        skipped)`` appointment counts, like VaccinationRecord's set_status();
+        no appointment is ever skipped.
+        """
+        with transaction.atomic(using=self.db):
+            rows = list(self.select_for_update().exclude(status=status).order_by().values_list('pk', 'status'))
+            pks = [pk for pk, _ in rows]
+            for start in range(0, len(pks), self.UPDATE_CHUNK_SIZE):
+                self.model.objects.filter(pk__in=pks[start:start + self.UPDATE_CHUNK_SIZE]).update(
+                    status=status, updated_at=timezone.now()
+                )
+            if rows:
+                rows_updated.send(sender=self.model, changes=[(old_status, status) for _, old_status in rows])
+        return len(rows), 0
+
+
 class Appointment(models.Model):
     APPOINTMENT_STATUS = [
         ('scheduled', 'Scheduled'),
@@ -355,8 +873,14 @@ class Appointment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = AppointmentQuerySet.as_manager()
+    
     class Meta:
         ordering = ['scheduled_date']
+        indexes = [
+            models.Index(fields=['scheduled_date'], name='appointment_date_idx'),
+            models.Index(fields=['created_at'], name='appointment_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.patient} - {self.appointment_type} - {self.scheduled_date.strftime('%Y-%m-%d %H:%M')}"
@@ -368,7 +892,167 @@ class Appointment(models.Model):
         return self.status in ['scheduled', 'confirmed'] and self.scheduled_date < timezone.now()
 
 
+# Stock Ledger
+# Every change to VaccineInventory.current_stock is appended to StockMovement
+# by vaccineapp.ledger. StockSnapshot holds the stock of every lot at the end
+# of each snapshot period, so stock at any moment is the latest snapshot plus
+# the movements since, without summing the whole ledger.
+
+class StockMovement(models.Model):
+    KIND_CHOICES = [
+        ('receipt', 'Receipt'),
+        ('administration', 'Administration'),
+        ('adjustment', 'Adjustment'),
+        ('wastage', 'Wastage'),
+        ('transfer', 'Transfer'),
+    ]
+    
+    inventory = models.ForeignKey(VaccineInventory, on_delete=models.CASCADE, related_name='stock_movements')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    quantity = models.IntegerField(help_text="Signed change in doses")
+    record = models.ForeignKey('VaccinationRecord', on_delete=models.SET_NULL, null=True, blank=True, related_name='stock_movements')
+    notes = models.CharField(max_length=200, blank=True, null=True)
+    
+    occurred_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['-occurred_at', '-pk']
+        indexes = [
+            models.Index(fields=['occurred_at'], name='movement_occurred_idx'),
+            models.Index(fields=['inventory', 'occurred_at'], name='movement_inventory_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_kind_display()} of {self.quantity:+d} doses for lot {self.inventory_id}"
+
+
+class StockSnapshot(models.Model):
+    # Lots with no stock at ``taken_at`` have no row in that snapshot
+    inventory = models.ForeignKey(VaccineInventory, on_delete=models.CASCADE, related_name='stock_snapshots')
+    taken_at = models.DateTimeField()
+    stock = models.IntegerField()
+    
+    class Meta:
+        ordering = ['-taken_at']
+        unique_together = ['taken_at', 'inventory']
+    
+    def __str__(self):
+        return f"Lot {self.inventory_id}: {self.stock} doses at {self.taken_at}"
+
+
+# Statistics Rollups
+# These tables are maintained incrementally by vaccineapp.rollups and can be
+# rebuilt from the raw tables with ``python manage.py rebuild_rollups``.
+
+class StatisticCounter(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    value = models.BigIntegerField(default=0)
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['name']
+    
+    def __str__(self):
+        return f"{self.name} = {self.value}"
+
+
+class DailyVaccinationCount(models.Model):
+    day = models.DateField()
+    vaccine = models.ForeignKey(Vaccine, on_delete=models.CASCADE, related_name='daily_counts')
+    status = models.CharField(max_length=20, choices=VaccinationRecord.STATUS_CHOICES)
+    reaction = models.CharField(max_length=20, choices=VaccinationRecord.REACTION_CHOICES, default='none')
+    count = models.IntegerField(default=0)
+    
+    class Meta:
+        ordering = ['-day']
+        unique_together = ['day', 'vaccine', 'status', 'reaction']
+    
+    def __str__(self):
+        return f"{self.day} - {self.vaccine} ({self.status}, {self.reaction}): {self.count}"
+
+
+class MonthlyVaccinationCount(models.Model):
+    # Same counts as DailyVaccinationCount, summed per calendar month so that
+    # years of history can be read without scanning every daily row
+    month = models.DateField()  # first day of the month
+    vaccine = models.ForeignKey(Vaccine, on_delete=models.CASCADE, related_name='monthly_counts')
+    status = models.CharField(max_length=20, choices=VaccinationRecord.STATUS_CHOICES)
+    reaction = models.CharField(max_length=20, choices=VaccinationRecord.REACTION_CHOICES, default='none')
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['-month']
+        unique_together = ['month', 'vaccine', 'status', 'reaction']
+
+    def __str__(self):
+        return f"{self.month:%Y-%m} - {self.vaccine} ({self.status}, {self.reaction}): {self.count}"
+
+
+class PatientVaccinationFlag(models.Model):
+    patient = models.OneToOneField(Patient, on_delete=models.CASCADE, primary_key=True, related_name='vaccination_flag')
+    administered_count = models.IntegerField(default=0)
+    
+    class Meta:
+        indexes = [models.Index(fields=['administered_count'])]
+    
+    def __str__(self):
+        return f"{self.patient} - {self.administered_count} administered"
+    
+    def has_been_vaccinated(self):
+        return self.administered_count > 0
+
+
+def restore_deducted_stock(inventory_id, record):
+    """Put a record's dose back into its lot, unless the lot has been deleted"""
+    try:
+        VaccineInventory.objects.adjust_stock(inventory_id, 1, reason='reversal', record=record)
+    except VaccineInventory.DoesNotExist:
+        pass
+
+
 # Signal Handlers
+@receiver(pre_save, sender=Vaccine)
+def remember_catalog_values(sender, instance, raw=False, **kwargs):
+    """Remember the stored catalog values so post_save can push only the changes"""
+    instance._catalog_before = None
+    if instance.pk and not raw:
+        instance._catalog_before = Vaccine.objects.filter(pk=instance.pk).values(
+            *INVENTORY_CATALOG_FIELDS.values()
+        ).first()
+
+@receiver(post_save, sender=Vaccine)
+def propagate_catalog_changes(sender, instance, created, raw=False, **kwargs):
+    """Copy edited catalog fields to the vaccine's existing lots"""
+    before = getattr(instance, '_catalog_before', None)
+    if created or raw or before is None:
+        return
+    changed = [
+        field for field, source in INVENTORY_CATALOG_FIELDS.items()
+        if before[source] != getattr(instance, source)
+    ]
+    instance.push_catalog_to_inventory(changed)
+
+@receiver(pre_save, sender=VaccineInventory)
+def remember_stored_stock(sender, instance, raw=False, **kwargs):
+    """Remember the stored ``(status, current_stock)`` of a lot being saved
+    
+    Read once here for the post_save receivers of both the rollups and the
+    stock ledger.
+    """
+    instance._stored_stock = None
+    if instance.pk and not raw:
+        instance._stored_stock = VaccineInventory.objects.filter(pk=instance.pk).values_list(
+            'status', 'current_stock'
+        ).first()
+
+@receiver(post_delete, sender=VaccinationRecord)
+def restore_stock_on_delete(sender, instance, **kwargs):
+    """Return the dose of a deleted administered record to its lot"""
+    if instance.stock_deducted_from_id:
+        # The record is gone, so the reversal cannot reference it
+        restore_deducted_stock(instance.stock_deducted_from_id, None)
+
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     """Create UserProfile when a new User is created"""
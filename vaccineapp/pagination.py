@@ -0,0 +1,133 @@
+import base64
+import json
+from dataclasses import dataclass
+from datetime import date, datetime
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Q
+
+# =============================================
+# KEYSET (CURSOR) PAGINATION
+# =============================================
+# A page is the next ``page_size`` rows after the sort key of the last row
+# the client has seen, so it is an index range scan whatever the depth,
+# unlike OFFSET which reads and discards every earlier row. The primary key
+# is always the last sort column, which makes the ordering total and pages
+# stable while rows are inserted or deleted.
+#
+# Cursors are opaque to clients: URL-safe base64 of the sort name and the
+# sort key values of the last row.
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class InvalidCursor(ValueError):
+    """Raised for a cursor that is malformed or belongs to another sort order"""
+
+
+@dataclass
+class KeysetPage:
+    items: list
+    next_cursor: str = None
+
+    @property
+    def has_more(self):
+        return self.next_cursor is not None
+
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, (date, datetime)) else value
+
+
+def encode_cursor(sort, values):
+    payload = json.dumps([sort, [_json_value(value) for value in values]], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort, model_fields):
+    """Return the sort key values in ``cursor``, checking it matches ``sort``
+
+    Each value is converted with ``to_python()`` of its model field in
+    ``model_fields``, so a value the field cannot hold is rejected here
+    instead of failing in the query.
+    """
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, values = json.loads(payload)
+    except (ValueError, TypeError):
+        raise InvalidCursor("Malformed cursor.")
+    if cursor_sort != sort or not isinstance(values, list) or len(values) != len(model_fields):
+        raise InvalidCursor("The cursor does not match the requested sort order.")
+    try:
+        return [field.to_python(value) for field, value in zip(model_fields, values)]
+    except (ValidationError, TypeError, ValueError):
+        raise InvalidCursor("Malformed cursor.")
+
+
+def parse_page_size(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """Clamp a ``page_size`` query parameter to ``1..maximum``"""
+    try:
+        return min(max(int(value), 1), maximum)
+    except (TypeError, ValueError):
+        return default
+
+
+def after_key(fields, values):
+    """Filter for the rows strictly after ``values`` in the ``fields`` ordering
+
+    ``fields`` is a list of ``(name, descending)``. The lexicographic
+    condition is ``f1 > v1 OR (f1 = v1 AND f2 > v2) ...``; the redundant
+    ``f1 >= v1`` in front lets the database use an index range on ``f1``.
+    """
+    (first, first_descending), first_value = fields[0], values[0]
+    bound = Q(**{f"{first}__{'lte' if first_descending else 'gte'}": first_value})
+    after = Q()
+    equal = Q()
+    for (name, descending), value in zip(fields, values):
+        after |= equal & Q(**{f"{name}__{'lt' if descending else 'gt'}": value})
+        equal &= Q(**{name: value})
+    return bound & after
+
+
+def keyset_page(queryset, sort, fields, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """Return the KeysetPage of ``queryset`` following ``cursor``
+
+    ``fields`` is the ordering as a list of ``(name, descending)`` without
+    the primary key, which is appended in the direction of the last field.
+    ``sort`` names the ordering inside cursors. Raises InvalidCursor.
+    """
+    fields = [*fields, ('pk', fields[-1][1] if fields else False)]
+    if cursor:
+        opts = queryset.model._meta
+        model_fields = [opts.pk if name == 'pk' else opts.get_field(name) for name, _ in fields]
+        queryset = queryset.filter(after_key(fields, decode_cursor(cursor, sort, model_fields)))
+    queryset = queryset.order_by(*[f"{'-' if descending else ''}{name}" for name, descending in fields])
+
+    items = list(queryset[:page_size + 1])
+    if len(items) <= page_size:
+        return KeysetPage(items)
+    items = items[:page_size]
+    last = items[-1]
+    return KeysetPage(items, encode_cursor(sort, [getattr(last, name) for name, _ in fields]))
+
+
+# =============================================
+# PAGE-NUMBER PAGINATION
+# =============================================
+
+class CountedPaginator(Paginator):
+    """Page-number paginator given its row count up front
+
+    For querysets whose COUNT would repeat expensive joins or annotations
+    when the count is available from a cheaper query.
+    """
+
+    def __init__(self, object_list, per_page, count, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self._count = count
+
+    @property
+    def count(self):
+        return self._count
@@ -0,0 +1,520 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, Exists, F, Max, Min, OuterRef, Q, Sum
+from django.db.models.functions import TruncMonth
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from .signals import rows_updated, stock_changed, stock_recounted
+from .models import (
+    Patient, VaccinationRecord, Appointment, VaccineInventory,
+    StatisticCounter, DailyVaccinationCount, MonthlyVaccinationCount, PatientVaccinationFlag,
+)
+
+# =============================================
+# STATISTICS ROLLUPS
+# =============================================
+# Counters are keyed by name:
+#   patients, patients_vaccinated
+#   records:<status>, records:<status>:vaccine:<vaccine_id>
+#   inventory:<status> (lot count), inventory:doses
+#   appointments:<status>
+# DailyVaccinationCount holds per-day, per-vaccine, per-status, per-reaction
+# record counts, MonthlyVaccinationCount the same counts per calendar month
+# and PatientVaccinationFlag the number of administered doses per patient.
+#
+# Deltas only ever create rows when they are positive, so cascading deletes
+# never resurrect rows for a vaccine or patient that is being removed.
+
+
+def counter_values(*names):
+    """Return ``{name: value}`` for the requested counters (missing ones are 0)"""
+    values = dict.fromkeys(names, 0)
+    values.update(StatisticCounter.objects.filter(name__in=names).values_list('name', 'value'))
+    return values
+
+
+def apply_counter_deltas(deltas):
+    """Add each ``{name: delta}`` to its counter"""
+    for name, delta in deltas.items():
+        if not delta:
+            continue
+        updated = StatisticCounter.objects.filter(name=name).update(value=F('value') + delta)
+        if not updated and delta > 0:
+            _, created = StatisticCounter.objects.get_or_create(name=name, defaults={'value': delta})
+            if not created:
+                StatisticCounter.objects.filter(name=name).update(value=F('value') + delta)
+
+
+def apply_daily_deltas(deltas):
+    """Add each ``{(day, vaccine_id, status, reaction): delta}`` to the daily rollup"""
+    for (day, vaccine_id, status, reaction), delta in deltas.items():
+        if not delta:
+            continue
+        rows = DailyVaccinationCount.objects.filter(day=day, vaccine_id=vaccine_id, status=status, reaction=reaction)
+        if not rows.update(count=F('count') + delta) and delta > 0:
+            DailyVaccinationCount.objects.create(day=day, vaccine_id=vaccine_id, status=status, reaction=reaction, count=delta)
+
+
+def monthly_deltas(daily):
+    """Fold ``{(day, vaccine_id, status, reaction): delta}`` into calendar months"""
+    months = Counter()
+    for (day, vaccine_id, status, reaction), delta in daily.items():
+        months[(day.replace(day=1), vaccine_id, status, reaction)] += delta
+    return months
+
+
+def apply_monthly_deltas(deltas):
+    """Add each ``{(month, vaccine_id, status, reaction): delta}`` to the monthly rollup"""
+    for (month, vaccine_id, status, reaction), delta in deltas.items():
+        if not delta:
+            continue
+        rows = MonthlyVaccinationCount.objects.filter(month=month, vaccine_id=vaccine_id, status=status, reaction=reaction)
+        if not rows.update(count=F('count') + delta) and delta > 0:
+            MonthlyVaccinationCount.objects.create(
+                month=month, vaccine_id=vaccine_id, status=status, reaction=reaction, count=delta
+            )
+
+
+# Patients whose flags are updated by one statement
+PATIENT_CHUNK_SIZE = 500
+
+
+def apply_patient_deltas(deltas):
+    """Add each ``{patient_id: delta}`` to the patient's administered dose count
+
+    Patients sharing a delta (usually +1 or -1) are updated together, a few
+    statements per chunk of them rather than per patient.
+    """
+    groups = {}
+    for patient_id, delta in deltas.items():
+        if delta:
+            groups.setdefault(delta, []).append(patient_id)
+    vaccinated = 0
+    for delta, patient_ids in groups.items():
+        for start in range(0, len(patient_ids), PATIENT_CHUNK_SIZE):
+            chunk = patient_ids[start:start + PATIENT_CHUNK_SIZE]
+            flags = PatientVaccinationFlag.objects.filter(patient_id__in=chunk)
+            if delta > 0:
+                missing = set(chunk).difference(flags.values_list('patient_id', flat=True))
+                # Raise positive counts before resetting the others, which then become positive too
+                flags.filter(administered_count__gt=0).update(administered_count=F('administered_count') + delta)
+                vaccinated += flags.filter(administered_count__lte=0).update(administered_count=delta)
+                PatientVaccinationFlag.objects.bulk_create(
+                    [PatientVaccinationFlag(patient_id=patient_id, administered_count=delta) for patient_id in missing]
+                )
+                vaccinated += len(missing)
+            else:
+                # Reset the counts that reach zero first, so lowered counts are not reset again
+                vaccinated -= flags.filter(administered_count__gt=0, administered_count__lte=-delta).update(
+                    administered_count=0
+                )
+                flags.filter(administered_count__gt=-delta).update(administered_count=F('administered_count') + delta)
+    apply_counter_deltas({'patients_vaccinated': vaccinated})
+
+
+def _record_contribution(state, sign, counters, daily, patients):
+    """Accumulate the rollup contribution of one VaccinationRecord state"""
+    if state is None:
+        return
+    status, day, vaccine_id, patient_id, reaction = state
+    counters[f'records:{status}'] += sign
+    counters[f'records:{status}:vaccine:{vaccine_id}'] += sign
+    daily[(day, vaccine_id, status, reaction)] += sign
+    if status == 'administered':
+        patients[patient_id] += sign
+
+
+def record_changed(before, after):
+    """Apply the rollup delta for a record moving from ``before`` to ``after``
+
+    Each state is ``(status, date_administered, vaccine_id, patient_id,
+    reaction)`` or ``None`` when the record does not exist on that side of
+    the change.
+    """
+    records_changed([(before, after)])
+
+
+def records_changed(changes):
+    """Apply the summed rollup delta of many ``(before, after)`` record changes"""
+    counters, daily, patients = Counter(), Counter(), Counter()
+    for before, after in changes:
+        if before != after:
+            _record_contribution(before, -1, counters, daily, patients)
+            _record_contribution(after, 1, counters, daily, patients)
+    if not any(counters.values()) and not any(daily.values()):
+        return
+    with transaction.atomic():
+        apply_counter_deltas(counters)
+        apply_daily_deltas(daily)
+        apply_monthly_deltas(monthly_deltas(daily))
+        apply_patient_deltas(patients)
+
+
+def _inventory_contribution(state, sign, counters):
+    """Accumulate the rollup contribution of one VaccineInventory state"""
+    if state is None:
+        return
+    status, current_stock = state
+    counters[f'inventory:{status}'] += sign
+    counters['inventory:doses'] += sign * current_stock
+
+
+def inventory_changed(before, after):
+    """Apply the rollup delta for a lot moving from ``before`` to ``after``
+
+    Each state is ``(status, current_stock)`` or ``None``.
+    """
+    if before == after:
+        return
+    counters = Counter()
+    _inventory_contribution(before, -1, counters)
+    _inventory_contribution(after, 1, counters)
+    apply_counter_deltas(counters)
+
+
+def recount_inventory():
+    """Reset the inventory counters from one grouped query over the lots"""
+    counters = {f'inventory:{status}': 0 for status, _ in VaccineInventory.STATUS_CHOICES}
+    counters['inventory:doses'] = 0
+    rows = VaccineInventory.objects.order_by().values('status').annotate(lots=Count('pk'), doses=Sum('current_stock'))
+    for row in rows:
+        counters[f"inventory:{row['status']}"] = row['lots']
+        counters['inventory:doses'] += row['doses'] or 0
+    with transaction.atomic():
+        for name, value in counters.items():
+            StatisticCounter.objects.update_or_create(name=name, defaults={'value': value})
+
+
+def _record_state(record):
+    return (record.status, record.date_administered, record.vaccine_id, record.patient_id, record.reaction)
+
+
+def _inventory_state(item):
+    return (item.status, item.current_stock)
+
+
+# =============================================
+# SIGNAL HANDLERS
+# =============================================
+
+@receiver(pre_save, sender=VaccinationRecord)
+def remember_record_state(sender, instance, raw=False, **kwargs):
+    """Remember the stored state of a record so post_save can diff against it"""
+    instance._rollup_before = None
+    if instance.pk and not raw:
+        instance._rollup_before = VaccinationRecord.objects.filter(pk=instance.pk).values_list(
+            'status', 'date_administered', 'vaccine_id', 'patient_id', 'reaction'
+        ).first()
+
+
+@receiver(post_save, sender=VaccinationRecord)
+def update_record_rollups(sender, instance, raw=False, **kwargs):
+    if not raw:
+        record_changed(getattr(instance, '_rollup_before', None), _record_state(instance))
+
+
+@receiver(post_delete, sender=VaccinationRecord)
+def remove_record_rollups(sender, instance, **kwargs):
+    record_changed(_record_state(instance), None)
+
+
+@receiver(post_save, sender=VaccineInventory)
+def update_inventory_rollups(sender, instance, raw=False, **kwargs):
+    # The stored state is read before the save by models.remember_stored_stock
+    if not raw:
+        inventory_changed(getattr(instance, '_stored_stock', None), _inventory_state(instance))
+
+
+@receiver(post_delete, sender=VaccineInventory)
+def remove_inventory_rollups(sender, instance, **kwargs):
+    inventory_changed(_inventory_state(instance), None)
+
+
+@receiver(stock_changed)
+def update_stock_rollups(sender, changes, **kwargs):
+    """Apply stock moved by UPDATE statements, which bypass post_save"""
+    counters = Counter()
+    for change in changes:
+        _inventory_contribution((change.old_status, change.old_stock), -1, counters)
+        _inventory_contribution((change.new_status, change.new_stock), 1, counters)
+    apply_counter_deltas(counters)
+
+
+@receiver(stock_recounted)
+def recount_stock_rollups(sender, **kwargs):
+    recount_inventory()
+
+
+@receiver(pre_save, sender=Appointment)
+def remember_appointment_state(sender, instance, raw=False, **kwargs):
+    instance._rollup_before = None
+    if instance.pk and not raw:
+        instance._rollup_before = Appointment.objects.filter(pk=instance.pk).values_list(
+            'status', flat=True
+        ).first()
+
+
+@receiver(post_save, sender=Appointment)
+def update_appointment_rollups(sender, instance, raw=False, **kwargs):
+    before = getattr(instance, '_rollup_before', None)
+    if raw or before == instance.status:
+        return
+    counters = Counter({f'appointments:{instance.status}': 1})
+    if before is not None:
+        counters[f'appointments:{before}'] -= 1
+    apply_counter_deltas(counters)
+
+
+@receiver(post_delete, sender=Appointment)
+def remove_appointment_rollups(sender, instance, **kwargs):
+    apply_counter_deltas({f'appointments:{instance.status}': -1})
+
+
+@receiver(rows_updated, sender=VaccinationRecord)
+def update_updated_record_rollups(sender, changes, **kwargs):
+    """Apply record changes made by UPDATE statements, which bypass post_save"""
+    records_changed(changes)
+
+
+@receiver(rows_updated, sender=Appointment)
+def update_updated_appointment_rollups(sender, changes, **kwargs):
+    counters = Counter()
+    for before, after in changes:
+        counters[f'appointments:{before}'] -= 1
+        counters[f'appointments:{after}'] += 1
+    apply_counter_deltas(counters)
+
+
+@receiver(post_save, sender=Patient)
+def update_patient_rollups(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        apply_counter_deltas({'patients': 1})
+
+
+@receiver(pre_delete, sender=Patient)
+def clear_patient_flag(sender, instance, **kwargs):
+    """Drop the patient from the vaccinated count before their records cascade"""
+    if PatientVaccinationFlag.objects.filter(patient_id=instance.pk, administered_count__gt=0).update(administered_count=0):
+        apply_counter_deltas({'patients_vaccinated': -1})
+
+
+@receiver(post_delete, sender=Patient)
+def remove_patient_rollups(sender, instance, **kwargs):
+    apply_counter_deltas({'patients': -1})
+
+
+# =============================================
+# REBUILD AND VERIFY
+# =============================================
+
+def compute_expected():
+    """Compute every rollup from the raw tables
+
+    Returns ``(counters, daily, monthly, flags)`` dictionaries keyed like the
+    rollup tables.
+    """
+    administered = VaccinationRecord.objects.filter(patient=OuterRef('pk'), status='administered')
+    patients = Patient.objects.order_by().aggregate(
+        total=Count('pk'),
+        vaccinated=Count('pk', filter=Q(Exists(administered))),
+    )
+    counters = Counter({'patients': patients['total'], 'patients_vaccinated': patients['vaccinated']})
+    daily = Counter()
+
+    records = VaccinationRecord.objects.order_by().values('date_administered', 'vaccine_id', 'status', 'reaction')
+    for row in records.annotate(n=Count('pk')):
+        counters[f"records:{row['status']}"] += row['n']
+        counters[f"records:{row['status']}:vaccine:{row['vaccine_id']}"] += row['n']
+        daily[(row['date_administered'], row['vaccine_id'], row['status'], row['reaction'])] += row['n']
+
+    inventory = VaccineInventory.objects.order_by().values('status').annotate(
+        lots=Count('pk'), doses=Sum('current_stock')
+    )
+    for row in inventory:
+        counters[f"inventory:{row['status']}"] += row['lots']
+        counters['inventory:doses'] += row['doses'] or 0
+
+    appointments = Appointment.objects.order_by().values('status').annotate(n=Count('pk'))
+    for row in appointments:
+        counters[f"appointments:{row['status']}"] += row['n']
+
+    flags = dict(
+        VaccinationRecord.objects.filter(status='administered').order_by()
+        .values('patient_id').annotate(n=Count('pk')).values_list('patient_id', 'n')
+    )
+
+    return +counters, +daily, +monthly_deltas(daily), flags
+
+
+def rebuild():
+    """Replace the contents of every rollup table with freshly computed values"""
+    counters, daily, monthly, flags = compute_expected()
+    with transaction.atomic():
+        StatisticCounter.objects.all().delete()
+        DailyVaccinationCount.objects.all().delete()
+        MonthlyVaccinationCount.objects.all().delete()
+        PatientVaccinationFlag.objects.all().delete()
+        StatisticCounter.objects.bulk_create(
+            [StatisticCounter(name=name, value=value) for name, value in counters.items()],
+            batch_size=1000,
+        )
+        DailyVaccinationCount.objects.bulk_create(
+            [
+                DailyVaccinationCount(day=day, vaccine_id=vaccine_id, status=status, reaction=reaction, count=count)
+                for (day, vaccine_id, status, reaction), count in daily.items()
+            ],
+            batch_size=1000,
+        )
+        MonthlyVaccinationCount.objects.bulk_create(
+            [
+                MonthlyVaccinationCount(month=month, vaccine_id=vaccine_id, status=status, reaction=reaction, count=count)
+                for (month, vaccine_id, status, reaction), count in monthly.items()
+            ],
+            batch_size=1000,
+        )
+        PatientVaccinationFlag.objects.bulk_create(
+            [PatientVaccinationFlag(patient_id=patient_id, administered_count=n) for patient_id, n in flags.items()],
+            batch_size=1000,
+        )
+    return len(counters), len(daily), len(monthly), len(flags)
+
+
+def _stored_counts(rows, period):
+    """``{(period, vaccine_id, status, reaction): count}`` of daily or monthly rollup rows"""
+    return {row[:4]: row[4] for row in rows.values_list(period, 'vaccine_id', 'status', 'reaction', 'count')}
+
+
+def verify():
+    """Compare the rollup tables with the raw tables
+
+    Returns a list of ``(table, key, stored, expected)`` mismatches.
+    """
+    counters, daily, monthly, flags = compute_expected()
+    stored_counters = dict(StatisticCounter.objects.exclude(value=0).values_list('name', 'value'))
+    stored_daily = _stored_counts(DailyVaccinationCount.objects.exclude(count=0), 'day')
+    stored_monthly = _stored_counts(MonthlyVaccinationCount.objects.exclude(count=0), 'month')
+    stored_flags = dict(
+        PatientVaccinationFlag.objects.exclude(administered_count=0).values_list('patient_id', 'administered_count')
+    )
+
+    mismatches = []
+    for table, stored, expected in (
+        ('counters', stored_counters, counters),
+        ('daily', stored_daily, daily),
+        ('monthly', stored_monthly, monthly),
+        ('flags', stored_flags, flags),
+    ):
+        for key in sorted(set(stored) | set(expected), key=str):
+            if stored.get(key, 0) != expected.get(key, 0):
+                mismatches.append((table, key, stored.get(key, 0), expected.get(key, 0)))
+    return mismatches
+
+
+# =============================================
+# INCREMENTAL BACKFILL
+# =============================================
+# The daily and monthly rollups can be recomputed one calendar month at a
+# time, each in its own transaction, writing only the rows that differ. A
+# backfill can therefore be interrupted and resumed, and re-running it over
+# months that are already correct costs one grouped read per month.
+
+def next_month(month):
+    return (month + timedelta(days=32)).replace(day=1)
+
+
+def expected_daily(start, end):
+    """Daily rollup counts of the records dated from ``start`` up to, not including, ``end``"""
+    records = VaccinationRecord.objects.filter(date_administered__gte=start, date_administered__lt=end).order_by()
+    return Counter({
+        (row['date_administered'], row['vaccine_id'], row['status'], row['reaction']): row['n']
+        for row in records.values('date_administered', 'vaccine_id', 'status', 'reaction').annotate(n=Count('pk'))
+    })
+
+
+def _sync_rows(model, period, expected, start, end):
+    """Make the rows of ``model`` with ``period`` in [start, end) match ``expected``
+
+    Returns the number of rows created, updated or deleted.
+    """
+    rows = model.objects.filter(**{f'{period}__gte': start, f'{period}__lt': end})
+    stored = {
+        row[1:5]: (row[0], row[5])
+        for row in rows.values_list('pk', period, 'vaccine_id', 'status', 'reaction', 'count')
+    }
+    stale = [pk for key, (pk, _) in stored.items() if not expected.get(key)]
+    changed = [
+        model(pk=pk, count=expected[key])
+        for key, (pk, count) in stored.items() if expected.get(key) and expected[key] != count
+    ]
+    created = [
+        model(**{period: key[0]}, vaccine_id=key[1], status=key[2], reaction=key[3], count=count)
+        for key, count in expected.items() if count and key not in stored
+    ]
+    model.objects.filter(pk__in=stale).delete()
+    model.objects.bulk_update(changed, ['count'], batch_size=1000)
+    model.objects.bulk_create(created, batch_size=1000)
+    return len(stale) + len(changed) + len(created)
+
+
+def backfill_month(month):
+    """Recompute the daily and monthly rollup rows of the calendar month starting on ``month``
+
+    Returns the number of rows written.
+    """
+    end = next_month(month)
+    with transaction.atomic():
+        daily = expected_daily(month, end)
+        written = _sync_rows(DailyVaccinationCount, 'day', daily, month, end)
+        written += _sync_rows(MonthlyVaccinationCount, 'month', monthly_deltas(daily), month, end)
+    return written
+
+
+def drifted_months(start=None, end=None):
+    """First days of the months whose monthly rollup total differs from their record count"""
+    records = VaccinationRecord.objects.order_by()
+    rows = MonthlyVaccinationCount.objects.order_by()
+    if start is not None:
+        records = records.filter(date_administered__gte=start.replace(day=1))
+        rows = rows.filter(month__gte=start.replace(day=1))
+    if end is not None:
+        records = records.filter(date_administered__lt=next_month(end.replace(day=1)))
+        rows = rows.filter(month__lte=end)
+    counted = records.annotate(month=TruncMonth('date_administered')).values('month').annotate(n=Count('pk'))
+    counted = dict(counted.values_list('month', 'n'))
+    stored = dict(rows.values('month').annotate(n=Sum('count')).values_list('month', 'n'))
+    return {month for month in counted.keys() | stored.keys() if counted.get(month, 0) != stored.get(month, 0)}
+
+
+def backfill_months(start=None, end=None, changed_since=None):
+    """First days of the months a backfill should cover, oldest first
+
+    ``start`` and ``end`` (dates, inclusive) default to the range of record
+    dates. With ``changed_since`` only months holding records updated since
+    then are returned, plus the months whose rollup total no longer matches
+    their record count: those a record was moved out of or deleted from
+    without signals. A change that keeps every month's total, such as a
+    record moved to another day of the same month by an UPDATE that left
+    updated_at alone, still needs a full backfill.
+    """
+    records = VaccinationRecord.objects.order_by()
+    if changed_since is not None:
+        months = set(records.filter(updated_at__gte=changed_since).dates('date_administered', 'month'))
+        months |= drifted_months(start, end)
+        return sorted(
+            month for month in months
+            if (start is None or month >= start.replace(day=1)) and (end is None or month <= end)
+        )
+    bounds = records.aggregate(first=Min('date_administered'), last=Max('date_administered'))
+    start = start or bounds['first']
+    end = end or bounds['last']
+    if start is None or end is None:
+        return []
+    months = []
+    month = start.replace(day=1)
+    while month <= end:
+        months.append(month)
+        month = next_month(month)
+    return months
@@ -0,0 +1,310 @@
+import html
+import re
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .models import Vaccine, VaccineInventory, Patient, VaccinationRecord
+from .signals import lots_updated
+
+# =============================================
+# FULL-TEXT SEARCH
+# =============================================
+# Vaccines, inventory lots, patients and vaccination records are indexed as
+# documents with a title and a body. Patients and records carry the id of the
+# user who owns them, so searches only return that user's patients; vaccines
+# and lots are shared. Documents are written on post_save and removed on
+# post_delete, and lots changed in bulk are re-indexed on ``lots_updated``;
+# ``python manage.py rebuild_search_index`` re-creates the documents after
+# other bulk changes that bypass signals.
+#
+# The default backend on SQLite is an FTS5 table (created by migration 0012)
+# whose rowid encodes the kind and primary key, so updates and deletes are
+# rowid lookups. Other databases fall back to icontains queries. Set
+# settings.SEARCH['BACKEND'] to the dotted path of a class to plug in another.
+
+Document = namedtuple('Document', 'kind object_id owner_id title body')
+SearchHit = namedtuple('SearchHit', 'kind object_id title snippet score')
+
+KINDS = ('vaccine', 'lot', 'patient', 'record')
+KIND_MODELS = {'vaccine': Vaccine, 'lot': VaccineInventory, 'patient': Patient, 'record': VaccinationRecord}
+
+# Highlight markers that cannot occur in indexed text; they become <mark>
+# tags once the rest of the text has been escaped
+MARK_START, MARK_END = '\x02', '\x03'
+
+
+def _join(*values):
+    return ' '.join(str(value) for value in values if value)
+
+
+def vaccine_document(vaccine):
+    return Document(
+        'vaccine', vaccine.pk, None,
+        _join(vaccine.name, vaccine.short_name),
+        _join(vaccine.target_diseases, vaccine.manufacturer, vaccine.description),
+    )
+
+
+def lot_document(lot):
+    return Document(
+        'lot', lot.pk, None,
+        _join(lot.vaccine_name, 'Lot', lot.lot_number),
+        _join(lot.target_diseases, lot.manufacturer, lot.notes),
+    )
+
+
+def patient_document(patient):
+    return Document(
+        'patient', patient.pk, patient.user_id,
+        _join(patient.first_name, patient.last_name),
+        _join(patient.patient_email, patient.patient_phone),
+    )
+
+
+def record_document(record):
+    return Document(
+        'record', record.pk, record.patient.user_id,
+        _join(record.vaccine.name, 'dose', record.dose_number, '-', record.patient.first_name, record.patient.last_name),
+        _join(record.notes, record.reaction_notes, record.lot_number, record.administered_by, record.administering_facility),
+    )
+
+
+# Lot fields the lot documents are built from
+LOT_DOCUMENT_FIELDS = {'vaccine_name', 'lot_number', 'target_diseases', 'manufacturer', 'notes'}
+
+# Patient fields copied into the documents of their records
+PATIENT_RECORD_FIELDS = ('first_name', 'last_name', 'user_id')
+
+
+DOCUMENT_BUILDERS = {
+    'vaccine': (vaccine_document, ()),
+    'lot': (lot_document, ()),
+    'patient': (patient_document, ()),
+    'record': (record_document, ('patient', 'vaccine')),
+}
+
+
+def documents_for(kind, queryset):
+    """Yield the documents of a queryset of one kind, reading it in chunks"""
+    build, related = DOCUMENT_BUILDERS[kind]
+    for obj in queryset.select_related(*related).iterator(chunk_size=2000):
+        yield build(obj)
+
+
+def query_terms(query):
+    """Words of a free-text query; punctuation and search operators are dropped"""
+    return re.findall(r'\w+', query)
+
+
+def render_highlight(text):
+    """Escape ``text`` and turn the highlight markers into <mark> tags"""
+    return html.escape(text or '').replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+
+
+class SQLiteFTSBackend:
+    """FTS5 index ranked with bm25, titles weighted above bodies"""
+    table = 'vaccineapp_search_index'
+    title_weight = 10.0
+    body_weight = 1.0
+    snippet_tokens = 16
+
+    @staticmethod
+    def rowid(kind, object_id):
+        return object_id * len(KINDS) + KINDS.index(kind)
+
+    def index(self, documents):
+        rows = [(self.rowid(doc.kind, doc.object_id), doc.owner_id, doc.title, doc.body) for doc in documents]
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(f'INSERT INTO {self.table} (rowid, owner_id, title, body) VALUES (%s, %s, %s, %s)', rows)
+
+    def remove(self, kind, object_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {self.table} WHERE rowid = %s',
+                [(self.rowid(kind, object_id),) for object_id in object_ids],
+            )
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+
+    def search(self, query, kinds=KINDS, owner_id=None, limit=20):
+        terms = query_terms(query)
+        if not terms or not kinds:
+            return []
+        # Every word must match, as a prefix, in the title or the body
+        match = ' '.join(f'"{term}"*' for term in terms)
+        where = [f'{self.table} MATCH %s']
+        params = [match]
+        if owner_id is not None:
+            where.append('(owner_id IS NULL OR owner_id = %s)')
+            params.append(owner_id)
+        if set(kinds) != set(KINDS):
+            where.append(f"(rowid %% {len(KINDS)}) IN ({', '.join(str(KINDS.index(kind)) for kind in kinds)})")
+        rank = f'bm25({self.table}, 0.0, {self.title_weight}, {self.body_weight})'
+        sql = (
+            f"SELECT rowid, highlight({self.table}, 1, %s, %s), "
+            f"snippet({self.table}, 2, %s, %s, '...', {self.snippet_tokens}), {rank} "
+            f"FROM {self.table} WHERE {' AND '.join(where)} ORDER BY {rank} LIMIT %s"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [MARK_START, MARK_END, MARK_START, MARK_END, *params, limit])
+            rows = cursor.fetchall()
+        return [
+            SearchHit(KINDS[rowid % len(KINDS)], rowid // len(KINDS), title, snippet, -score)
+            for rowid, title, snippet, score in rows
+        ]
+
+
+class IContainsBackend:
+    """Fallback without an index: icontains over the searchable model fields"""
+    fields = {
+        'vaccine': ['name', 'short_name', 'target_diseases', 'manufacturer'],
+        'lot': ['vaccine_name', 'lot_number', 'target_diseases', 'manufacturer'],
+        'patient': ['first_name', 'last_name', 'patient_email'],
+        'record': ['notes', 'reaction_notes', 'lot_number', 'vaccine__name'],
+    }
+    owner_lookups = {'patient': 'user_id', 'record': 'patient__user_id'}
+
+    def index(self, documents):
+        pass
+
+    def remove(self, kind, object_ids):
+        pass
+
+    def clear(self):
+        pass
+
+    def search(self, query, kinds=KINDS, owner_id=None, limit=20):
+        terms = query_terms(query)
+        if not terms:
+            return []
+        pattern = re.compile('|'.join(re.escape(term) for term in terms), re.IGNORECASE)
+        hits = []
+        for kind in kinds:
+            condition = Q()
+            for term in terms:
+                condition &= Q(*[Q(**{f'{field}__icontains': term}) for field in self.fields[kind]], _connector=Q.OR)
+            objects = KIND_MODELS[kind].objects.filter(condition)
+            if owner_id is not None and kind in self.owner_lookups:
+                objects = objects.filter(**{self.owner_lookups[kind]: owner_id})
+            for doc in documents_for(kind, objects[:limit]):
+                marked = [pattern.sub(lambda m: f'{MARK_START}{m.group()}{MARK_END}', text) for text in (doc.title, doc.body)]
+                hits.append(SearchHit(kind, doc.object_id, marked[0], marked[1], 0.0))
+        return hits[:limit]
+
+
+def get_backend():
+    """Return an instance of the configured search backend"""
+    path = getattr(settings, 'SEARCH', {}).get('BACKEND')
+    if path is None:
+        return SQLiteFTSBackend() if connection.vendor == 'sqlite' else IContainsBackend()
+    return import_string(path)()
+
+
+def search(query, kinds=KINDS, owner_id=None, limit=20):
+    """Ranked hits for ``query``; ``owner_id`` hides other users' patients and records"""
+    return get_backend().search(query, kinds=kinds, owner_id=owner_id, limit=limit)
+
+
+def search_ids(kind, query, limit=1000):
+    """Primary keys of the objects of one kind matching ``query``, best first"""
+    return [hit.object_id for hit in search(query, kinds=[kind], limit=limit)]
+
+
+def index_objects(kind, objects):
+    """Write the documents of ``objects`` (e.g. after a bulk insert)"""
+    build = DOCUMENT_BUILDERS[kind][0]
+    get_backend().index(build(obj) for obj in objects)
+
+
+def rebuild_index():
+    """Replace the whole index; returns the number of documents per kind"""
+    backend = get_backend()
+    backend.clear()
+    counts = {}
+    for kind in KINDS:
+        count = 0
+        batch = []
+        for document in documents_for(kind, KIND_MODELS[kind].objects.order_by()):
+            batch.append(document)
+            if len(batch) == 2000:
+                backend.index(batch)
+                count += len(batch)
+                batch = []
+        backend.index(batch)
+        counts[kind] = count + len(batch)
+    return counts
+
+
+# =============================================
+# SIGNAL HANDLERS
+# =============================================
+
+@receiver(post_save, sender=Vaccine)
+def index_vaccine(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    backend = get_backend()
+    backend.index([vaccine_document(instance)])
+    before = getattr(instance, '_catalog_before', None)
+    if before and before['name'] != instance.name:
+        # Record titles carry the vaccine name; the lots' copies of the
+        # catalog are re-indexed on lots_updated when they are pushed
+        backend.index(documents_for('record', instance.vaccination_records.all()))
+
+
+@receiver(post_save, sender=VaccineInventory)
+def index_lot(sender, instance, raw=False, **kwargs):
+    if not raw:
+        get_backend().index([lot_document(instance)])
+
+
+@receiver(lots_updated)
+def index_updated_lots(sender, lots, fields, **kwargs):
+    if LOT_DOCUMENT_FIELDS.intersection(fields):
+        get_backend().index(documents_for('lot', lots))
+
+
+@receiver(pre_save, sender=Patient)
+def remember_patient_name(sender, instance, raw=False, **kwargs):
+    """Remember the stored name so post_save re-indexes records only when it changed"""
+    instance._name_before = None
+    if instance.pk and not raw:
+        instance._name_before = Patient.objects.filter(pk=instance.pk).values_list(*PATIENT_RECORD_FIELDS).first()
+
+
+@receiver(post_save, sender=Patient)
+def index_patient(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    backend = get_backend()
+    backend.index([patient_document(instance)])
+    before = getattr(instance, '_name_before', None)
+    if not created and before != tuple(getattr(instance, field) for field in PATIENT_RECORD_FIELDS):
+        # Record titles carry the patient name, and records the owner
+        backend.index(documents_for('record', instance.vaccination_records.all()))
+
+
+@receiver(post_save, sender=VaccinationRecord)
+def index_record(sender, instance, raw=False, **kwargs):
+    if not raw:
+        get_backend().index([record_document(instance)])
+
+
+@receiver(post_delete, sender=Vaccine)
+@receiver(post_delete, sender=VaccineInventory)
+@receiver(post_delete, sender=Patient)
+@receiver(post_delete, sender=VaccinationRecord)
+def remove_from_index(sender, instance, **kwargs):
+    kind = next(kind for kind, model in KIND_MODELS.items() if model is sender)
+    get_backend().remove(kind, [instance.pk])
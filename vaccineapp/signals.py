@@ -0,0 +1,39 @@
+from typing import NamedTuple
+
+from django.dispatch import Signal
+
+
+class StockChange(NamedTuple):
+    """Stock level of one inventory lot before and after a set-based update"""
+    inventory_id: int
+    old_stock: int
+    new_stock: int
+    old_status: str
+    new_status: str
+
+
+# Sent after current_stock is changed with UPDATE statements instead of
+# VaccineInventory.save(), so no post_save is fired for the lots involved.
+# Arguments: ``changes`` (list of StockChange), ``reason`` (receipt,
+# administration, reversal, adjustment, wastage or transfer) and ``record``
+# (the VaccinationRecord responsible, or None). Batch administrations may
+# also send ``records``, mapping lot ids to the records that took one dose
+# each from the lot.
+stock_changed = Signal()
+
+# Sent after lots were inserted or had their status changed in bulk,
+# bypassing post_save; receivers should recount from the table.
+stock_recounted = Signal()
+
+# Sent after VaccinationRecord or Appointment rows were changed with UPDATE
+# statements, bypassing post_save. Arguments: ``changes``, a list of
+# ``(before, after)`` pairs of the fields the rollups track: the status of
+# an appointment, ``(status, date_administered, vaccine_id, patient_id,
+# reaction)`` of a record.
+rows_updated = Signal()
+
+# Sent after VaccineInventory fields other than the stock levels (catalog
+# copies, lot numbers, notes) were changed with UPDATE statements, bypassing
+# post_save. Arguments: ``lots``, a queryset of the lots changed, and
+# ``fields``, the names of the fields written.
+lots_updated = Signal()
@@ -1,3 +1,1613 @@
-from django.test import TestCase
+import json
+import tempfile
+import threading
+from io import StringIO
+from unittest import mock
+from datetime import date, timedelta
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, OperationalError, connection
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncMonth
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .models import (
+    Appointment, Patient, StatisticCounter, StockMovement, Vaccine, VaccineInventory, VaccinationRecord, WastageRecord,
+)
+from . import admin as vaccine_admin
+from . import allocation, analytics, caching, cohorts, coverage, coverage_matrix, forecasting, inventory_import, ledger, rollups, search
+from .dashboard_stats import get_catalog_stats, get_dashboard_stats, get_inventory_stats, get_patient_stats
+from .pagination import encode_cursor
+
+
+def create_lot(stock, min_stock_level=10):
+    vaccine = Vaccine.objects.create(name='MMR', vaccine_type='live')
+    return VaccineInventory.objects.create(
+        vaccine=vaccine,
+        lot_number='LOT-1',
+        expiration_date=date.today() + timedelta(days=365),
+        current_stock=stock,
+        min_stock_level=min_stock_level,
+    )
+
+
+def create_patient(user, number, date_of_birth=date(2020, 1, 1)):
+    return Patient.objects.create(
+        user=user, first_name=f'Patient{number}', last_name='Test', date_of_birth=date_of_birth
+    )
+
+
+def next_month_start(year, month):
+    return date(year + month // 12, month % 12 + 1, 1)
+
+
+def create_record(patient, vaccine, day, status='administered', dose_number=1, **fields):
+    return VaccinationRecord.objects.create(
+        patient=patient, vaccine=vaccine, date_administered=day, status=status, dose_number=dose_number, **fields
+    )
+
+
+class StockTransitionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('nurse', password='x')
+        self.lot = create_lot(stock=3)
+        self.record = VaccinationRecord(
+            patient=create_patient(self.user, 1),
+            vaccine=self.lot.vaccine,
+            inventory_used=self.lot,
+            date_administered=date.today(),
+            status='scheduled',
+        )
+        self.record.save()
+
+    def stock(self):
+        self.lot.refresh_from_db()
+        return self.lot.current_stock
+
+    def test_scheduled_record_does_not_touch_stock(self):
+        self.assertEqual(self.stock(), 3)
+
+    def test_dose_is_deducted_once_per_administration(self):
+        self.record.status = 'administered'
+        self.record.save()
+        self.record.notes = 'Edited after administration'
+        self.record.save()
+        self.assertEqual(self.stock(), 2)
+        self.assertEqual(self.lot.status, 'critical')
+
+    def test_cancel_and_delete_restore_the_dose(self):
+        self.record.status = 'administered'
+        self.record.save()
+        self.record.status = 'cancelled'
+        self.record.save()
+        self.assertEqual(self.stock(), 3)
+
+        self.record.status = 'administered'
+        self.record.save()
+        self.record.delete()
+        self.assertEqual(self.stock(), 3)
+        self.assertEqual(rollups.verify(), [])
+
+    def test_out_of_stock_lot_is_rejected_by_validation_only(self):
+        VaccineInventory.objects.adjust_stock(self.lot.pk, -3)
+        self.record.status = 'administered'
+        with self.assertRaises(ValidationError):
+            self.record.full_clean()
+
+        # Saves that bypass clean() go ahead without a deduction, as before
+        with self.assertLogs('vaccineapp.models', 'WARNING'):
+            self.record.save()
+        self.record.refresh_from_db()
+        self.assertEqual((self.record.status, self.record.stock_deducted_from_id), ('administered', None))
+        self.assertEqual(self.stock(), 0)
+        self.assertEqual(self.lot.status, 'out_of_stock')
+
+        VaccineInventory.objects.adjust_stock(self.lot.pk, 2)
+        self.record.save()
+        self.assertEqual(self.record.stock_deducted_from_id, self.lot.pk)
+        self.assertEqual(self.stock(), 1)
+        self.assertEqual(rollups.verify(), [])
+        self.assertEqual(ledger.verify(), [])
+
+
+class ConcurrentStockDecrementTests(TransactionTestCase):
+    """Hammer one lot from several threads and check no decrement is lost"""
+    threads = 8
+    attempts_per_thread = 10
+    initial_stock = 50
+
+    def run_concurrently(self, work):
+        """Run ``work(thread_index, attempt)`` from several threads
+
+        Returns the number of calls that succeeded. Calls refused for lack of
+        stock count as failures; calls that hit a database lock are retried.
+        """
+        successes = []
+        lock = threading.Lock()
+        start = threading.Barrier(self.threads)
+
+        def run(index):
+            start.wait()
+            try:
+                for attempt in range(self.attempts_per_thread):
+                    while True:
+                        try:
+                            work(index, attempt)
+                        except ValidationError:
+                            break
+                        except OperationalError:
+                            continue  # SQLite allows a single writer; try again
+                        with lock:
+                            successes.append((index, attempt))
+                        break
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=run, args=(index,)) for index in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return len(successes)
+
+    def test_adjust_stock_never_loses_updates(self):
+        lot = create_lot(stock=self.initial_stock)
+
+        succeeded = self.run_concurrently(lambda index, attempt: VaccineInventory.objects.adjust_stock(lot.pk, -1))
+
+        lot.refresh_from_db()
+        self.assertEqual(succeeded, self.initial_stock)
+        self.assertEqual(lot.current_stock, 0)
+        self.assertEqual(lot.status, 'out_of_stock')
+        self.assertEqual(rollups.verify(), [])
+
+    def test_concurrent_administrations_deduct_exactly_once_each(self):
+        lot = create_lot(stock=self.initial_stock)
+        user = User.objects.create_user('nurse', password='x')
+        patients = [create_patient(user, index) for index in range(self.threads)]
+
+        def administer(index, attempt):
+            VaccinationRecord(
+                patient=patients[index],
+                vaccine=lot.vaccine,
+                inventory_used=lot,
+                dose_number=attempt + 1,
+                date_administered=date.today(),
+                status='administered',
+            ).save()
+
+        # Records saved once the lot is empty are kept without a deduction
+        with self.assertLogs('vaccineapp.models', 'WARNING'):
+            succeeded = self.run_concurrently(administer)
+
+        lot.refresh_from_db()
+        self.assertEqual(succeeded, self.threads * self.attempts_per_thread)
+        self.assertEqual(lot.current_stock, 0)
+        self.assertEqual(VaccinationRecord.objects.filter(stock_deducted_from=lot).count(), self.initial_stock)
+        self.assertEqual(rollups.verify(), [])
+
+
+class DashboardStatsTests(TestCase):
+    def setUp(self):
+        self.today = date(2024, 5, 15)  # a Wednesday
+        self.user = User.objects.create_user('nurse', password='x')
+        other = User.objects.create_user('other', password='x')
+        lot = create_lot(stock=40)
+        self.vaccine = lot.vaccine
+        VaccineInventory.objects.create(
+            vaccine=self.vaccine, lot_number='LOT-2', current_stock=3, min_stock_level=10,
+            expiration_date=self.today + timedelta(days=10),
+        )
+        patients = [create_patient(self.user, number) for number in range(3)]
+        stranger = create_patient(other, 9)
+        for dose, day in enumerate([self.today, self.today - timedelta(days=1), self.today - timedelta(days=20)], 1):
+            create_record(patients[0], self.vaccine, day, dose_number=dose)
+        create_record(patients[1], self.vaccine, self.today - timedelta(days=45))
+        create_record(patients[2], self.vaccine, self.today, status='scheduled')
+        create_record(stranger, self.vaccine, self.today - timedelta(days=3), status='scheduled')
+        Appointment.objects.create(
+            patient=patients[0], appointment_type='vaccination', scheduled_date=timezone.now() + timedelta(days=1)
+        )
+        Appointment.objects.create(
+            patient=stranger, appointment_type='vaccination', scheduled_date=timezone.now() + timedelta(days=1)
+        )
+
+    def test_header_statistics_match_the_raw_tables(self):
+        stats = get_dashboard_stats(self.user, today=self.today, use_cache=False)
+
+        self.assertEqual(stats.user.patients_count, 3)
+        self.assertEqual(stats.user.appointments_count, 1)
+        self.assertEqual(stats.user.vaccination_records_count, 5)
+        self.assertEqual(stats.vaccinations.administered_total, 4)
+        self.assertEqual(stats.vaccinations.administered_last_30_days, 3)
+        self.assertEqual(stats.vaccinations.administered_this_month, 2)
+        self.assertEqual(stats.vaccinations.administered_this_week, 2)
+        self.assertEqual(stats.vaccinations.administered_today, 1)
+        self.assertEqual(stats.vaccinations.due_today, 1)
+        self.assertEqual(stats.vaccinations.overdue, 1)
+        self.assertEqual(stats.inventory.total_lots, 2)
+        self.assertEqual(stats.inventory.total_doses, 43)
+        self.assertEqual(stats.inventory.low_stock_count, 1)
+        self.assertEqual(stats.inventory.expiring_soon_count, 1)
+        self.assertEqual(stats.inventory.vaccine_types, 1)
+
+    def test_patient_and_catalog_statistics(self):
+        patients = get_patient_stats(self.today)
+        self.assertEqual((patients.total_patients, patients.patients_vaccinated), (4, 2))
+        self.assertEqual(patients.vaccine_coverage, 50.0)
+
+        Vaccine.objects.create(name='IPV', vaccine_type='inactivated', is_active=False)
+        catalog = get_catalog_stats()
+        self.assertEqual(catalog.vaccine_types, 2)
+        self.assertEqual(catalog.type_distribution['live']['count'], 1)
+        self.assertEqual(catalog.type_distribution['inactivated']['count'], 0)
+
+    def test_cached_sections_match_a_direct_computation(self):
+        cache.clear()
+        direct = get_dashboard_stats(self.user, today=self.today, use_cache=False)
+        cached = get_dashboard_stats(self.user, today=self.today)
+        self.assertEqual(cached, direct)
+        self.assertEqual(cached.as_context()['total_doses'], 43)
+
+
+class RollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('nurse', password='x')
+        self.lot = create_lot(stock=20)
+        self.vaccine = self.lot.vaccine
+        self.patients = [create_patient(self.user, number) for number in range(3)]
+
+    def test_rollups_follow_saves_and_deletes(self):
+        record = create_record(self.patients[0], self.vaccine, date(2024, 1, 31), inventory_used=self.lot)
+        create_record(self.patients[1], self.vaccine, date(2024, 2, 1), status='scheduled')
+        self.assertEqual(rollups.verify(), [])
+
+        record.date_administered = date(2024, 2, 29)
+        record.reaction = 'mild'
+        record.save()
+        self.assertEqual(rollups.verify(), [])
+
+        record.status = 'missed'
+        record.save()
+        self.assertEqual(rollups.verify(), [])
+        self.assertEqual(rollups.counter_values('patients_vaccinated')['patients_vaccinated'], 0)
+
+        record.delete()
+        self.patients[1].delete()
+        self.assertEqual(rollups.verify(), [])
+
+    def test_rollups_follow_set_based_updates(self):
+        for number, patient in enumerate(self.patients):
+            create_record(patient, self.vaccine, date(2024, 3, number + 1), status='scheduled')
+        Appointment.objects.create(patient=self.patients[0], appointment_type='checkup', scheduled_date=timezone.now())
+
+        VaccinationRecord.objects.filter(patient__in=self.patients[:2]).set_status('administered')
+        Appointment.objects.all().set_status('completed')
+        VaccineInventory.objects.adjust_stock(self.lot.pk, -5)
+        self.assertEqual(rollups.verify(), [])
+        self.assertEqual(rollups.counter_values('patients_vaccinated')['patients_vaccinated'], 2)
+
+    def test_set_status_applies_patient_deltas_in_bulk(self):
+        patients = self.patients + [create_patient(self.user, number) for number in range(3, 12)]
+        for patient in patients:
+            create_record(patient, self.vaccine, date(2024, 3, 1), status='scheduled')
+        # Patients already vaccinated once, or twice, keep counting
+        create_record(patients[0], self.vaccine, date(2024, 2, 1), dose_number=2)
+        create_record(patients[1], self.vaccine, date(2024, 2, 1), dose_number=2)
+        create_record(patients[1], self.vaccine, date(2024, 2, 2), dose_number=3)
+        Appointment.objects.create(patient=patients[0], appointment_type='checkup', scheduled_date=timezone.now())
+
+        records = VaccinationRecord.objects.filter(date_administered=date(2024, 3, 1))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(records.set_status('administered'), (12, 0))
+        flag_updates = [query for query in queries if query['sql'].startswith('UPDATE "vaccineapp_patientvaccinationflag"')]
+        self.assertLessEqual(len(flag_updates), 2)
+        self.assertEqual(rollups.verify(), [])
+        self.assertEqual(rollups.counter_values('patients_vaccinated')['patients_vaccinated'], 12)
+
+        self.assertEqual(records.set_status('missed'), (12, 0))
+        self.assertEqual(rollups.verify(), [])
+        self.assertEqual(rollups.counter_values('patients_vaccinated')['patients_vaccinated'], 2)
+        self.assertEqual(Appointment.objects.all().set_status('completed'), (1, 0))
+
+    def test_rebuild_recovers_from_drift(self):
+        create_record(self.patients[0], self.vaccine, date(2024, 1, 1))
+        rollups.apply_counter_deltas({'records:administered': 5, 'patients': -1})
+        self.assertNotEqual(rollups.verify(), [])
+
+        rollups.rebuild()
+        self.assertEqual(rollups.verify(), [])
+
+
+@override_settings(DASHBOARD_CACHE={'MISS_WAIT_SECONDS': 0.1})
+class StaleWhileRevalidateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_miss_is_computed_once_and_then_hit(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(caching.get_or_refresh('stats', compute), 1)
+        self.assertEqual(caching.get_or_refresh('stats', compute), 1)
+        self.assertEqual(len(calls), 1)
+
+    def test_waiter_stores_its_value_when_the_lock_holder_never_finishes(self):
+        cache.add(caching._lock_key('stats'), 1)
+        self.assertEqual(caching.get_or_refresh('stats', lambda: 'computed'), 'computed')
+        self.assertEqual(caching.get_or_refresh('stats', lambda: 'recomputed'), 'computed')
+
+
+class InventoryTableApiTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('nurse', password='x')
+        self.client.force_login(self.user)
+        self.vaccine = Vaccine.objects.create(name='MMR', vaccine_type='live', target_diseases='Measles')
+        today = date.today()
+        for number, (stock, expires) in enumerate([(50, 400), (5, 20), (0, 200), (30, -3)]):
+            VaccineInventory.objects.create(
+                vaccine=self.vaccine, lot_number=f'LOT-{number}', current_stock=stock,
+                expiration_date=today + timedelta(days=expires),
+            )
+
+    def get(self, **params):
+        response = self.client.get('/api/inventory/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_pages_are_stable_and_complete(self):
+        first = self.get(page_size=3, sort='-stock')
+        second = self.get(page_size=3, sort='-stock', page=2)
+        self.assertEqual((first['total'], first['num_pages'], first['has_next']), (4, 2, True))
+        self.assertEqual([item['current_stock'] for item in first['items'] + second['items']], [50, 30, 5, 0])
+
+    def test_filters_and_search(self):
+        lots = lambda data: sorted(item['lot_number'] for item in data['items'])
+        self.assertEqual(lots(self.get(filter='low_stock')), ['LOT-1'])
+        self.assertEqual(lots(self.get(filter='expiring_soon')), ['LOT-1'])
+        self.assertEqual(lots(self.get(filter='expired')), ['LOT-3'])
+        self.assertEqual(lots(self.get(q='lot-2')), ['LOT-2'])
+        self.assertEqual(self.get(q='measles')['total'], 4)
+
+    def test_html_fragments(self):
+        data = self.get(format='html', view='cards')
+        self.assertNotIn('items', data)
+        self.assertEqual(data['html'].count('vaccine-card-item'), 4)
+
+
+class ChartApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('nurse', password='x')
+        self.client.force_login(self.user)
+        vaccine = Vaccine.objects.create(name='MMR', vaccine_type='live')
+        vaccinated = create_patient(self.user, 1, date_of_birth=date.today() - timedelta(days=400))
+        create_patient(self.user, 2, date_of_birth=date.today() - timedelta(days=3000))
+        create_record(vaccinated, vaccine, date.today())
+
+    def test_chart_datasets(self):
+        coverage = self.client.get('/api/dashboard/charts/coverage/').json()
+        self.assertEqual(coverage['datasets'][0]['data'], [1, 1])
+        self.assertEqual(coverage['coverage'], 50.0)
+
+        types = self.client.get('/api/dashboard/charts/vaccine-types/').json()
+        self.assertEqual(dict(zip(types['labels'], types['datasets'][0]['data']))['Live Attenuated'], 1)
+
+        ages = self.client.get('/api/dashboard/charts/age-distribution/').json()
+        self.assertEqual(sum(ages['datasets'][0]['data']), 2)
+
+    def test_matching_etag_is_answered_with_304(self):
+        for url in (
+            '/api/dashboard/charts/coverage/',
+            '/api/dashboard/charts/vaccine-types/',
+            '/api/dashboard/charts/age-distribution/',
+        ):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('private', response['Cache-Control'])
+
+            revalidated = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(revalidated.status_code, 304)
+            self.assertEqual(revalidated.content, b'')
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='"stale"').status_code, 200)
+
+    def test_etag_changes_with_the_data(self):
+        url = '/api/dashboard/charts/coverage/'
+        etag = self.client.get(url)['ETag']
+        create_patient(self.user, 3)
+        cache.clear()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class InventoryStatusTests(TestCase):
+    def test_update_lots_derives_status_in_one_statement(self):
+        lot = create_lot(stock=50)
+        with self.assertNumQueries(1):
+            VaccineInventory.objects.filter(pk=lot.pk).update_lots(min_stock_level=100)
+        lot.refresh_from_db()
+        self.assertEqual(lot.status, 'low_stock')
+
+        VaccineInventory.objects.filter(pk=lot.pk).update_lots(current_stock=20)
+        lot.refresh_from_db()
+        self.assertEqual(lot.status, 'critical')
+
+    def test_refresh_status_fixes_stale_lots_and_recounts_rollups(self):
+        lot = create_lot(stock=0)
+        fine = VaccineInventory.objects.create(
+            vaccine=lot.vaccine, lot_number='LOT-2', current_stock=40, expiration_date=lot.expiration_date
+        )
+        VaccineInventory.objects.update(status='in_stock')
+        self.assertEqual(list(VaccineInventory.objects.stale_status()), [lot])
+
+        self.assertEqual(VaccineInventory.objects.refresh_status(), 1)
+        lot.refresh_from_db()
+        fine.refresh_from_db()
+        self.assertEqual((lot.status, fine.status), ('out_of_stock', 'in_stock'))
+        self.assertEqual(rollups.verify(), [])
+        self.assertEqual(VaccineInventory.objects.refresh_status(), 0)
+
+
+IMPORT_HEADER = (
+    'vaccine,vaccine_name,vaccine_type,manufacturer,lot_number,current_stock,min_stock_level,'
+    'doses_per_vial,expiration_date,storage_temperature'
+)
+
+
+def import_line(lot_number, stock=10, vaccine='', name='Polio', expires='2030-01-31'):
+    return f'{vaccine},{name},inactivated,Acme,{lot_number},{stock},5,1,{expires},2-8C'
+
+
+class InventoryImportTests(TestCase):
+    def setUp(self):
+        self.vaccine = Vaccine.objects.create(name='MMR', vaccine_type='live')
+
+    def run_import(self, lines, **kwargs):
+        return inventory_import.import_lots([IMPORT_HEADER, *lines], **kwargs)
+
+    def test_valid_file(self):
+        result = self.run_import([import_line('A-1', vaccine=self.vaccine.pk, name=''), import_line('P-1', stock=2)])
+
+        self.assertEqual((result.created, result.vaccines_created, result.failed), (2, 1, 0))
+        mmr = VaccineInventory.objects.get(lot_number='A-1')
+        self.assertEqual((mmr.vaccine, mmr.vaccine_name), (self.vaccine, 'MMR'))
+        polio = VaccineInventory.objects.get(lot_number='P-1')
+        self.assertEqual((polio.vaccine.name, polio.status), ('Polio', 'low_stock'))
+        self.assertEqual(ledger.verify(), [])
+        self.assertEqual(rollups.verify(), [])
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        result = self.run_import([
+            import_line('P-1'),
+            import_line('P-2', stock=-4),
+            import_line('', stock=3),
+            import_line('P-4', vaccine=9999, name=''),
+            import_line('P-5', expires='someday'),
+            import_line('P-6'),
+        ])
+
+        self.assertEqual((result.created, result.failed), (2, 4))
+        self.assertEqual([line for line, _ in result.errors], [3, 4, 5, 6])
+        self.assertIn('current_stock', result.errors[0][1])
+        self.assertIn('lot_number', result.errors[1][1])
+        self.assertIn('vaccine', result.errors[2][1])
+        self.assertIn('expiration_date', result.errors[3][1])
+        self.assertEqual(sorted(VaccineInventory.objects.values_list('lot_number', flat=True)), ['P-1', 'P-6'])
+
+    def test_json_lines(self):
+        lines = [
+            json.dumps({'vaccine': self.vaccine.pk, 'vaccine_type': 'live', 'manufacturer': 'Acme', 'lot_number': 'J-1',
+                        'current_stock': 4, 'min_stock_level': 2, 'doses_per_vial': 1,
+                        'expiration_date': '2030-01-01', 'storage_temperature': '2-8C'}),
+            '',
+            '{not json',
+            '[1, 2]',
+        ]
+        result = inventory_import.import_lots(lines, 'jsonl')
+        self.assertEqual((result.created, result.failed), (1, 2))
+        self.assertEqual([line for line, _ in result.errors], [3, 4])
+
+    def test_file_larger_than_one_chunk(self):
+        lines = [import_line(f'P-{number}') for number in range(7)]
+        lines[4] = import_line('P-4', stock='many')
+        result = self.run_import(lines, chunk_size=3)
+
+        self.assertEqual((result.created, result.vaccines_created, result.failed), (6, 1, 1))
+        self.assertEqual(result.errors[0][0], 6)
+        self.assertEqual(Vaccine.objects.filter(name='Polio').count(), 1)
+        self.assertEqual(VaccineInventory.objects.filter(vaccine__name='Polio').count(), 6)
+        self.assertEqual(ledger.verify(), [])
+
+    def test_dry_run_saves_nothing(self):
+        result = self.run_import([import_line('P-1')], dry_run=True)
+        self.assertEqual(result.created, 1)
+        self.assertFalse(VaccineInventory.objects.exists())
+        self.assertFalse(Vaccine.objects.filter(name='Polio').exists())
+
+
+class InventoryImportApiTests(TestCase):
+    url = '/api/inventory/import/'
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('nurse', password='x'))
+
+    def test_upload(self):
+        upload = SimpleUploadedFile('lots.csv', '\n'.join([IMPORT_HEADER, import_line('P-1'), import_line('')]).encode())
+        data = self.client.post(self.url, {'file': upload}).json()
+        self.assertEqual((data['success'], data['created'], data['failed']), (True, 1, 1))
+        self.assertEqual(data['errors'][0]['line'], 3)
+        self.assertIn('lot_number', data['errors'][0]['errors'])
+
+    def test_raw_body_dry_run(self):
+        body = '\n'.join([IMPORT_HEADER, import_line('P-1')])
+        response = self.client.post(f'{self.url}?format=csv&dry_run=1', body, content_type='text/csv')
+        self.assertEqual(response.json()['created'], 1)
+        self.assertFalse(VaccineInventory.objects.exists())
+
+    def test_error_responses(self):
+        response = self.client.post(f'{self.url}?format=xml', 'x', content_type='text/xml')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Unsupported format', response.json()['error'])
+
+        response = self.client.post(f'{self.url}?format=csv', b'\xff\xfe\x00bad', content_type='text/csv')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'The file must be UTF-8 encoded')
+
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+
+
+class BulkAdjustTests(TestCase):
+    url = '/api/inventory/adjust/'
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('nurse', password='x'))
+        self.lot = create_lot(stock=30)
+        self.other = VaccineInventory.objects.create(
+            vaccine=self.lot.vaccine, lot_number='LOT-2', current_stock=4, expiration_date=self.lot.expiration_date
+        )
+
+    def post(self, changes):
+        return self.client.post(self.url, json.dumps({'changes': changes}), content_type='application/json')
+
+    def test_bulk_adjust_reports_partial_failures(self):
+        results = VaccineInventory.objects.bulk_adjust({
+            self.lot.pk: {'delta': -25},
+            self.other.pk: {'delta': -5},
+            9999: {'delta': 1},
+        })
+
+        self.assertEqual(results[self.lot.pk].new_stock, 5)
+        self.assertEqual(results[self.lot.pk].new_status, 'low_stock')
+        self.assertEqual(results[self.other.pk], f"Not enough stock in vaccine inventory {self.other.pk} (4 doses left).")
+        self.assertEqual(results[9999], "Vaccine inventory 9999 does not exist.")
+        self.other.refresh_from_db()
+        self.assertEqual(self.other.current_stock, 4)
+        self.assertEqual(ledger.verify(), [])
+        self.assertEqual(rollups.verify(), [])
+
+    def test_status_follows_new_stock_and_minimum(self):
+        self.post([
+            {'id': self.lot.pk, 'min_stock_level': 200},
+            {'id': self.other.pk, 'current_stock': 0, 'lot_number': 'LOT-2B'},
+        ])
+        self.lot.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual((self.lot.current_stock, self.lot.status), (30, 'critical'))
+        self.assertEqual((self.other.lot_number, self.other.status), ('LOT-2B', 'out_of_stock'))
+        self.assertEqual(rollups.verify(), [])
+
+    def test_api_reports_a_result_per_change(self):
+        data = self.post([
+            {'id': self.lot.pk, 'delta': -10},
+            {'id': self.other.pk, 'delta': -5},
+            {'id': 9999, 'delta': 1},
+            {'id': self.lot.pk, 'delta': 1},
+            {'id': self.lot.pk, 'delta': 1, 'current_stock': 3},
+            {'id': self.other.pk, 'colour': 'red'},
+            {'delta': 1},
+            {'id': self.other.pk, 'expiration_date': 'soon'},
+        ]).json()
+
+        self.assertEqual((data['success'], data['updated'], data['failed']), (False, 1, 7))
+        results = data['results']
+        self.assertEqual(results[0], {'index': 0, 'id': self.lot.pk, 'success': True, 'current_stock': 20, 'status': 'in_stock'})
+        self.assertIn('Not enough stock', results[1]['error'])
+        self.assertIn('does not exist', results[2]['error'])
+        self.assertEqual(results[3]['error'], 'Duplicate id in this batch.')
+        self.assertEqual(results[4]['error'], 'Give either delta or current_stock, not both.')
+        self.assertEqual(results[5]['error'], 'Unknown fields: colour.')
+        self.assertEqual(results[6]['error'], 'A numeric id is required.')
+        self.assertTrue(results[7]['error'].startswith('expiration_date:'))
+
+    def test_api_rejects_malformed_requests(self):
+        response = self.client.post(self.url, '{', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(self.url, json.dumps({'changes': 'all'}), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class ExpirySweepTests(TestCase):
+    def setUp(self):
+        self.today = date(2024, 6, 1)
+        vaccine = Vaccine.objects.create(name='MMR', vaccine_type='live')
+        self.lots = {
+            days: VaccineInventory.objects.create(
+                vaccine=vaccine, lot_number=f'LOT{days}', current_stock=10, expiration_date=self.today + timedelta(days=days)
+            )
+            for days in (-30, -1, 0, 7, 45)
+        }
+
+    def sweep(self, *args):
+        out = StringIO()
+        call_command('sweep_expired_inventory', '--date', self.today.isoformat(), *args, stdout=out)
+        return out.getvalue()
+
+    def test_expiry_windows(self):
+        windows = VaccineInventory.objects.expiry_windows(self.today)
+        self.assertEqual((windows['expired_lots'], windows['expired_doses']), (2, 20))
+        self.assertEqual(windows['within_7_days_lots'], 2)
+        self.assertEqual(windows['within_30_days_lots'], 2)
+        self.assertEqual(windows['within_90_days_doses'], 30)
+
+    def test_dashboard_counts_expired_lots_apart(self):
+        stats = get_inventory_stats(self.today)
+        self.assertEqual((stats.expiring_soon_count, stats.expired_count, stats.vaccine_types), (2, 2, 1))
+        self.assertEqual(stats.expiring_soon_count, VaccineInventory.objects.expiring_within(30, self.today).count())
+
+    def test_sweep_writes_off_expired_lots_in_batches(self):
+        self.assertIn('2 lots would be written off', self.sweep('--dry-run'))
+        self.assertFalse(WastageRecord.objects.exists())
+
+        self.assertIn('Wrote off 2 expired lots (20 doses)', self.sweep('--batch-size', '1'))
+        for days, lot in self.lots.items():
+            lot.refresh_from_db()
+            self.assertEqual((lot.is_usable, lot.current_stock), (days >= 0, 0 if days < 0 else 10))
+        self.assertEqual(WastageRecord.objects.filter(reason='expired').aggregate(n=Sum('doses'))['n'], 20)
+        self.assertEqual(ledger.verify(), [])
+        self.assertEqual(rollups.verify(), [])
+
+        # Written-off lots are not swept again
+        self.assertIn('Wrote off 0 expired lots', self.sweep())
+        self.assertEqual(WastageRecord.objects.count(), 2)
+
+    def test_batch_size_must_be_positive(self):
+        for size in ('0', '-5'):
+            with self.assertRaises(CommandError):
+                self.sweep('--batch-size', size)
+        self.assertFalse(WastageRecord.objects.exists())
+
+    def test_written_off_lot_cannot_be_administered(self):
+        lot = self.lots[-1]
+        VaccineInventory.objects.filter(pk=lot.pk).write_off('damaged')
+        VaccineInventory.objects.filter(pk=lot.pk).update(current_stock=5)
+        record = VaccinationRecord(
+            patient=create_patient(User.objects.create_user('nurse', password='x'), 1),
+            vaccine=lot.vaccine, inventory_used=lot, date_administered=self.today,
+        )
+        with self.assertRaises(ValidationError):
+            record.full_clean()
+
+
+class AllocationTests(TestCase):
+    def setUp(self):
+        self.today = date.today()
+        self.user = User.objects.create_user('nurse', password='x')
+        self.vaccine = Vaccine.objects.create(name='MMR', vaccine_type='live')
+        self.other_vaccine = Vaccine.objects.create(name='DTaP', vaccine_type='combination')
+        self.patients = [create_patient(self.user, number) for number in range(4)]
+
+    def lot(self, lot_number, stock, expires_in, vaccine=None, **fields):
+        return VaccineInventory.objects.create(
+            vaccine=vaccine or self.vaccine, lot_number=lot_number, current_stock=stock,
+            expiration_date=self.today + timedelta(days=expires_in), **fields
+        )
+
+    def record(self, number, vaccine=None, **fields):
+        return VaccinationRecord(
+            patient=self.patients[number], vaccine=vaccine or self.vaccine, date_administered=self.today,
+            status='scheduled', **fields
+        )
+
+    def stock(self, lot):
+        lot.refresh_from_db()
+        return lot.current_stock
+
+    def test_first_expiring_usable_lot_is_used(self):
+        self.lot('EXPIRED', 5, -1)
+        self.lot('RETIRED', 5, 5, is_usable=False)
+        self.lot('EMPTY', 0, 6)
+        first = self.lot('FIRST', 2, 10)
+        later = self.lot('LATER', 5, 90)
+
+        record = self.record(0)
+        self.assertEqual(allocation.allocate(record, self.today), first)
+        record.refresh_from_db()
+        self.assertEqual((record.status, record.lot_number, record.stock_deducted_from_id), ('administered', 'FIRST', first.pk))
+        self.assertEqual(allocation.allocate(self.record(1), self.today), first)
+        self.assertEqual(allocation.allocate(self.record(2), self.today), later)
+        self.assertEqual((self.stock(first), self.stock(later)), (0, 4))
+
+    def test_lot_emptied_concurrently_is_skipped(self):
+        raced = self.lot('RACED', 1, 10)
+        spare = self.lot('SPARE', 3, 20)
+        # The candidates were read just before another nurse took the last dose of RACED
+        VaccineInventory.objects.adjust_stock(raced.pk, -1)
+        stale = VaccineInventory.objects.filter(pk__in=[raced.pk, spare.pk]).order_by('expiration_date', 'pk')
+
+        record = self.record(0, expiration_date=None)
+        with mock.patch.object(allocation, 'usable_lots', return_value=stale):
+            self.assertEqual(allocation.allocate(record, self.today), spare)
+        record.refresh_from_db()
+        self.assertEqual((record.lot_number, record.expiration_date), ('SPARE', spare.expiration_date))
+        self.assertEqual((self.stock(raced), self.stock(spare)), (0, 2))
+        self.assertEqual(ledger.verify(), [])
+
+    def test_failed_allocation_leaves_the_record_as_passed_in(self):
+        self.lot('ONLY', 1, 10)
+        allocation.allocate(self.record(0), self.today)
+
+        record = self.record(1, lot_number='HANDWRITTEN')
+        with self.assertRaises(ValidationError):
+            allocation.allocate(record, self.today)
+        self.assertEqual((record.pk, record.status, record.inventory_used_id), (None, 'scheduled', None))
+        self.assertEqual(record.lot_number, 'HANDWRITTEN')
+
+    def test_only_stock_shortages_are_retried(self):
+        lot = self.lot('FIRST', 5, 10)
+        self.lot('SECOND', 5, 20)
+        record = self.record(0)
+        with mock.patch.object(VaccinationRecord, 'save', side_effect=ValidationError('Invalid record')) as save:
+            with self.assertRaisesMessage(ValidationError, 'Invalid record'):
+                allocation.allocate(record, self.today)
+        self.assertEqual(save.call_count, 1)
+        self.assertEqual((record.status, record.inventory_used_id), ('scheduled', None))
+        self.assertEqual(self.stock(lot), 5)
+
+    def test_session_is_allocated_first_expiring_first(self):
+        first = self.lot('FIRST', 2, 10)
+        later = self.lot('LATER', 5, 30)
+        other = self.lot('OTHER', 5, 30, vaccine=self.other_vaccine)
+        records = [self.record(number) for number in range(3)] + [self.record(0, vaccine=self.other_vaccine)]
+
+        plan = allocation.allocate_session(records, self.today)
+        self.assertEqual([lot.lot_number for _, lot in plan], ['FIRST', 'FIRST', 'LATER', 'OTHER'])
+        self.assertEqual((self.stock(first), self.stock(later), self.stock(other)), (0, 4, 4))
+        self.assertEqual(VaccinationRecord.objects.filter(status='administered').count(), 4)
+        self.assertEqual(ledger.verify(), [])
+        self.assertEqual(rollups.verify(), [])
+
+    def test_session_movements_reference_their_records(self):
+        first = self.lot('FIRST', 2, 10)
+        later = self.lot('LATER', 5, 30)
+        records = [self.record(number) for number in range(3)]
+        allocation.allocate_session(records, self.today)
+
+        movements = StockMovement.objects.filter(kind='administration')
+        self.assertEqual(
+            sorted(movements.values_list('record_id', 'inventory_id', 'quantity')),
+            sorted([(records[0].pk, first.pk, -1), (records[1].pk, first.pk, -1), (records[2].pk, later.pk, -1)]),
+        )
+        self.assertEqual(ledger.verify(), [])
+
+    def test_session_is_all_or_nothing(self):
+        lot = self.lot('MMR', 5, 10)
+        other = self.lot('DTAP', 1, 10, vaccine=self.other_vaccine)
+        records = [self.record(0), self.record(1, vaccine=self.other_vaccine), self.record(2, vaccine=self.other_vaccine)]
+        with self.assertRaisesMessage(ValidationError, 'needs 2 doses, 1 left'):
+            allocation.allocate_session(records, self.today)
+
+        # A record failing to save rolls back the whole session
+        records = [self.record(0), self.record(1), self.record(0)]  # the last one repeats the first dose
+        with self.assertRaises(IntegrityError):
+            allocation.allocate_session(records, self.today)
+
+        self.assertEqual((self.stock(lot), self.stock(other)), (5, 1))
+        self.assertFalse(VaccinationRecord.objects.exists())
+        self.assertEqual([(record.pk, record.status) for record in records], [(None, 'scheduled')] * 3)
+        self.assertEqual(ledger.verify(), [])
+        self.assertEqual(rollups.verify(), [])
+
+
+class StockLedgerTests(TestCase):
+    def setUp(self):
+        self.lot = create_lot(stock=10)
+
+    def test_replaying_the_movements_gives_the_current_stock(self):
+        other = VaccineInventory.objects.create(
+            vaccine=self.lot.vaccine, lot_number='LOT-2', current_stock=5, expiration_date=self.lot.expiration_date
+        )
+        VaccineInventory.objects.adjust_stock(self.lot.pk, -3)
+        VaccineInventory.objects.transfer_stock(self.lot.pk, other.pk, 2)
+        VaccineInventory.objects.bulk_adjust({self.lot.pk: {'delta': 4}, other.pk: {'current_stock': 1}})
+        self.lot.refresh_from_db()
+        self.lot.current_stock = 20
+        self.lot.save()
+        VaccineInventory.objects.filter(pk=other.pk).write_off('damaged')
+
+        for lot in (self.lot, other):
+            lot.refresh_from_db()
+            replayed = lot.stock_movements.aggregate(total=Sum('quantity'))['total']
+            self.assertEqual(replayed, lot.current_stock)
+        self.assertEqual(ledger.verify(), [])
+        self.assertEqual(rollups.verify(), [])
+
+    def test_stock_at_reads_across_a_snapshot(self):
+        received = timezone.now()
+        VaccineInventory.objects.adjust_stock(self.lot.pk, -3)
+        snapshot = timezone.now()
+        self.assertEqual(ledger.take_snapshot(snapshot), 1)
+        self.assertIsNone(ledger.take_snapshot(snapshot))
+        VaccineInventory.objects.adjust_stock(self.lot.pk, -2)
+
+        self.assertEqual(ledger.stock_at(received), {self.lot.pk: 10})
+        self.assertEqual(ledger.stock_at(snapshot), {self.lot.pk: 7})
+        self.assertEqual(ledger.stock_at(timezone.now()), {self.lot.pk: 5})
+
+        # Later reads start from the snapshot, not from the first movement
+        self.lot.stock_movements.filter(occurred_at__lte=snapshot).delete()
+        self.assertEqual(ledger.stock_at(timezone.now()), {self.lot.pk: 5})
+        self.assertEqual(ledger.stock_at(timezone.now(), VaccineInventory.objects.exclude(pk=self.lot.pk)), {})
+
+    def test_saving_a_lot_reads_its_stored_state_once(self):
+        self.lot.current_stock = 8
+        with CaptureQueriesContext(connection) as queries:
+            self.lot.save()
+        reads = [query['sql'] for query in queries if query['sql'].startswith('SELECT') and 'vaccineinventory' in query['sql']]
+        self.assertEqual(len(reads), 1)
+        self.assertEqual(ledger.verify(), [])
+        self.assertEqual(rollups.verify(), [])
+
+
+class ForecastTests(TestCase):
+    today = date(2024, 6, 1)
+    config = {**forecasting.DEFAULTS, 'HISTORY_MONTHS': 24, 'RECENT_DAYS': 28, 'HORIZON_DAYS': 120}
+
+    def forecast(self, stock, monthly=None, recent=None, booked=None):
+        config = self.config
+        monthly = np.zeros((len(stock), config['HISTORY_MONTHS'])) if monthly is None else monthly
+        recent = np.zeros((len(stock), config['RECENT_DAYS'])) if recent is None else recent
+        booked = np.zeros((len(stock), config['HORIZON_DAYS'])) if booked is None else booked
+        return forecasting.compute_forecast(monthly, recent, booked, np.array(stock, dtype=float), self.today, config)
+
+    def test_steady_consumption(self):
+        result = self.forecast([100, 20], recent=np.full((2, 28), 2.0))
+
+        np.testing.assert_allclose(result['rate'], [2, 2])
+        np.testing.assert_allclose(result['days_of_cover'], [50, 10])
+        self.assertEqual(result['stockout_day'].tolist(), [49, 9])
+        self.assertEqual(result['reorder_point'].tolist(), [28, 28])  # 14 lead days, no variability
+        self.assertEqual(result['reorder_quantity'].tolist(), [0, 68])  # 44 days of demand less the stock
+        self.assertEqual(result['needs_reorder'].tolist(), [False, True])
+
+    def test_unused_vaccine_never_runs_out(self):
+        result = self.forecast([5])
+        self.assertEqual(result['stockout_day'].tolist(), [-1])
+        self.assertTrue(np.isinf(result['days_of_cover'][0]))
+        self.assertFalse(result['needs_reorder'][0])
+
+    def test_booked_doses_raise_demand(self):
+        booked = np.zeros((1, 120))
+        booked[0, 3] = 30
+        result = self.forecast([25], recent=np.full((1, 28), 1.0), booked=booked)
+        self.assertEqual(result['booked'].tolist(), [30])
+        self.assertEqual(result['stockout_day'].tolist(), [3])
+
+    def test_seasonal_months_are_weighted(self):
+        # Two years using 31 doses every June and 1 in every other month
+        monthly = np.ones((1, 24))
+        monthly[0, [0, 12]] = 31  # June 2022 and June 2023
+        result = self.forecast([1000], monthly=monthly, recent=np.ones((1, 28)))
+        self.assertGreater(result['seasonal_index'][0], 5)
+
+        flat = self.forecast([1000], monthly=np.ones((1, 24)), recent=np.ones((1, 28)))
+        self.assertAlmostEqual(flat['seasonal_index'][0], 1, delta=0.05)
+
+    def test_forecast_from_the_database(self):
+        user = User.objects.create_user('nurse', password='x')
+        patients = [create_patient(user, number) for number in range(30)]
+        lot = create_lot(stock=10)
+        VaccineInventory.objects.create(
+            vaccine=lot.vaccine, lot_number='OLD', current_stock=50, expiration_date=self.today - timedelta(days=1)
+        )
+        for number, patient in enumerate(patients[:28]):
+            create_record(patient, lot.vaccine, self.today - timedelta(days=number + 1))
+        create_record(patients[29], lot.vaccine, self.today + timedelta(days=2), status='scheduled')
+        idle = Vaccine.objects.create(name='Rabies', vaccine_type='inactivated')
+
+        with override_settings(FORECAST=self.config):
+            forecasts = forecasting.forecast_all(self.today)
+
+        self.assertEqual([forecast.vaccine_id for forecast in forecasts], [lot.vaccine_id, idle.pk])
+        mmr = forecasts[0]
+        self.assertEqual((mmr.stock, mmr.booked_doses, mmr.needs_reorder), (10, 1, True))
+        self.assertAlmostEqual(mmr.daily_rate, 1.0)
+        self.assertEqual(mmr.stockout_date, self.today + timedelta(days=9))
+        self.assertEqual(forecasts[1].as_dict()['days_of_cover'], None)
+
+
+class CatalogPropagationTests(TestCase):
+    def setUp(self):
+        self.vaccine = Vaccine.objects.create(
+            name='MMR', vaccine_type='live', manufacturer='Acme', target_diseases='Measles', storage_temperature='2-8C'
+        )
+        self.lots = [
+            VaccineInventory.objects.create(
+                vaccine=self.vaccine, lot_number=f'LOT-{number}', current_stock=10, expiration_date=date(2030, 1, 1)
+            )
+            for number in range(3)
+        ]
+        self.unrelated = create_lot(stock=5)
+
+    def test_catalog_edits_reach_every_lot_in_one_update(self):
+        self.vaccine.manufacturer = 'Globex'
+        self.vaccine.target_diseases = 'Measles, Mumps, Rubella'
+        with CaptureQueriesContext(connection) as queries:
+            self.vaccine.save()
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "vaccineapp_vaccineinventory"')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"manufacturer"', updates[0])
+        self.assertNotIn('"storage_temperature"', updates[0])
+
+        for lot in self.lots:
+            lot.refresh_from_db()
+            self.assertEqual((lot.manufacturer, lot.target_diseases), ('Globex', 'Measles, Mumps, Rubella'))
+        self.unrelated.refresh_from_db()
+        self.assertIsNone(self.unrelated.manufacturer)
+
+    def test_saving_unchanged_catalog_fields_updates_no_lot(self):
+        self.vaccine.description = 'Live attenuated'
+        with CaptureQueriesContext(connection) as queries:
+            self.vaccine.save()
+        self.assertFalse([query for query in queries if 'vaccineapp_vaccineinventory' in query['sql']])
+
+    def test_drifted_lots_are_reconciled(self):
+        # Empty and missing values compare equal
+        Vaccine.objects.filter(pk=self.vaccine.pk).update(storage_temperature='')
+        VaccineInventory.objects.filter(vaccine=self.vaccine).update(storage_temperature=None)
+        VaccineInventory.objects.filter(pk=self.lots[0].pk).update(vaccine_name='M.M.R.', manufacturer=None)
+        self.assertEqual(list(VaccineInventory.objects.catalog_drift()), [self.lots[0]])
+
+        with self.assertRaises(CommandError):
+            call_command('reconcile_inventory_catalog', '--check', stdout=StringIO())
+        call_command('reconcile_inventory_catalog', stdout=StringIO())
+        self.assertFalse(VaccineInventory.objects.catalog_drift().exists())
+        self.lots[0].refresh_from_db()
+        self.assertEqual((self.lots[0].vaccine_name, self.lots[0].manufacturer), ('MMR', 'Acme'))
+
+
+class VaccineDetailApiTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('nurse', password='x')
+        self.client.force_login(self.user)
+        self.lot = create_lot(stock=10)
+        self.url = f'/api/vaccines/{self.lot.pk}/'
+
+    def test_details(self):
+        create_record(create_patient(self.user, 1), self.lot.vaccine, date.today())
+        data = self.client.get(self.url).json()
+        self.assertEqual((data['name'], data['lot_number'], data['current_stock']), ('MMR', 'LOT-1', 10))
+        self.assertEqual(data['administered_count'], 1)
+        self.assertEqual(self.client.get('/api/vaccines/9999/').status_code, 404)
+
+    def test_matching_etag_is_answered_with_304(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        revalidated = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated['ETag'], etag)
+
+    def test_etag_changes_with_the_lot_its_vaccine_and_its_count(self):
+        etags = [self.client.get(self.url)['ETag']]
+        VaccineInventory.objects.adjust_stock(self.lot.pk, -1)
+        etags.append(self.client.get(self.url)['ETag'])
+        self.lot.vaccine.description = 'Live attenuated'
+        self.lot.vaccine.save()
+        etags.append(self.client.get(self.url)['ETag'])
+        create_record(create_patient(self.user, 1), self.lot.vaccine, date.today())
+        etags.append(self.client.get(self.url)['ETag'])
+
+        self.assertEqual(len(set(etags)), 4)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etags[0]).status_code, 200)
+
+
+class VaccineBatchDetailApiTests(TestCase):
+    url = '/api/vaccines/batch/'
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('nurse', password='x'))
+        self.lot = create_lot(stock=3)
+        self.lots = [self.lot] + [
+            VaccineInventory.objects.create(
+                vaccine=self.lot.vaccine, lot_number=f'LOT-{number}', current_stock=40,
+                expiration_date=date.today() + timedelta(days=number * 100),
+            )
+            for number in (2, 3)
+        ]
+
+    def get(self, **params):
+        return self.client.get(self.url, params)
+
+    def test_lots_by_id_with_selected_fields(self):
+        ids = [self.lots[2].pk, 9999, self.lots[0].pk, self.lots[2].pk]
+        data = self.get(ids=','.join(map(str, ids)), fields='lot_number,current_stock').json()
+        self.assertEqual(data['items'], [
+            {'lot_number': 'LOT-1', 'current_stock': 3},
+            {'lot_number': 'LOT-3', 'current_stock': 40},
+        ])
+        self.assertEqual((data['missing'], data['truncated']), ([9999], False))
+
+    def test_lots_by_filter(self):
+        data = self.get(filter='low_stock', fields='lot_number').json()
+        self.assertEqual(data['items'], [{'lot_number': 'LOT-1'}])
+        self.assertNotIn('missing', data)
+        self.assertEqual(len(self.get(q='lot-', fields='administered_count').json()['items']), 3)
+
+    def test_result_is_capped(self):
+        with mock.patch('vaccineapp.views.MAX_BATCH_DETAILS', 2):
+            data = self.get(filter='all', fields='lot_number').json()
+            self.assertEqual((len(data['items']), data['truncated']), (2, True))
+            self.assertEqual(self.get(ids='1,2,3').status_code, 400)
+
+    def test_errors(self):
+        self.assertEqual(self.get().status_code, 400)
+        self.assertEqual(self.get(ids='1,x').json()['error'], 'Invalid ids')
+        self.assertEqual(self.get(ids='1', fields='lot_number,secret').json()['error'], 'Unknown fields: secret')
+
+
+class KeysetPaginationTests(TestCase):
+    url = '/api/records/'
+
+    def setUp(self):
+        self.user = User.objects.create_user('nurse', password='x')
+        self.client.force_login(self.user)
+        vaccine = Vaccine.objects.create(name='MMR', vaccine_type='live')
+        days = [date(2024, 1, 1)] * 4 + [date(2024, 1, 2)] * 3 + [date(2024, 1, 3)]
+        self.records = [
+            create_record(create_patient(self.user, number), vaccine, day) for number, day in enumerate(days)
+        ]
+        create_record(create_patient(User.objects.create_user('other', password='x'), 99), vaccine, date(2024, 1, 2))
+
+    def walk(self, **params):
+        """Follow next_cursor through every page, returning the record ids in order"""
+        ids, cursor = [], None
+        while True:
+            data = self.client.get(self.url, {**params, **({'cursor': cursor} if cursor else {})}).json()
+            ids += [item['id'] for item in data['items']]
+            cursor = data['next_cursor']
+            self.assertEqual(data['has_more'], cursor is not None)
+            if cursor is None:
+                return ids
+
+    def test_pages_continue_across_ties(self):
+        expected = [
+            record.pk for record in sorted(self.records, key=lambda record: (record.date_administered, record.pk), reverse=True)
+        ]
+        for page_size in (1, 2, 3, 8):
+            self.assertEqual(self.walk(page_size=page_size), expected)
+        self.assertEqual(self.walk(page_size=3, sort='date'), expected[::-1])
+
+    def test_new_rows_do_not_shift_later_pages(self):
+        first = self.client.get(self.url, {'page_size': 3}).json()
+        create_record(create_patient(self.user, 50), self.records[0].vaccine, date(2024, 1, 9))
+        second = self.client.get(self.url, {'page_size': 3, 'cursor': first['next_cursor']}).json()
+        seen = [item['id'] for item in first['items'] + second['items']]
+        self.assertEqual(len(set(seen)), 6)
+
+    def test_cursor_of_another_sort_is_rejected(self):
+        cursor = self.client.get(self.url, {'page_size': 2}).json()['next_cursor']
+        response = self.client.get(self.url, {'cursor': cursor, 'sort': 'date'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'The cursor does not match the requested sort order.')
+
+    def test_malformed_cursors_are_rejected(self):
+        for cursor in (
+            'not base64!',
+            encode_cursor('-date', ['not-a-date', 1]),
+            encode_cursor('-date', ['2024-01-01', 'one']),
+            encode_cursor('-date', [{'day': 1}, 1]),
+            encode_cursor('-date', ['2024-01-01']),
+        ):
+            response = self.client.get(self.url, {'cursor': cursor})
+            self.assertEqual(response.status_code, 400, cursor)
+
+
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('nurse', password='x')
+        self.lot = create_lot(stock=20)
+        self.patient = create_patient(self.user, 1)
+        self.record = create_record(self.patient, self.lot.vaccine, date(2024, 1, 1))
+
+    def test_bulk_adjust_reindexes_edited_lots(self):
+        VaccineInventory.objects.bulk_adjust({self.lot.pk: {'lot_number': 'ZEBRA-9', 'notes': 'quarantined'}})
+        self.assertEqual(search.search_ids('lot', 'zebra quarantined'), [self.lot.pk])
+        self.assertEqual(search.search_ids('lot', 'LOT-1'), [])
+
+    def test_catalog_edits_reindex_lots(self):
+        vaccine = self.lot.vaccine
+        vaccine.manufacturer = 'Globex'
+        vaccine.target_diseases = 'Rubella'
+        vaccine.save()
+        self.assertEqual(search.search_ids('lot', 'globex rubella'), [self.lot.pk])
+
+    def test_catalog_sync_reindexes_drifted_lots(self):
+        Vaccine.objects.filter(pk=self.lot.vaccine_id).update(manufacturer='Initech')
+        VaccineInventory.objects.sync_catalog()
+        self.assertEqual(search.search_ids('lot', 'initech'), [self.lot.pk])
+
+    def test_patient_records_reindexed_only_on_name_change(self):
+        self.patient.patient_phone = '555-0100'
+        with CaptureQueriesContext(connection) as queries:
+            self.patient.save()
+        self.assertFalse([query for query in queries if 'vaccineapp_vaccinationrecord' in query['sql']])
+
+        self.patient.last_name = 'Renamed'
+        self.patient.save()
+        self.assertEqual(search.search_ids('record', 'renamed'), [self.record.pk])
+
+
+class PatientDirectoryTests(TestCase):
+    url = '/api/patients/directory/'
+
+    def setUp(self):
+        self.user = User.objects.create_user('nurse', password='x')
+        self.client.force_login(self.user)
+        mmr = Vaccine.objects.create(name='MMR', vaccine_type='live')
+        polio = Vaccine.objects.create(name='Polio', vaccine_type='inactivated')
+        # Ada: MMR complete, Polio dose 1 of 3 with the next dose due
+        self.ada = Patient.objects.create(user=self.user, first_name='Ada', last_name='Byron', date_of_birth=date(2020, 1, 1))
+        create_record(self.ada, mmr, date(2024, 1, 10), total_doses=1)
+        create_record(self.ada, polio, date(2024, 2, 10), total_doses=3, next_due_date=date(2024, 4, 10))
+        # Ben: one scheduled dose only
+        self.ben = Patient.objects.create(user=self.user, first_name='Ben', last_name='Adams', date_of_birth=date(2021, 1, 1))
+        create_record(self.ben, mmr, date(2024, 5, 1), status='scheduled')
+        # Cy: polio dose 1 superseded by dose 2, so its due date no longer counts
+        self.cy = Patient.objects.create(user=self.user, first_name='Cy', last_name='Cole', date_of_birth=date(2022, 1, 1))
+        create_record(self.cy, polio, date(2024, 1, 1), total_doses=3, next_due_date=date(2024, 2, 1))
+        create_record(self.cy, polio, date(2024, 3, 1), dose_number=2, total_doses=3, next_due_date=date(2024, 6, 1))
+        # Another user's patient never shows up
+        create_patient(User.objects.create_user('other', password='x'), 1)
+
+    def items(self, **params):
+        return {item['first_name']: item for item in self.client.get(self.url, params).json()['items']}
+
+    def test_vaccination_status_is_annotated(self):
+        items = self.items()
+        self.assertEqual(set(items), {'Ada', 'Ben', 'Cy'})
+        ada, ben, cy = items['Ada'], items['Ben'], items['Cy']
+        self.assertEqual(
+            (ada['dose_count'], ada['last_vaccination'], ada['started_series'], ada['completed_series']),
+            (2, '2024-02-10', 2, 1),
+        )
+        self.assertEqual(ada['series_completion'], 50.0)
+        self.assertEqual(ada['next_due_date'], '2024-04-10')
+        self.assertEqual((ben['dose_count'], ben['last_vaccination'], ben['series_completion']), (0, None, None))
+        self.assertEqual(ben['next_due_date'], '2024-05-01')
+        self.assertEqual((cy['dose_count'], cy['series_completion'], cy['next_due_date']), (2, 0.0, '2024-06-01'))
+
+    def test_sorts_put_missing_values_last(self):
+        def order(sort):
+            return [item['first_name'] for item in self.client.get(self.url, {'sort': sort}).json()['items']]
+        self.assertEqual(order('name'), ['Ben', 'Ada', 'Cy'])
+        self.assertEqual(order('-completion'), ['Ada', 'Cy', 'Ben'])
+        self.assertEqual(order('completion'), ['Cy', 'Ada', 'Ben'])
+        self.assertEqual(order('last_vaccination'), ['Ada', 'Cy', 'Ben'])
+        self.assertEqual(order('-last_vaccination'), ['Cy', 'Ada', 'Ben'])
+        self.assertEqual(order('next_due'), ['Ada', 'Ben', 'Cy'])
+        self.assertEqual(self.client.get(self.url, {'sort': 'bogus'}).json()['sort'], 'name')
+
+    def test_pages_are_counted_without_counting_the_annotated_query(self):
+        for number in range(10):
+            create_patient(self.user, number)
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(self.url, {'page_size': 5, 'page': 3}).json()
+        self.assertEqual((data['total'], data['vaccinated'], data['num_pages']), (13, 2, 3))
+        self.assertEqual((len(data['items']), data['has_next'], data['has_previous']), (3, False, True))
+        self.assertFalse([query for query in queries if 'COUNT(*)' in query['sql'] and 'GROUP BY' in query['sql']])
+
+        with CaptureQueriesContext(connection) as more_queries:
+            self.client.get(self.url, {'page_size': 5, 'page': 1})
+        self.assertEqual(len(more_queries), len(queries))
+
+
+class CohortTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('nurse', password='x')
+        # Month ends, leap days and their neighbours, where calendar-month arithmetic is clamped
+        self.birthdays = sorted({
+            day
+            for year in range(2019, 2025)
+            for month in range(1, 13)
+            for day in (
+                date(year, month, 28),
+                next_month_start(year, month) - timedelta(days=1),
+                next_month_start(year, month) - timedelta(days=2),
+                next_month_start(year, month),
+            )
+        })
+        Patient.objects.bulk_create([
+            Patient(user=user, first_name=f'Patient{number}', last_name='Test', date_of_birth=day)
+            for number, day in enumerate(self.birthdays)
+        ])
+
+    def test_counts_match_exact_ages_around_month_ends(self):
+        bands = cohorts.parse_bands(','.join(f'{months}-{months + 1}' for months in range(80)) + ',80-', unit='months')
+        for as_of in (
+            date(2024, 2, 28), date(2024, 2, 29), date(2024, 3, 1), date(2024, 3, 31), date(2024, 4, 30),
+            date(2025, 2, 28), date(2025, 3, 1), date(2025, 3, 29), date(2025, 12, 31),
+        ):
+            expected = [0] * len(bands)
+            for born in self.birthdays:
+                if born <= as_of:
+                    expected[min(cohorts.age_in_months(born, as_of), 80)] += 1
+            self.assertEqual(cohorts.cohort_counts(bands, as_of=as_of).totals, expected, as_of)
+
+    def test_leap_day_birthdays_age_on_the_last_day_of_february(self):
+        self.assertEqual(cohorts.age_in_months(date(2024, 2, 29), date(2025, 2, 28)), 11)
+        self.assertEqual(cohorts.age_in_months(date(2024, 2, 29), date(2025, 3, 1)), 12)
+        self.assertEqual(cohorts.age_in_months(date(2024, 1, 31), date(2024, 2, 29)), 0)
+        self.assertEqual(cohorts.age_in_months(date(2024, 1, 31), date(2024, 3, 31)), 2)
+        bands = cohorts.parse_bands('0-1,1-', unit='years')
+        leaplings = Patient.objects.filter(date_of_birth=date(2024, 2, 29))
+        self.assertEqual(cohorts.cohort_counts(bands, as_of=date(2025, 2, 28), patients=leaplings).totals, [1, 0])
+        self.assertEqual(cohorts.cohort_counts(bands, as_of=date(2025, 3, 1), patients=leaplings).totals, [0, 1])
+
+
+class CoverageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('nurse', password='x')
+        self.other = User.objects.create_user('other', password='x')
+        self.vaccine = Vaccine.objects.create(name='MMR', vaccine_type='live')
+        self.patients = [create_patient(self.user, number) for number in range(2)]
+        self.record = create_record(self.patients[0], self.vaccine, date(2024, 1, 1))
+        create_record(self.patients[1], self.vaccine, date(2024, 1, 1), status='scheduled')
+
+    def mmr(self, user):
+        return next(item for item in coverage.get_coverage(user).vaccines if item.vaccine_id == self.vaccine.pk)
+
+    def test_reports_are_cached_until_a_change(self):
+        coverage.get_coverage(self.user)
+        with mock.patch.object(coverage, 'compute_coverage', wraps=coverage.compute_coverage) as compute:
+            self.assertEqual(self.mmr(self.user).patients, 1)
+            compute.assert_not_called()
+
+    def test_record_save_invalidates_the_owner_only(self):
+        self.assertEqual(self.mmr(self.user).doses, 1)
+        coverage.get_coverage(self.other)
+
+        self.record.dose_number = 2
+        self.record.total_doses = 2
+        self.record.save()
+        self.assertEqual(self.mmr(self.user).completed_patients, 1)
+        with mock.patch.object(coverage, 'compute_coverage', wraps=coverage.compute_coverage) as compute:
+            coverage.get_coverage(self.other)
+            compute.assert_not_called()
+
+        self.record.delete()
+        self.assertEqual(self.mmr(self.user).doses, 0)
+
+    def test_set_status_invalidates_the_owner(self):
+        self.assertEqual((self.mmr(self.user).doses, self.mmr(self.user).patients), (1, 1))
+        VaccinationRecord.objects.filter(patient__user=self.user).set_status('administered')
+        self.assertEqual((self.mmr(self.user).doses, self.mmr(self.user).patients), (2, 2))
+        VaccinationRecord.objects.filter(patient__user=self.user).set_status('missed')
+        self.assertEqual(self.mmr(self.user).doses, 0)
+
+    def owner_lookups(self, action):
+        with CaptureQueriesContext(connection) as queries:
+            action()
+        return [query for query in queries if query['sql'].startswith('SELECT') and 'FROM "vaccineapp_patient"' in query['sql']]
+
+    def test_bulk_deletes_look_owners_up_once(self):
+        for patient in self.patients:
+            for dose in range(2, 5):
+                create_record(patient, self.vaccine, date(2024, 2, dose), dose_number=dose)
+        self.assertEqual(self.mmr(self.user).doses, 7)
+
+        records = VaccinationRecord.objects.filter(dose_number__gte=3)
+        self.assertLessEqual(len(self.owner_lookups(records.delete)), 1)
+        self.assertEqual(self.mmr(self.user).doses, 3)
+
+        # Deleting the same queryset again still expires the reports
+        create_record(self.patients[0], self.vaccine, date(2024, 3, 1), dose_number=3)
+        self.assertEqual(self.mmr(self.user).doses, 4)
+        records.delete()
+        self.assertEqual(self.mmr(self.user).doses, 3)
+
+    def test_cascading_deletes_skip_record_owner_lookups(self):
+        for dose in range(2, 6):
+            create_record(self.patients[0], self.vaccine, date(2024, 2, dose), dose_number=dose)
+        self.assertEqual(self.mmr(self.user).doses, 5)
+        self.assertFalse(self.owner_lookups(Patient.objects.get(pk=self.patients[0].pk).delete))
+        self.assertEqual(self.mmr(self.user).doses, 0)
+
+    def test_catalog_and_patient_changes_invalidate(self):
+        coverage.get_coverage(self.user)
+        Vaccine.objects.create(name='Polio', vaccine_type='inactivated')
+        self.assertEqual([item.name for item in coverage.get_coverage(self.user).vaccines], ['MMR', 'Polio'])
+        create_patient(self.user, 5)
+        self.assertEqual(coverage.get_coverage(self.user).total_patients, 3)
+
+
+class CoverageMatrixTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('nurse', password='x')
+        self.mmr = Vaccine.objects.create(name='MMR', short_name='mmr', vaccine_type='live')
+        self.polio = Vaccine.objects.create(name='Polio', vaccine_type='inactivated')
+        self.patients = [create_patient(self.user, number) for number in range(6)]
+        for patient in self.patients[:4]:
+            create_record(patient, self.mmr, date(2024, 1, 1))
+        for patient in self.patients[:2]:
+            create_record(patient, self.mmr, date(2024, 2, 1), dose_number=2)
+            create_record(patient, self.polio, date(2024, 2, 1))
+        self.matrix = coverage_matrix.CoverageMatrix()
+        self.matrix.rebuild()
+
+    @staticmethod
+    def cells(matrix):
+        """Set ``(patient_id, vaccine_id, dose)`` cells, independent of the row layout"""
+        return {
+            (patient_id, vaccine_id, dose)
+            for (vaccine_id, dose), column in matrix.columns.items()
+            for patient_id in matrix.patients(column)
+        }
+
+    def assert_matches_rebuild(self, rebuilds):
+        with mock.patch.object(self.matrix, 'rebuild', wraps=self.matrix.rebuild) as rebuild:
+            self.matrix.refresh()
+        self.assertEqual(rebuild.call_count, rebuilds)
+        fresh = coverage_matrix.CoverageMatrix()
+        fresh.rebuild()
+        self.assertEqual(self.cells(self.matrix), self.cells(fresh))
+        self.assertEqual(self.matrix.patient_ids.tolist(), fresh.patient_ids.tolist())
+        for expression in ('mmr:1 - mmr:2', 'MMR & Polio', '~mmr', '(mmr:2 | polio) & ~polio'):
+            self.assertEqual(
+                self.matrix.patients(self.matrix.evaluate(expression, self.user.pk)),
+                fresh.patients(fresh.evaluate(expression, self.user.pk)),
+                expression,
+            )
+
+    def test_inserts_and_updates_are_applied_incrementally(self):
+        newcomer = create_patient(self.user, 10)
+        create_record(newcomer, self.polio, date(2024, 3, 1))
+        create_record(self.patients[4], self.polio, date(2024, 3, 1), dose_number=2)
+        create_record(self.patients[5], self.mmr, date(2024, 3, 1), status='scheduled')
+        VaccinationRecord.objects.filter(patient=self.patients[3]).set_status('missed')
+        self.assert_matches_rebuild(rebuilds=0)
+        self.assertEqual(self.matrix.patients(self.matrix.evaluate('polio:2')), [self.patients[4].pk])
+
+    def test_deletes_fall_back_to_a_rebuild(self):
+        VaccinationRecord.objects.filter(patient=self.patients[1], vaccine=self.polio).delete()
+        self.patients[0].delete()
+        self.assert_matches_rebuild(rebuilds=1)
+        self.assertEqual(self.matrix.patients(self.matrix.evaluate('polio')), [])
+
+    def test_inserts_and_deletes_together(self):
+        create_record(create_patient(self.user, 11), self.mmr, date(2024, 3, 1))
+        VaccinationRecord.objects.filter(patient=self.patients[2]).delete()
+        self.assert_matches_rebuild(rebuilds=1)
+
+
+class RollupBackfillTests(TestCase):
+    def setUp(self):
+        self.vaccine = Vaccine.objects.create(name='MMR', vaccine_type='live')
+        user = User.objects.create_user('nurse', password='x')
+        patients = [create_patient(user, number) for number in range(4)]
+        self.records = [
+            create_record(patients[0], self.vaccine, date(2024, 3, 5)),
+            create_record(patients[1], self.vaccine, date(2024, 3, 20), reaction='mild'),
+            create_record(patients[2], self.vaccine, date(2024, 4, 2)),
+            create_record(patients[3], self.vaccine, date(2024, 6, 1), status='scheduled'),
+        ]
+        self.since = timezone.now()
+
+    def test_backfill_repairs_only_differing_rows(self):
+        self.assertEqual(rollups.backfill_months(), [date(2024, 3, 1), date(2024, 4, 1), date(2024, 5, 1), date(2024, 6, 1)])
+        self.assertEqual(sum(rollups.backfill_month(month) for month in rollups.backfill_months()), 0)
+
+        # An UPDATE bypasses the signals keeping the rollups current
+        VaccinationRecord.objects.filter(pk=self.records[2].pk).update(reaction='severe')
+        self.assertNotEqual(rollups.verify(), [])
+        self.assertEqual(rollups.backfill_month(date(2024, 4, 1)), 4)
+        self.assertEqual(rollups.verify(), [])
+
+    def test_changed_since_includes_the_months_records_left(self):
+        VaccinationRecord.objects.filter(pk=self.records[0].pk).update(
+            date_administered=date(2024, 5, 10), updated_at=timezone.now()
+        )
+        self.assertEqual(rollups.backfill_months(changed_since=self.since), [date(2024, 3, 1), date(2024, 5, 1)])
+        self.assertEqual(rollups.backfill_months(date(2024, 4, 1), changed_since=self.since), [date(2024, 5, 1)])
+
+        out = StringIO()
+        call_command('backfill_rollups', '--changed-since', self.since.isoformat(), stdout=out)
+        self.assertIn('Backfilled 2 months', out.getvalue())
+        self.assertEqual(rollups.verify(), [])
+
+    def test_changed_since_finds_deletions_without_signals(self):
+        VaccinationRecord.objects.filter(pk=self.records[2].pk)._raw_delete(connection.alias)
+        self.assertEqual(rollups.backfill_months(changed_since=self.since), [date(2024, 4, 1)])
+        call_command('backfill_rollups', '--changed-since', self.since.isoformat(), stdout=StringIO())
+        # Counters and flags are left to rebuild_rollups
+        self.assertFalse([mismatch for mismatch in rollups.verify() if mismatch[0] in ('daily', 'monthly')])
+
+    def test_invalid_arguments_are_rejected(self):
+        with self.assertRaises(CommandError):
+            call_command('backfill_rollups', '--from', '2024-13', stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command('backfill_rollups', '--from', '2024-05', '--to', '2024-03', stdout=StringIO())
+
+
+class TrendApiTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('nurse', password='x')
+        self.client.force_login(user)
+        self.vaccine = Vaccine.objects.create(name='MMR', vaccine_type='live')
+        self.patient = create_patient(user, 1)
+        self.doses = 0
+
+    def record(self, day, **fields):
+        self.doses += 1
+        return create_record(self.patient, self.vaccine, day, dose_number=self.doses, **fields)
+
+    def trend(self, granularity, **params):
+        response = self.client.get(f'/api/trends/{granularity}/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_weeks_start_on_monday_across_years(self):
+        self.record(date(2024, 12, 29))   # Sunday
+        self.record(date(2024, 12, 30))   # Monday of ISO week 2025-W01
+        self.record(date(2025, 1, 1))
+        self.record(date(2025, 1, 5))     # Sunday of that week
+        self.record(date(2025, 1, 20))
+        data = self.trend('week', **{'from': '2024-12-25', 'to': '2025-01-21'})
+        self.assertEqual(data['periods'], ['2024-12-23', '2024-12-30', '2025-01-06', '2025-01-13', '2025-01-20'])
+        self.assertEqual(data['totals'], [1, 3, 0, 0, 1])
+
+    def test_empty_periods_and_split_values_are_zero_filled(self):
+        self.record(date(2024, 1, 15))
+        self.record(date(2024, 4, 3), reaction='mild')
+        self.record(date(2024, 4, 9), status='scheduled')
+        data = self.trend('month', **{'from': '2024-01-31', 'to': '2024-05-01', 'split': 'reaction'})
+        self.assertEqual(data['periods'], ['2024-01-01', '2024-02-01', '2024-03-01', '2024-04-01', '2024-05-01'])
+        self.assertEqual(data['totals'], [1, 0, 0, 1, 0])
+        series = {item['key']: item['counts'] for item in data['series']}
+        self.assertEqual(set(series), set(dict(VaccinationRecord.REACTION_CHOICES)))
+        self.assertEqual(series['mild'], [0, 0, 0, 1, 0])
+        self.assertEqual(series['severe'], [0] * 5)
+
+        data = self.trend('year', **{'from': '2022-06-01', 'to': '2024-06-01', 'status': 'all'})
+        self.assertEqual(data['periods'], ['2022-01-01', '2023-01-01', '2024-01-01'])
+        self.assertEqual(data['totals'], [0, 0, 3])
+        self.assertEqual(self.trend('week', **{'from': '2023-01-02', 'to': '2023-01-15'})['totals'], [0, 0])
+
+    def test_invalid_parameters_are_rejected(self):
+        for url, params in (
+            ('/api/trends/day/', {}),
+            ('/api/trends/week/', {'split': 'patient'}),
+            ('/api/trends/week/', {'from': '2024-02-01', 'to': '2024-01-01'}),
+            ('/api/trends/week/', {'from': 'yesterday'}),
+        ):
+            self.assertEqual(self.client.get(url, params).status_code, 400, (url, params))
+
+
+class AnalyticsSnapshotTests(TestCase):
+    def setUp(self):
+        users = [User.objects.create_user(name, password='x') for name in ('nurse', 'other')]
+        vaccines = [Vaccine.objects.create(name=name, vaccine_type='live') for name in ('MMR', 'Polio', 'Hep B')]
+        statuses = ['administered', 'administered', 'scheduled', 'missed']
+        reactions = ['none', 'mild', 'none', 'severe', 'none']
+        for number in range(12):
+            patient = Patient.objects.create(
+                user=users[number % 2], first_name=f'Patient{number}', last_name='Test',
+                date_of_birth=date(2016 + number % 7, 1, 31) + timedelta(days=30 * number), gender='MF'[number % 2],
+            )
+            for dose in range(1, number % 4 + 2):
+                create_record(
+                    patient, vaccines[(number + dose) % 3], date(2023, 11, 1) + timedelta(days=37 * dose + 11 * number),
+                    status=statuses[(number + dose) % 4], dose_number=dose, reaction=reactions[(number * dose) % 5],
+                    follow_up_required=(number + dose) % 3 == 0, administering_facility=['Clinic A', None][dose % 2],
+                )
+        self.users = users
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        self.snapshot = analytics.export_snapshot(directory)
+
+    def grouped(self, *group_by, metrics=('count',), **kwargs):
+        return {key: values for key, values in analytics.query(self.snapshot, group_by, metrics, **kwargs).groups}
+
+    def test_group_by_matches_the_orm(self):
+        records = VaccinationRecord.objects.order_by()
+        expected = {
+            (row['vaccine__name'], row['status']): {
+                'count': row['count'], 'patients': row['patients'], 'follow_ups': row['follow_ups'],
+            }
+            for row in records.values('vaccine__name', 'status').annotate(
+                count=Count('pk'), patients=Count('patient', distinct=True),
+                follow_ups=Count('pk', filter=Q(follow_up_required=True)),
+            )
+        }
+        self.assertEqual(self.grouped('vaccine', 'status', metrics=('count', 'patients', 'follow_ups')), expected)
+        self.assertEqual(self.snapshot.rows, records.count())
+
+        expected = {
+            (row['month'].strftime('%Y-%m'), row['reaction']): {'count': row['count']}
+            for row in records.annotate(month=TruncMonth('date_administered')).values('month', 'reaction').annotate(
+                count=Count('pk')
+            )
+        }
+        self.assertEqual(self.grouped('month', 'reaction'), expected)
+
+        expected = {
+            (row['administering_facility'] or '', row['patient__gender']): {'count': row['count']}
+            for row in records.filter(patient__user=self.users[0], date_administered__gte=date(2024, 2, 1))
+            .values('administering_facility', 'patient__gender').annotate(count=Count('pk'))
+        }
+        self.assertEqual(
+            self.grouped('facility', 'gender', owner_id=self.users[0].pk, start=date(2024, 2, 1)), expected
+        )
+
+    def test_age_bands_and_filters_match_exact_ages(self):
+        bands = cohorts.parse_bands('0-5,5-', unit='years')
+        expected = {}
+        records = VaccinationRecord.objects.filter(status='administered', dose_number__in=[1, 2]).select_related('patient')
+        for record in records:
+            months = cohorts.age_in_months(record.patient.date_of_birth, record.date_administered)
+            band = bands[0].label if months < 60 else bands[1].label
+            expected.setdefault((band,), {'count': 0, 'total_age': 0})
+            expected[(band,)]['count'] += 1
+            expected[(band,)]['total_age'] += months
+        result = self.grouped(
+            'age_band', metrics=('count', 'avg_age_months'), bands=bands,
+            filters={'status': ['administered'], 'dose_number': [1, 2]},
+        )
+        self.assertEqual(len(result), 2)
+        self.assertEqual(
+            result,
+            {
+                key: {'count': values['count'], 'avg_age_months': round(values['total_age'] / values['count'], 1)}
+                for key, values in expected.items()
+            },
+        )
+
+
+class AdminChangelistTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin', password='x')
+        self.client.force_login(self.user)
+        self.patients = [create_patient(self.user, number) for number in range(3)]
+
+    def test_changelists_do_not_depend_on_the_counters(self):
+        StatisticCounter.objects.all().delete()
+        response = self.client.get('/admin/vaccineapp/patient/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, 3)
+        self.assertEqual(len(response.context['cl'].result_list), 3)
+
+    def test_counters_only_extend_counts_past_the_limit(self):
+        patients = Patient.objects.order_by('pk')
+        with mock.patch.object(vaccine_admin, 'COUNT_LIMIT', 2):
+            rollups.apply_counter_deltas({'patients': -2})
+            paginator = vaccine_admin.EstimatedCountPaginator(patients, 2)
+            self.assertEqual(paginator.count, 2)
+            # The last page is not cut at the low count
+            self.assertEqual(len(paginator.page(1)), 2)
+
+            rollups.apply_counter_deltas({'patients': 9})
+            paginator = vaccine_admin.EstimatedCountPaginator(patients, 2)
+            self.assertEqual(paginator.count, 10)
+            self.assertEqual(list(paginator.page(2)), [self.patients[2]])
+            self.assertEqual(vaccine_admin.EstimatedCountPaginator(patients.filter(last_name='Test'), 2).count, 2)
@@ -0,0 +1,147 @@
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+from django.db.models import F, Sum
+from django.db.models.functions import TruncWeek, TruncYear
+from django.utils import timezone
+
+from .cohorts import months_before
+from .models import Vaccine, VaccinationRecord, DailyVaccinationCount, MonthlyVaccinationCount
+from .rollups import next_month
+
+# =============================================
+# VACCINATION TRENDS
+# =============================================
+# Weekly trends are summed from the daily rollup, monthly and yearly ones
+# from the monthly rollup, so a chart over years reads a few thousand rollup
+# rows however many records there are. Periods are ISO weeks (starting on
+# Monday), calendar months or calendar years; a range covers every whole
+# period containing a day from ``start`` to ``end``, and periods without
+# records are reported as zeros.
+
+GRANULARITIES = ('week', 'month', 'year')
+SPLITS = ('vaccine', 'status', 'reaction')
+
+# Periods up to ``end`` covered when no start is given
+DEFAULT_PERIODS = {'week': 26, 'month': 24, 'year': 10}
+MAX_PERIODS = 1000
+
+
+def period_start(day, granularity):
+    """First day of the period containing ``day``"""
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day.replace(month=1, day=1)
+
+
+def next_period(start, granularity):
+    if granularity == 'week':
+        return start + timedelta(days=7)
+    if granularity == 'month':
+        return next_month(start)
+    return start.replace(year=start.year + 1)
+
+
+def default_start(end, granularity):
+    """Start of the DEFAULT_PERIODS periods ending with the one containing ``end``"""
+    count = DEFAULT_PERIODS[granularity] - 1
+    if granularity == 'week':
+        return period_start(end, 'week') - timedelta(weeks=count)
+    if granularity == 'month':
+        return months_before(end.replace(day=1), count)
+    return date(end.year - count, 1, 1)
+
+
+@dataclass
+class Trend:
+    """Counts per period, per value of the split
+
+    ``series`` maps each split value (None when not split) to its counts in
+    the order of ``periods``; ``labels`` names the split values.
+    """
+    granularity: str
+    periods: list
+    split: str
+    series: dict
+    labels: dict
+
+    @property
+    def totals(self):
+        return [sum(counts[index] for counts in self.series.values()) for index in range(len(self.periods))]
+
+    def as_dict(self):
+        return {
+            'granularity': self.granularity,
+            'split': self.split,
+            'periods': [period.isoformat() for period in self.periods],
+            'series': [
+                {'key': key, 'label': self.labels.get(key, key), 'counts': counts, 'total': sum(counts)}
+                for key, counts in self.series.items()
+            ],
+            'totals': self.totals,
+        }
+
+
+def vaccination_trend(granularity, start=None, end=None, split=None, status='administered', vaccine=None, reaction=None):
+    """Record counts per week, month or year from the rollup tables
+
+    ``end`` defaults to today and ``start`` to DEFAULT_PERIODS periods
+    before it. ``status`` (None for every status), ``vaccine`` and
+    ``reaction`` filter the records counted; ``split`` is None, 'vaccine',
+    'status' or 'reaction'. Raises ValueError.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity {granularity!r}, expected one of {', '.join(GRANULARITIES)}")
+    if split not in (None, *SPLITS):
+        raise ValueError(f"Unknown split {split!r}, expected one of {', '.join(SPLITS)}")
+    statuses = dict(VaccinationRecord.STATUS_CHOICES)
+    reactions = dict(VaccinationRecord.REACTION_CHOICES)
+    if status is not None and status not in statuses:
+        raise ValueError(f"Unknown status {status!r}, expected one of {', '.join(statuses)}")
+    if reaction is not None and reaction not in reactions:
+        raise ValueError(f"Unknown reaction {reaction!r}, expected one of {', '.join(reactions)}")
+
+    end = end or timezone.now().date()
+    start = start or default_start(end, granularity)
+    if start > end:
+        raise ValueError("The start of the range must not be after its end")
+    periods = [period_start(start, granularity)]
+    last = period_start(end, granularity)
+    while periods[-1] < last:
+        periods.append(next_period(periods[-1], granularity))
+        if len(periods) > MAX_PERIODS:
+            raise ValueError(f"The range covers more than {MAX_PERIODS} periods")
+    stop = next_period(last, granularity)
+
+    if granularity == 'week':
+        rows = DailyVaccinationCount.objects.filter(day__gte=periods[0], day__lt=stop).annotate(period=TruncWeek('day'))
+    else:
+        rows = MonthlyVaccinationCount.objects.filter(month__gte=periods[0], month__lt=stop)
+        rows = rows.annotate(period=F('month') if granularity == 'month' else TruncYear('month'))
+    if status is not None:
+        rows = rows.filter(status=status)
+    if vaccine is not None:
+        rows = rows.filter(vaccine=vaccine)
+    if reaction is not None:
+        rows = rows.filter(reaction=reaction)
+
+    group = {'vaccine': 'vaccine_id', 'status': 'status', 'reaction': 'reaction'}.get(split)
+    index = {period: position for position, period in enumerate(periods)}
+    series = {}
+    for row in rows.order_by().values('period', *([group] if group else [])).annotate(n=Sum('count')):
+        counts = series.setdefault(row[group] if group else None, [0] * len(periods))
+        counts[index[row['period']]] += row['n']
+
+    if split == 'vaccine':
+        labels = dict(Vaccine.objects.filter(pk__in=list(series)).values_list('pk', 'name'))
+    elif split == 'status':
+        labels = statuses
+    elif split == 'reaction':
+        labels = reactions
+    else:
+        labels = {None: 'All records'}
+    if split != 'vaccine':
+        series = {key: series.get(key, [0] * len(periods)) for key in labels}
+    return Trend(granularity, periods, split, series, labels)
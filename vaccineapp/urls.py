@@ -8,6 +8,15 @@ urlpatterns = [
     path('service/', views.service, name='service'),
     path('vaccine/', views.vaccine, name='vaccine'),
     path('dashboard/', views.dashboard, name='dashboard'),
+    path('api/dashboard/cache-metrics/', views.dashboard_cache_metrics_api, name='dashboard_cache_metrics_api'),
+    path('api/dashboard/charts/age-distribution/', views.age_distribution_chart_api, name='age_distribution_chart_api'),
+    path('api/dashboard/charts/vaccine-types/', views.vaccine_types_chart_api, name='vaccine_types_chart_api'),
+    path('api/dashboard/charts/coverage/', views.coverage_chart_api, name='coverage_chart_api'),
+    path('api/cohorts/', views.cohort_api, name='cohort_api'),
+    path('api/trends/<str:granularity>/', views.vaccination_trend_api, name='vaccination_trend_api'),
+    path('api/analytics/', views.analytics_api, name='analytics_api'),
+    path('api/coverage/', views.coverage_api, name='coverage_api'),
+    path('api/coverage/matrix/', views.coverage_matrix_api, name='coverage_matrix_api'),
     path('profile/', views.profile_view, name='profile'),
     path('signup/', views.signup_view, name='signup'),
     path('login/', views.login_view, name='login'),
@@ -20,11 +29,28 @@ urlpatterns = [
     path('vaccine-details/<int:inventory_id>/', views.vaccine_details, name='vaccine_details'),
     
     # VACCINE API ENDPOINTS
+    path('api/inventory/', views.inventory_table_api, name='inventory_table_api'),
+    path('api/inventory/expiry/', views.inventory_expiry_api, name='inventory_expiry_api'),
+    path('api/inventory/stock-at/', views.stock_at_api, name='stock_at_api'),
+    path('api/inventory/forecast/', views.forecast_api, name='forecast_api'),
+    path('api/inventory/adjust/', views.bulk_adjust_inventory_api, name='bulk_adjust_inventory_api'),
+    path('api/inventory/import/', views.bulk_import_inventory_api, name='bulk_import_inventory_api'),
+    path('api/vaccines/batch/', views.vaccine_batch_detail_api, name='vaccine_batch_detail_api'),
     path('api/vaccines/<int:vaccine_id>/', views.vaccine_detail_api, name='vaccine_detail_api'),
     path('api/vaccines/<int:vaccine_id>/delete/', views.delete_vaccine_api, name='delete_vaccine_api'),
     path('api/vaccines/create/', views.create_vaccine_api, name='create_vaccine_api'),
     path('api/vaccines/<int:vaccine_id>/update/', views.update_vaccine_api, name='update_vaccine_api'),
     
+    # SEARCH API
+    path('api/search/', views.search_api, name='search_api'),
+    
+    # LIST API ENDPOINTS
+    path('api/inventory/lots/', views.inventory_list_api, name='inventory_list_api'),
+    path('api/patients/', views.patient_list_api, name='patient_list_api'),
+    path('api/patients/directory/', views.patient_directory_api, name='patient_directory_api'),
+    path('api/records/', views.vaccination_record_list_api, name='vaccination_record_list_api'),
+    path('api/appointments/', views.appointment_list_api, name='appointment_list_api'),
+    
     # OTHER DASHBOARD URLS
     path('patients/', views.patient_list, name='patient_list'),
     path('vaccination-schedule/', views.vaccination_schedule, name='vaccination_schedule'),
@@ -6,13 +6,36 @@ from django.contrib.auth.decorators import login_required
 from django.views.decorators.cache import never_cache
 from django.utils.decorators import method_decorator
 from django.http import HttpResponseRedirect, JsonResponse
+from django.template.loader import render_to_string
+from django.core.paginator import Paginator
+from django.db.models import CharField, Count, Exists, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Cast, Coalesce, Concat
 from django.utils import timezone
 from datetime import timedelta, date
 import json
+import codecs
+import hashlib
+import time
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST, require_http_methods
 from .forms import CustomUserCreationForm, VaccineInventoryForm
-from .models import UserProfile, Patient, Vaccine, VaccinationRecord, Appointment, VaccineInventory
+from .models import UserProfile, Patient, Vaccine, VaccinationRecord, Appointment, VaccineInventory, VaccineInventoryQuerySet, StatisticCounter, EXPIRY_WINDOWS
+from .signals import StockChange
+from django.core.exceptions import ValidationError
+from .dashboard_stats import get_dashboard_stats, get_cached_section
+from .rollups import counter_values
+from .caching import get_metrics
+from .inventory_import import FORMATS, guess_format, import_lots
+from .ledger import end_of_day, stock_at
+from .forecasting import get_cached_forecast
+from .cohorts import cohort_counts, parse_bands
+from .coverage import get_coverage
+from .coverage_matrix import get_matrix
+from .trends import vaccination_trend
+from .analytics import DIMENSIONS as ANALYTICS_DIMENSIONS, load_snapshot, query as query_snapshot
+from .pagination import CountedPaginator, InvalidCursor, keyset_page, parse_page_size
+from .search import KINDS as SEARCH_KINDS, render_highlight, search as full_text_search
 
 # =============================================
 # CACHE CONTROL DECORATOR
@@ -72,11 +95,8 @@ def vaccine(request):
 def dashboard(request):
     """Dashboard page - requires login"""
     user = request.user
-    
-    # Patient statistics
-    patients_count = Patient.objects.filter(user=user).count()
-    appointments_count = Appointment.objects.filter(patient__user=user, status='scheduled').count()
-    vaccination_records_count = VaccinationRecord.objects.filter(patient__user=user).count()
+    today = timezone.now().date()
+    stats = get_dashboard_stats(user, today)
     
     # Recent appointments
     recent_appointments = Appointment.objects.filter(
@@ -84,61 +104,6 @@ def dashboard(request):
         status='scheduled'
     ).order_by('scheduled_date')[:5]
     
-    # ============ VACCINE INVENTORY DATA FOR DASHBOARD ============
-    # Get vaccine inventory data (for all users in the system)
-    vaccine_inventory = VaccineInventory.objects.select_related('vaccine').all()
-    
-    # Calculate vaccine statistics
-    total_vaccines = vaccine_inventory.count()
-    total_doses = sum(item.current_stock for item in vaccine_inventory)
-    
-    # Count low stock items (critical and low_stock status)
-    low_stock_count = vaccine_inventory.filter(
-        status__in=['low_stock', 'critical']
-    ).count()
-    
-    # Count unique vaccine types
-    vaccine_types = vaccine_inventory.values('vaccine__vaccine_type').distinct().count()
-    
-    # Total administered vaccines (last 30 days)
-    thirty_days_ago = timezone.now().date() - timedelta(days=30)
-    total_administered = VaccinationRecord.objects.filter(
-        status='administered',
-        date_administered__gte=thirty_days_ago
-    ).count()
-    
-    # Additional dashboard statistics
-    today = timezone.now().date()
-    
-    # Today's vaccinations
-    todays_vaccinations = VaccinationRecord.objects.filter(
-        date_administered=today,
-        status='administered'
-    ).count()
-    
-    # Vaccinations due (scheduled for today)
-    vaccinations_due = VaccinationRecord.objects.filter(
-        date_administered=today,
-        status='scheduled'
-    ).count()
-    
-    # Overdue vaccinations
-    overdue_vaccinations = VaccinationRecord.objects.filter(
-        date_administered__lt=today,
-        status='scheduled'
-    ).count()
-    
-    # Vaccine coverage percentage (patients with at least one vaccination)
-    total_patients = Patient.objects.count()
-    patients_vaccinated = Patient.objects.filter(
-        vaccination_records__status='administered'
-    ).distinct().count()
-    
-    if total_patients > 0:
-        vaccine_coverage = (patients_vaccinated / total_patients) * 100
-    else:
-        vaccine_coverage = 0
-    
     # Recent vaccination activity
     recent_vaccinations = VaccinationRecord.objects.filter(
         status='administered'
@@ -150,65 +115,13 @@ def dashboard(request):
         status__in=['scheduled', 'confirmed']
     ).select_related('patient').order_by('scheduled_date')
     
-    # Age distribution data for charts
-    age_distribution = {
-        '0-1': Patient.objects.filter(
-            date_of_birth__gte=today - timedelta(days=365)
-        ).count(),
-        '1-3': Patient.objects.filter(
-            date_of_birth__gte=today - timedelta(days=3*365),
-            date_of_birth__lt=today - timedelta(days=365)
-        ).count(),
-        '3-6': Patient.objects.filter(
-            date_of_birth__gte=today - timedelta(days=6*365),
-            date_of_birth__lt=today - timedelta(days=3*365)
-        ).count(),
-        '6-12': Patient.objects.filter(
-            date_of_birth__gte=today - timedelta(days=12*365),
-            date_of_birth__lt=today - timedelta(days=6*365)
-        ).count(),
-        '12-18': Patient.objects.filter(
-            date_of_birth__gte=today - timedelta(days=18*365),
-            date_of_birth__lt=today - timedelta(days=12*365)
-        ).count(),
-    }
-    
-    # Vaccine type distribution
-    vaccine_type_stats = {}
-    for vaccine_type, display_name in Vaccine.VACCINE_TYPE_CHOICES:
-        count = Vaccine.objects.filter(vaccine_type=vaccine_type, is_active=True).count()
-        vaccine_type_stats[vaccine_type] = {
-            'count': count,
-            'display_name': display_name
-        }
-    
-    context = {
-        # Original context
-        'patients_count': patients_count,
-        'appointments_count': appointments_count,
-        'vaccination_records_count': vaccination_records_count,
+    context = stats.as_context()
+    context.update({
+        'stats': stats,
         'recent_appointments': recent_appointments,
-        
-        # Vaccine inventory data for dashboard
-        'vaccine_inventory': vaccine_inventory,
-        'total_vaccines': total_vaccines,
-        'total_doses': total_doses,
-        'low_stock_count': low_stock_count,
-        'vaccine_types': vaccine_types,
-        'total_administered': total_administered,
-        
-        # Additional dashboard stats
-        'todays_vaccinations': todays_vaccinations,
-        'vaccinations_due': vaccinations_due,
-        'overdue_vaccinations': overdue_vaccinations,
-        'vaccine_coverage': round(vaccine_coverage, 1),
         'recent_vaccinations': recent_vaccinations,
         'todays_schedule': todays_schedule,
-        'age_distribution': age_distribution,
-        'vaccine_type_stats': vaccine_type_stats,
-        'total_patients': total_patients,
-        'patients_vaccinated': patients_vaccinated,
-    }
+    })
     
     response = render(request, 'dashboard.html', context)
     response['Cache-Control'] = 'no-cache, no-store, must-revalidate'
@@ -216,6 +129,171 @@ def dashboard(request):
     response['Expires'] = '0'
     return response
 
+@require_http_methods(["GET"])
+@login_required(login_url='/login/')
+def dashboard_cache_metrics_api(request):
+    """API endpoint exposing dashboard cache hit/miss/stale counters (staff only)"""
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Permission denied'}, status=403)
+    return JsonResponse(get_metrics())
+
+# =============================================
+# DASHBOARD CHART API ENDPOINTS
+# =============================================
+
+# Browser cache lifetime (seconds) for each chart dataset
+CHART_MAX_AGE = {
+    'age_distribution': 300,
+    'vaccine_types': 600,
+    'coverage': 60,
+}
+
+def chart_json_response(request, data, max_age):
+    """JsonResponse with an ETag and private Cache-Control; 304 when unchanged"""
+    payload = json.dumps(data, sort_keys=True)
+    etag = '"%s"' % hashlib.md5(payload.encode()).hexdigest()
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse(data)
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, max_age=max_age)
+    return response
+
+@require_http_methods(["GET"])
+@login_required(login_url='/login/')
+def age_distribution_chart_api(request):
+    """Chart data: number of patients per age bucket"""
+    max_age = CHART_MAX_AGE['age_distribution']
+    distribution = get_cached_section('ages', fresh=max_age)
+    data = {
+        'labels': [f'{label} yr' for label in distribution],
+        'datasets': [{'label': 'Patients', 'data': list(distribution.values())}],
+    }
+    return chart_json_response(request, data, max_age)
+
+@require_http_methods(["GET"])
+@login_required(login_url='/login/')
+def vaccine_types_chart_api(request):
+    """Chart data: active vaccines per vaccine type"""
+    max_age = CHART_MAX_AGE['vaccine_types']
+    catalog = get_cached_section('catalog', fresh=max_age)
+    data = {
+        'labels': [stats['display_name'] for stats in catalog.type_distribution.values()],
+        'datasets': [{'label': 'Vaccines', 'data': [stats['count'] for stats in catalog.type_distribution.values()]}],
+    }
+    return chart_json_response(request, data, max_age)
+
+@require_http_methods(["GET"])
+@login_required(login_url='/login/')
+def coverage_chart_api(request):
+    """Chart data: patients with and without an administered dose"""
+    max_age = CHART_MAX_AGE['coverage']
+    patients = get_cached_section('patients', fresh=max_age)
+    data = {
+        'labels': ['Vaccinated', 'Not yet vaccinated'],
+        'datasets': [{
+            'label': 'Patients',
+            'data': [patients.patients_vaccinated, patients.total_patients - patients.patients_vaccinated],
+        }],
+        'coverage': patients.vaccine_coverage,
+        'total_patients': patients.total_patients,
+    }
+    return chart_json_response(request, data, max_age)
+
+# =============================================
+# AGE COHORT API
+# =============================================
+
+@require_http_methods(["GET"])
+@login_required(login_url='/login/')
+def cohort_api(request):
+    """API endpoint counting the current user's patients per exact-age band
+
+    ``bands`` is a preset (age_groups, dashboard) or a list like ``0-2,2-5,5-``
+    in ``unit`` (years or months); ``as_of`` is an ISO date, ``split`` one of
+    gender, vaccine or coverage, and ``vaccine`` restricts coverage to one
+    vaccine.
+    """
+    params = request.GET
+    try:
+        bands = parse_bands(params.get('bands', 'age_groups'), params.get('unit', 'years'))
+        filters = parse_list_filters(params, {'as_of': ('as_of', date.fromisoformat), 'vaccine': ('vaccine', int)})
+        counts = cohort_counts(
+            bands,
+            as_of=filters.get('as_of'),
+            split=params.get('split') or None,
+            patients=Patient.objects.filter(user=request.user),
+            vaccine=filters.get('vaccine'),
+        )
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(counts.as_dict())
+
+@require_http_methods(["GET"])
+@login_required(login_url='/login/')
+def vaccination_trend_api(request, granularity):
+    """API endpoint with vaccination record counts per week, month or year
+    
+    Counts are system-wide, like the dashboard, and read from the rollup
+    tables. ``from`` and ``to`` are ISO dates, ``status`` defaults to
+    administered (``all`` for every status), ``vaccine`` and ``reaction``
+    filter the records and ``split`` is one of vaccine, status or reaction.
+    """
+    params = request.GET
+    status = params.get('status', 'administered')
+    try:
+        filters = parse_list_filters(params, {
+            'from': ('start', date.fromisoformat),
+            'to': ('end', date.fromisoformat),
+            'vaccine': ('vaccine', int),
+        })
+        trend = vaccination_trend(
+            granularity,
+            split=params.get('split') or None,
+            status=None if status == 'all' else status,
+            reaction=params.get('reaction') or None,
+            **filters,
+        )
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(trend.as_dict())
+
+@require_http_methods(["GET"])
+@login_required(login_url='/login/')
+def analytics_api(request):
+    """API endpoint grouping, filtering and aggregating the analytics snapshot
+    
+    ``group_by`` and ``metrics`` are comma separated; any dimension given
+    as a parameter (e.g. ``reaction=mild,severe``) keeps those values only,
+    ``from`` and ``to`` bound the administration date and ``bands`` (with
+    ``unit``) defines the age_band dimension. Staff see every record, other
+    users their own patients' records.
+    """
+    snapshot = load_snapshot()
+    if snapshot is None:
+        return JsonResponse({'error': "No analytics snapshot has been exported yet"}, status=404)
+    params = request.GET
+    try:
+        bands = parse_bands(params['bands'], params.get('unit', 'years')) if params.get('bands') else ()
+        dates = parse_list_filters(params, {'from': ('start', date.fromisoformat), 'to': ('end', date.fromisoformat)})
+        started = time.perf_counter()
+        result = query_snapshot(
+            snapshot,
+            group_by=[name for name in params.get('group_by', '').split(',') if name],
+            metrics=[name for name in params.get('metrics', 'count').split(',') if name],
+            filters={name: params[name].split(',') for name in ANALYTICS_DIMENSIONS if params.get(name)},
+            owner_id=None if request.user.is_staff else request.user.pk,
+            bands=bands,
+            **dates,
+        )
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({
+        'snapshot': {'created_at': snapshot.created_at, 'records': snapshot.rows},
+        **result.as_dict(),
+        'evaluated_in_ms': round((time.perf_counter() - started) * 1000, 2),
+    })
+
 @login_required(login_url='/login/')
 @no_cache_after_logout
 def profile_view(request):
@@ -275,47 +353,24 @@ def vaccine_inventory(request):
     vaccine_inventory = VaccineInventory.objects.select_related('vaccine').all()
     
     # Calculate statistics
-    total_vaccines = vaccine_inventory.count()
-    vaccine_types = Vaccine.objects.values('vaccine_type').distinct().count()
-    total_doses = sum(item.current_stock for item in vaccine_inventory)
-    
-    # Calculate doses administered this month
-    start_of_month = timezone.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    doses_this_month = VaccinationRecord.objects.filter(
-        date_administered__gte=start_of_month,
-        status='administered'
-    ).count()
-    
-    # Low stock count (critical + low stock)
-    low_stock_count = vaccine_inventory.filter(
-        status__in=['low_stock', 'critical']
-    ).count()
-    
-    # Total administered
-    total_administered = VaccinationRecord.objects.filter(status='administered').count()
-    
-    # Administered this week
-    start_of_week = timezone.now() - timedelta(days=timezone.now().weekday())
-    administered_this_week = VaccinationRecord.objects.filter(
-        date_administered__gte=start_of_week,
-        status='administered'
-    ).count()
-    
-    # Expiring soon (within 30 days)
-    expiring_soon_count = sum(1 for item in vaccine_inventory if item.is_expiring_soon())
+    today = timezone.now().date()
+    inventory_stats = get_cached_section('inventory', today)
+    vaccination_stats = get_cached_section('vaccinations', today)
+    catalog_stats = get_cached_section('catalog', today)
     
     context = {
         'vaccine_inventory': vaccine_inventory,
         'form': form,
         'vaccines': Vaccine.objects.filter(is_active=True),
-        'total_vaccines': total_vaccines,
-        'vaccine_types': vaccine_types,
-        'total_doses': total_doses,
-        'doses_this_month': doses_this_month,
-        'low_stock_count': low_stock_count,
-        'total_administered': total_administered,
-        'administered_this_week': administered_this_week,
-        'expiring_soon_count': expiring_soon_count,
+        'total_vaccines': inventory_stats.total_lots,
+        'vaccine_types': catalog_stats.vaccine_types,
+        'total_doses': inventory_stats.total_doses,
+        'doses_this_month': vaccination_stats.administered_this_month,
+        'low_stock_count': inventory_stats.low_stock_count,
+        'total_administered': vaccination_stats.administered_total,
+        'administered_this_week': vaccination_stats.administered_this_week,
+        'expiring_soon_count': inventory_stats.expiring_soon_count,
+        'expired_count': inventory_stats.expired_count,
     }
     
     response = render(request, 'vaccine_inventory.html', context)
@@ -467,38 +522,257 @@ def vaccine_details(request, inventory_id):
 # VACCINE API ENDPOINTS
 # =============================================
 
+# Fields of the vaccine detail API, computed from a lot and its vaccine (or None)
+INVENTORY_DETAIL_FIELDS = {
+    'id': lambda item, catalog: item.id,
+    'name': lambda item, catalog: item.get_display_name(),
+    'vaccine_type': lambda item, catalog: catalog.vaccine_type if catalog else item.vaccine_type,
+    'vaccine_type_display': lambda item, catalog: catalog.get_vaccine_type_display() if catalog else item.get_vaccine_type_display(),
+    'manufacturer': lambda item, catalog: catalog.manufacturer if catalog and catalog.manufacturer else item.manufacturer or 'Not specified',
+    'lot_number': lambda item, catalog: item.lot_number or 'Not specified',
+    'target_diseases': lambda item, catalog: catalog.target_diseases if catalog else item.target_diseases or 'Not specified',
+    'current_stock': lambda item, catalog: item.current_stock,
+    'minimum_stock': lambda item, catalog: item.min_stock_level,
+    'status': lambda item, catalog: item.status,
+    'expiration_date': lambda item, catalog: item.expiration_date.isoformat() if item.expiration_date else None,
+    'storage_temperature': lambda item, catalog: item.storage_temperature or 'Not specified',
+    'description': lambda item, catalog: catalog.description if catalog else item.description or 'No description available',
+    'administered_count': lambda item, catalog: item.administered_count if catalog else 0,
+    'doses_per_vial': lambda item, catalog: item.doses_per_vial,
+}
+
+def inventory_details(with_administered_count=True):
+    """Lots with their vaccine joined and, optionally, the administered count
+    
+    The count is read from the rollup counter of the lot's vaccine as a
+    subquery, so any number of lots still costs a single query.
+    """
+    items = VaccineInventory.objects.select_related('vaccine')
+    if with_administered_count:
+        administered = StatisticCounter.objects.filter(
+            name=Concat(Value('records:administered:vaccine:'), Cast(OuterRef('vaccine_id'), CharField()))
+        ).values('value')[:1]
+        items = items.annotate(administered_count=Coalesce(Subquery(administered), 0))
+    return items
+
+def inventory_detail_data(item, fields=INVENTORY_DETAIL_FIELDS):
+    """Serialize a lot from inventory_details() with the requested fields"""
+    return {field: INVENTORY_DETAIL_FIELDS[field](item, item.vaccine) for field in fields}
+
 @require_http_methods(["GET"])
 @login_required(login_url='/login/')
 def vaccine_detail_api(request, vaccine_id):
-    """API endpoint to get vaccine details"""
+    """API endpoint to get vaccine details; 304 when the client's copy is current
+    
+    The lot, its vaccine and the administered count are read in one query.
+    The ETag is derived from both ``updated_at`` stamps and the count, so an
+    unchanged item is answered without building the JSON body.
+    """
     try:
-        vaccine = VaccineInventory.objects.get(id=vaccine_id)
-        
-        data = {
-            'id': vaccine.id,
-            'name': vaccine.get_display_name(),
-            'vaccine_type': vaccine.vaccine.vaccine_type if vaccine.vaccine else vaccine.vaccine_type,
-            'vaccine_type_display': vaccine.vaccine.get_vaccine_type_display() if vaccine.vaccine else vaccine.get_vaccine_type_display(),
-            'manufacturer': vaccine.vaccine.manufacturer if vaccine.vaccine and vaccine.vaccine.manufacturer else vaccine.manufacturer or 'Not specified',
-            'lot_number': vaccine.lot_number or 'Not specified',
-            'target_diseases': vaccine.vaccine.target_diseases if vaccine.vaccine else vaccine.target_diseases or 'Not specified',
-            'current_stock': vaccine.current_stock,
-            'minimum_stock': vaccine.min_stock_level,
-            'status': vaccine.status,
-            'expiration_date': vaccine.expiration_date.isoformat() if vaccine.expiration_date else None,
-            'storage_temperature': vaccine.storage_temperature or 'Not specified',
-            'description': vaccine.vaccine.description if vaccine.vaccine else vaccine.description or 'No description available',
-            'administered_count': vaccine.vaccine.get_administered_count() if vaccine.vaccine else 0,
-            'doses_per_vial': vaccine.doses_per_vial,
-        }
+        vaccine = inventory_details().get(id=vaccine_id)
         
-        return JsonResponse(data)
+        validator = f"{vaccine.pk}:{vaccine.updated_at.isoformat()}:{vaccine.administered_count}"
+        if vaccine.vaccine:
+            validator += f":{vaccine.vaccine.updated_at.isoformat()}"
+        etag = '"%s"' % hashlib.md5(validator.encode()).hexdigest()
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = JsonResponse(inventory_detail_data(vaccine))
+        response['ETag'] = etag
+        # Let the browser keep the body but revalidate it on every poll
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
         
     except VaccineInventory.DoesNotExist:
         return JsonResponse({'error': 'Vaccine not found'}, status=404)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
+
+# Most lots returned by one call of the batch detail API
+MAX_BATCH_DETAILS = 500
+
+@require_http_methods(["GET"])
+@login_required(login_url='/login/')
+def vaccine_batch_detail_api(request):
+    """API endpoint returning the details of many lots in one response
+    
+    Lots are chosen by ``ids`` (comma separated) or by the inventory table
+    filters (``filter``, ``q``), and ``fields`` (comma separated) limits each
+    item to the columns the client renders. Always a single query.
+    """
+    fields = [name for name in request.GET.get('fields', '').split(',') if name] or list(INVENTORY_DETAIL_FIELDS)
+    unknown = [name for name in fields if name not in INVENTORY_DETAIL_FIELDS]
+    if unknown:
+        return JsonResponse({'error': f"Unknown fields: {', '.join(unknown)}"}, status=400)
+    
+    items = inventory_details(with_administered_count='administered_count' in fields)
+    ids = None
+    if request.GET.get('ids'):
+        try:
+            ids = list(dict.fromkeys(int(value) for value in request.GET['ids'].split(',') if value.strip()))
+        except ValueError:
+            return JsonResponse({'error': 'Invalid ids'}, status=400)
+        if len(ids) > MAX_BATCH_DETAILS:
+            return JsonResponse({'error': f'At most {MAX_BATCH_DETAILS} ids per request'}, status=400)
+        items = items.filter(pk__in=ids)
+    elif 'filter' in request.GET or 'q' in request.GET:
+        items = filter_inventory(items, request.GET)
+    else:
+        return JsonResponse({'error': 'Pass ids or a filter'}, status=400)
+    
+    # One extra row tells whether a filtered result was cut off
+    found = list(items.order_by('pk')[:MAX_BATCH_DETAILS + 1])
+    data = {
+        'items': [inventory_detail_data(item, fields) for item in found[:MAX_BATCH_DETAILS]],
+        'truncated': len(found) > MAX_BATCH_DETAILS,
+    }
+    if ids is not None:
+        returned = {item.pk for item in found}
+        data['missing'] = [pk for pk in ids if pk not in returned]
+    return JsonResponse(data)
+    
+# Sortable columns of the inventory table API
+INVENTORY_SORT_FIELDS = {
+    'name': 'display_name',
+    'type': 'vaccine_type',
+    'stock': 'current_stock',
+    'expiry': 'expiration_date',
+    'status': 'status',
+    'updated': 'updated_at',
+}
+
+def filter_inventory(items, params, today=None):
+    """Apply the inventory table filters (``filter`` and ``q``) to a lot queryset"""
+    today = today or timezone.now().date()
+    filter_name = params.get('filter', 'all')
+    if filter_name == 'low_stock':
+        items = items.filter(status__in=['low_stock', 'critical'])
+    elif filter_name == 'expiring_soon':
+        items = items.expiring_within(30, today)
+    elif filter_name == 'expired':
+        items = items.expired(today)
+    search = params.get('q', '').strip()
+    if search:
+        items = items.filter(
+            Q(vaccine__name__icontains=search) | Q(vaccine_name__icontains=search) |
+            Q(lot_number__icontains=search) | Q(target_diseases__icontains=search)
+        )
+    return items
+
+@require_http_methods(["GET"])
+@login_required(login_url='/login/')
+def inventory_table_api(request):
+    """API endpoint serving one page of the inventory table as JSON or an HTML fragment"""
+    today = timezone.now().date()
+    items = VaccineInventory.objects.select_related('vaccine').annotate(
+        display_name=Coalesce('vaccine__name', 'vaccine_name')
+    )
+    items = filter_inventory(items, request.GET, today)
     
+    # Sorting, with the primary key as a tie-breaker so pages are stable
+    sort = request.GET.get('sort', 'name')
+    field = INVENTORY_SORT_FIELDS.get(sort.lstrip('-'), 'display_name')
+    prefix = '-' if sort.startswith('-') else ''
+    items = items.order_by(f'{prefix}{field}', f'{prefix}pk')
+    
+    try:
+        page_size = min(max(int(request.GET.get('page_size', 25)), 1), 100)
+    except ValueError:
+        page_size = 25
+    page = Paginator(items, page_size).get_page(request.GET.get('page'))
+    
+    # Administered counts come from the rollup counters in one query
+    counter_names = {item.vaccine_id: f'records:administered:vaccine:{item.vaccine_id}' for item in page}
+    counters = counter_values(*counter_names.values())
+    for item in page:
+        item.administered_count = counters[counter_names[item.vaccine_id]] if item.vaccine_id else 0
+    
+    data = {
+        'page': page.number,
+        'num_pages': page.paginator.num_pages,
+        'total': page.paginator.count,
+        'has_next': page.has_next(),
+        'has_previous': page.has_previous(),
+    }
+    if request.GET.get('format') == 'html':
+        template = 'inventory_cards.html' if request.GET.get('view') == 'cards' else 'inventory_table_rows.html'
+        data['html'] = render_to_string(template, {'items': page}, request=request)
+    else:
+        data['items'] = [{
+            'id': item.id,
+            'name': item.display_name,
+            'vaccine_type': item.vaccine.vaccine_type if item.vaccine else item.vaccine_type,
+            'target_diseases': item.vaccine.target_diseases if item.vaccine else item.target_diseases,
+            'lot_number': item.lot_number,
+            'current_stock': item.current_stock,
+            'min_stock_level': item.min_stock_level,
+            'stock_percentage': item.get_stock_percentage(),
+            'status': item.status,
+            'status_display': item.get_status_display(),
+            'expiration_date': item.expiration_date.isoformat() if item.expiration_date else None,
+            'is_expiring_soon': item.is_expiring_soon(),
+            'administered_count': item.administered_count,
+        } for item in page]
+    
+    return JsonResponse(data)
+
+@require_http_methods(["GET"])
+@login_required(login_url='/login/')
+def inventory_expiry_api(request):
+    """API endpoint returning lot and dose counts per expiry window"""
+    today = timezone.now().date()
+    row = VaccineInventory.objects.expiry_windows(today)
+    windows = {'expired': {'lots': row['expired_lots'], 'doses': row['expired_doses']}}
+    for days in EXPIRY_WINDOWS:
+        windows[f'{days}_days'] = {
+            'lots': row[f'within_{days}_days_lots'],
+            'doses': row[f'within_{days}_days_doses'],
+        }
+    return JsonResponse({'today': today.isoformat(), 'windows': windows})
+
+@require_http_methods(["GET"])
+@login_required(login_url='/login/')
+def stock_at_api(request):
+    """API endpoint returning per-lot stock at the end of a past date, from the stock ledger"""
+    try:
+        day = date.fromisoformat(request.GET.get('date', ''))
+    except ValueError:
+        return JsonResponse({'error': 'A date in YYYY-MM-DD format is required'}, status=400)
+    
+    lots = None
+    if request.GET.get('vaccine'):
+        try:
+            lots = VaccineInventory.objects.filter(vaccine_id=int(request.GET['vaccine']))
+        except ValueError:
+            return JsonResponse({'error': 'Invalid vaccine id'}, status=400)
+    
+    moment = min(end_of_day(day), timezone.now())
+    stock = stock_at(moment, lots)
+    return JsonResponse({
+        'as_of': moment.isoformat(),
+        'total_doses': sum(stock.values()),
+        'lots': [{'id': inventory_id, 'stock': value} for inventory_id, value in sorted(stock.items())],
+    })
+
+@require_http_methods(["GET"])
+@login_required(login_url='/login/')
+def forecast_api(request):
+    """API endpoint returning projected stock-outs and reorder suggestions per vaccine"""
+    forecasts = get_cached_forecast()
+    if request.GET.get('vaccine'):
+        try:
+            vaccine_id = int(request.GET['vaccine'])
+        except ValueError:
+            return JsonResponse({'error': 'Invalid vaccine id'}, status=400)
+        forecasts = [forecast for forecast in forecasts if forecast.vaccine_id == vaccine_id]
+    if request.GET.get('reorder') == '1':
+        forecasts = [forecast for forecast in forecasts if forecast.needs_reorder]
+    
+    return JsonResponse({
+        'today': timezone.now().date().isoformat(),
+        'forecasts': [forecast.as_dict() for forecast in forecasts],
+    })
+
 @require_http_methods(["DELETE"])
 @csrf_exempt
 @login_required(login_url='/login/')
@@ -554,27 +828,216 @@ def update_vaccine_api(request, vaccine_id):
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+MAX_BATCH_ADJUSTMENTS = 10000
+
+def parse_inventory_adjustment(item):
+    """Validate one batch adjustment, returning ``(inventory_id, {field: value})``"""
+    if not isinstance(item, dict):
+        raise ValidationError("Each change must be an object.")
+    try:
+        inventory_id = int(item['id'])
+    except (KeyError, TypeError, ValueError):
+        raise ValidationError("A numeric id is required.")
+    
+    allowed = {'id', 'delta', *VaccineInventoryQuerySet.BULK_ADJUSTABLE_FIELDS}
+    unknown = sorted(set(item) - allowed)
+    if unknown:
+        raise ValidationError(f"Unknown fields: {', '.join(unknown)}.")
+    if 'delta' in item and 'current_stock' in item:
+        raise ValidationError("Give either delta or current_stock, not both.")
+    
+    change = {}
+    if 'delta' in item:
+        if isinstance(item['delta'], bool) or not isinstance(item['delta'], int):
+            raise ValidationError("delta must be an integer.")
+        change['delta'] = item['delta']
+    for name in VaccineInventoryQuerySet.BULK_ADJUSTABLE_FIELDS:
+        if name in item:
+            try:
+                change[name] = VaccineInventory._meta.get_field(name).clean(item[name], None)
+            except ValidationError as e:
+                raise ValidationError(f"{name}: {' '.join(e.messages)}")
+    if not change:
+        raise ValidationError("Nothing to change.")
+    return inventory_id, change
+
+@require_http_methods(["POST"])
+@csrf_exempt
+@login_required(login_url='/login/')
+def bulk_adjust_inventory_api(request):
+    """API endpoint to adjust the stock and details of many lots at once
+    
+    Takes ``{"changes": [{"id": 1, "delta": -3}, {"id": 2, "current_stock": 40,
+    "min_stock_level": 10}, ...]}``. Valid changes are applied together; each
+    change gets its own result so partial failures can be reported.
+    """
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    items = data.get('changes') if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        return JsonResponse({'error': 'Expected a list of changes'}, status=400)
+    if len(items) > MAX_BATCH_ADJUSTMENTS:
+        return JsonResponse({'error': f'At most {MAX_BATCH_ADJUSTMENTS} changes per request'}, status=400)
+    
+    results = [None] * len(items)
+    changes, positions = {}, {}
+    for index, item in enumerate(items):
+        try:
+            inventory_id, change = parse_inventory_adjustment(item)
+        except ValidationError as e:
+            results[index] = {'index': index, 'success': False, 'error': ' '.join(e.messages)}
+            continue
+        if inventory_id in changes:
+            results[index] = {'index': index, 'id': inventory_id, 'success': False, 'error': 'Duplicate id in this batch.'}
+            continue
+        changes[inventory_id] = change
+        positions[inventory_id] = index
+    
+    try:
+        outcomes = VaccineInventory.objects.bulk_adjust(changes) if changes else {}
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+    
+    for inventory_id, outcome in outcomes.items():
+        index = positions[inventory_id]
+        if isinstance(outcome, StockChange):
+            results[index] = {
+                'index': index,
+                'id': inventory_id,
+                'success': True,
+                'current_stock': outcome.new_stock,
+                'status': outcome.new_status,
+            }
+        else:
+            results[index] = {'index': index, 'id': inventory_id, 'success': False, 'error': outcome}
+    
+    updated = sum(1 for result in results if result['success'])
+    return JsonResponse({
+        'success': updated == len(results),
+        'updated': updated,
+        'failed': len(results) - updated,
+        'results': results,
+    })
+
+@require_http_methods(["POST"])
+@csrf_exempt
+@login_required(login_url='/login/')
+def bulk_import_inventory_api(request):
+    """API endpoint to import many inventory lots from a CSV or JSON lines upload
+    
+    Send the file as the multipart field ``file``, or as the raw request body
+    with ``?format=csv|jsonl``. Add ``?dry_run=1`` to only validate the rows.
+    """
+    upload = request.FILES.get('file')
+    fmt = request.GET.get('format') or guess_format(upload.name if upload else None)
+    if fmt not in FORMATS:
+        return JsonResponse({'error': f"Unsupported format, expected one of {', '.join(FORMATS)}"}, status=400)
+    
+    # Decode line by line so large manifests are never held in memory at once
+    source = upload if upload else request
+    lines = codecs.iterdecode(source, 'utf-8-sig')
+    try:
+        result = import_lots(lines, fmt, dry_run=request.GET.get('dry_run') == '1')
+    except UnicodeDecodeError:
+        return JsonResponse({'error': 'The file must be UTF-8 encoded'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+    
+    return JsonResponse({
+        'success': True,
+        'created': result.created,
+        'vaccines_created': result.vaccines_created,
+        'failed': result.failed,
+        'errors': [{'line': line, 'errors': errors} for line, errors in result.errors],
+    })
+
 # =============================================
 # PATIENT MANAGEMENT
 # =============================================
 
+# Directory sort keys: the columns annotated by Patient.objects.with_vaccination_status()
+PATIENT_DIRECTORY_SORTS = {
+    'name': ['last_name', 'first_name'],
+    'doses': ['dose_count'],
+    'last_vaccination': ['last_vaccination'],
+    'completion': ['series_completion'],
+    'next_due': ['next_due_date'],
+    'created': ['created_at'],
+}
+
+def patient_directory(request):
+    """One page of the current user's patients with their vaccination status
+
+    Returns ``(page, sort, vaccinated)``. The page is read with one annotated
+    query and counted with one aggregate that also counts vaccinated
+    patients, whatever the number of patients or records.
+    """
+    sort = request.GET.get('sort', 'name')
+    if sort.lstrip('-') not in PATIENT_DIRECTORY_SORTS:
+        sort = 'name'
+    descending = sort.startswith('-')
+    # Patients without a value sort last either way; the pk breaks ties so pages are stable
+    ordering = [
+        F(field).desc(nulls_last=True) if descending else F(field).asc(nulls_last=True)
+        for field in PATIENT_DIRECTORY_SORTS[sort.lstrip('-')]
+    ]
+    ordering.append('-pk' if descending else 'pk')
+
+    patients = Patient.objects.filter(user=request.user)
+    stats = patients.order_by().aggregate(
+        total=Count('pk'),
+        vaccinated=Count('pk', filter=Q(Exists(
+            VaccinationRecord.objects.filter(patient=OuterRef('pk'), status='administered')
+        ))),
+    )
+    page_size = parse_page_size(request.GET.get('page_size'), default=25, maximum=100)
+    paginator = CountedPaginator(patients.with_vaccination_status().order_by(*ordering), page_size, stats['total'])
+    return paginator.get_page(request.GET.get('page')), sort, stats['vaccinated']
+
 @login_required(login_url='/login/')
 @no_cache_after_logout
 def patient_list(request):
-    """List all patients for the current user"""
-    patients = Patient.objects.filter(user=request.user).select_related('user')
-    
-    # Calculate statistics
-    total_patients = patients.count()
-    patients_with_complete_vaccinations = sum(1 for patient in patients if patient.vaccination_records.filter(status='administered').exists())
-    
+    """List the current user's patients, paginated, with their vaccination status"""
+    page, sort, vaccinated = patient_directory(request)
     context = {
-        'patients': patients,
-        'total_patients': total_patients,
-        'patients_with_complete_vaccinations': patients_with_complete_vaccinations,
+        'patients': page,
+        'page_obj': page,
+        'sort': sort,
+        'total_patients': page.paginator.count,
+        'patients_with_complete_vaccinations': vaccinated,
     }
     return render(request, 'patient_list.html', context)
 
+@require_http_methods(["GET"])
+@login_required(login_url='/login/')
+def patient_directory_api(request):
+    """API endpoint serving one page of the patient directory"""
+    page, sort, vaccinated = patient_directory(request)
+    return JsonResponse({
+        'page': page.number,
+        'num_pages': page.paginator.num_pages,
+        'total': page.paginator.count,
+        'vaccinated': vaccinated,
+        'sort': sort,
+        'has_next': page.has_next(),
+        'has_previous': page.has_previous(),
+        'items': [{
+            'id': patient.id,
+            'first_name': patient.first_name,
+            'last_name': patient.last_name,
+            'date_of_birth': patient.date_of_birth.isoformat(),
+            'gender': patient.gender,
+            'dose_count': patient.dose_count,
+            'last_vaccination': patient.last_vaccination.isoformat() if patient.last_vaccination else None,
+            'started_series': patient.started_series,
+            'completed_series': patient.completed_series,
+            'series_completion': round(patient.series_completion, 1) if patient.series_completion is not None else None,
+            'next_due_date': patient.next_due_date.isoformat() if patient.next_due_date else None,
+        } for patient in page],
+    })
+
 @login_required(login_url='/login/')
 @no_cache_after_logout
 def vaccination_schedule(request):
@@ -624,40 +1087,266 @@ def immunization_records(request):
 @no_cache_after_logout
 def coverage_analytics(request):
     """Vaccine coverage analytics"""
-    # Get vaccination statistics
-    total_vaccinations = VaccinationRecord.objects.filter(
-        patient__user=request.user,
-        status='administered'
-    ).count()
-    
-    # Get vaccine coverage by type
-    vaccine_coverage = {}
-    for vaccine in Vaccine.objects.filter(is_active=True):
-        administered_count = VaccinationRecord.objects.filter(
-            patient__user=request.user,
-            vaccine=vaccine,
-            status='administered'
-        ).count()
-        total_patients = Patient.objects.filter(user=request.user).count()
-        
-        if total_patients > 0:
-            coverage_percentage = (administered_count / total_patients) * 100
-        else:
-            coverage_percentage = 0
-            
-        vaccine_coverage[vaccine.name] = {
-            'administered_count': administered_count,
-            'coverage_percentage': coverage_percentage,
-            'vaccine': vaccine
-        }
-    
+    report = get_coverage(request.user)
     context = {
-        'total_vaccinations': total_vaccinations,
-        'vaccine_coverage': vaccine_coverage,
-        'total_patients': Patient.objects.filter(user=request.user).count(),
+        'total_vaccinations': report.total_doses,
+        'vaccine_coverage': {
+            item.name: {
+                'vaccine_id': item.vaccine_id,
+                'administered_count': item.doses,
+                'patients': item.patients,
+                'completed_patients': item.completed_patients,
+                'coverage_percentage': item.coverage_percentage,
+                'completion_percentage': item.completion_percentage,
+            }
+            for item in report.vaccines
+        },
+        'total_patients': report.total_patients,
     }
     return render(request, 'coverage_analytics.html', context)
 
+@require_http_methods(["GET"])
+@login_required(login_url='/login/')
+def coverage_api(request):
+    """API endpoint with the current user's coverage per vaccine"""
+    return JsonResponse(get_coverage(request.user).as_dict())
+
+COVERAGE_MATRIX_MAX_RESULTS = 500
+
+@require_http_methods(["GET"])
+@login_required(login_url='/login/')
+def coverage_matrix_api(request):
+    """API endpoint evaluating a set expression over the current user's patients
+    
+    ``expr`` combines vaccine doses with & (and), | (or), - (and not), ~ (not)
+    and parentheses, e.g. ``MMR:1 - MMR:2`` or ``~MMR & ~DTaP``. The response
+    has the number of matching patients and the first ``limit`` of them.
+    """
+    expression = request.GET.get('expr', '').strip()
+    limit = parse_page_size(request.GET.get('limit'), default=100, maximum=COVERAGE_MATRIX_MAX_RESULTS)
+    
+    matrix = get_matrix()
+    started = time.perf_counter()
+    try:
+        result = matrix.evaluate(expression, owner_id=request.user.pk)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    elapsed = time.perf_counter() - started
+    
+    ids = matrix.patients(result, limit=limit)
+    patients = Patient.objects.in_bulk(ids)
+    return JsonResponse({
+        'expression': expression,
+        'count': matrix.count(result),
+        'patients': [{
+            'id': pk,
+            'name': f"{patients[pk].first_name} {patients[pk].last_name}",
+        } for pk in ids if pk in patients],
+        'evaluated_in_us': round(elapsed * 1e6, 1),
+    })
+
+# =============================================
+# SEARCH API
+# =============================================
+
+SEARCH_MAX_RESULTS = 100
+
+@require_http_methods(["GET"])
+@login_required(login_url='/login/')
+def search_api(request):
+    """API endpoint for ranked full-text search over vaccines, lots, patients and records
+    
+    ``q`` is matched word by word as prefixes, ``kind`` (comma separated)
+    limits the result types. Matches are wrapped in <mark> in the escaped
+    ``title`` and ``snippet``. Only the current user's patients and records
+    are returned.
+    """
+    query = request.GET.get('q', '').strip()
+    kinds = [kind for kind in request.GET.get('kind', '').split(',') if kind] or list(SEARCH_KINDS)
+    unknown = [kind for kind in kinds if kind not in SEARCH_KINDS]
+    if unknown:
+        return JsonResponse({'error': f"Unknown kinds: {', '.join(unknown)}"}, status=400)
+    limit = parse_page_size(request.GET.get('limit'), default=20, maximum=SEARCH_MAX_RESULTS)
+    
+    hits = full_text_search(query, kinds=kinds, owner_id=request.user.pk, limit=limit)
+    return JsonResponse({
+        'query': query,
+        'results': [{
+            'kind': hit.kind,
+            'id': hit.object_id,
+            'title': render_highlight(hit.title),
+            'snippet': render_highlight(hit.snippet),
+            'score': round(hit.score, 4),
+        } for hit in hits],
+    })
+
+# =============================================
+# LIST API ENDPOINTS (KEYSET PAGINATION)
+# =============================================
+# Each list API takes ``sort`` (a key below, ``-`` for descending),
+# ``page_size``, ``cursor`` (the ``next_cursor`` of the previous page) and
+# the filters below. Every sort column is indexed, so a deep page costs the
+# same as the first one.
+
+def parse_list_filters(params, spec):
+    """Turn query parameters into filter kwargs using ``{param: (lookup, parse)}``
+
+    Raises ValueError naming the parameter that could not be parsed.
+    """
+    filters = {}
+    for param, (lookup, parse) in spec.items():
+        value = params.get(param, '').strip()
+        if not value:
+            continue
+        try:
+            filters[lookup] = parse(value)
+        except ValueError:
+            raise ValueError(f"Invalid value for {param}: {value!r}")
+    return filters
+
+def parse_flag(value):
+    if value not in ('0', '1', 'true', 'false'):
+        raise ValueError(value)
+    return value in ('1', 'true')
+
+def keyset_list_response(request, items, sorts, default_sort, serialize):
+    """JsonResponse with one keyset page of ``items`` sorted as ``request.GET['sort']``"""
+    sort = request.GET.get('sort', default_sort)
+    column = sorts.get(sort.lstrip('-'))
+    if column is None:
+        return JsonResponse({'error': f"Unknown sort, expected one of {', '.join(sorts)}"}, status=400)
+    try:
+        page = keyset_page(
+            items, sort, [(column, sort.startswith('-'))],
+            cursor=request.GET.get('cursor'),
+            page_size=parse_page_size(request.GET.get('page_size')),
+        )
+    except InvalidCursor as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({
+        'items': [serialize(item) for item in page.items],
+        'next_cursor': page.next_cursor,
+        'has_more': page.has_more,
+    })
+
+INVENTORY_LIST_SORTS = {'expiry': 'expiration_date', 'updated': 'updated_at', 'id': 'pk'}
+INVENTORY_LIST_FILTERS = {
+    'status': ('status', str),
+    'vaccine': ('vaccine_id', int),
+    'usable': ('is_usable', parse_flag),
+}
+
+@require_http_methods(["GET"])
+@login_required(login_url='/login/')
+def inventory_list_api(request):
+    """API endpoint listing inventory lots, keyset paginated"""
+    try:
+        filters = parse_list_filters(request.GET, INVENTORY_LIST_FILTERS)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    items = filter_inventory(VaccineInventory.objects.select_related('vaccine').filter(**filters), request.GET)
+    return keyset_list_response(request, items, INVENTORY_LIST_SORTS, 'expiry', lambda item: {
+        'id': item.id,
+        'name': item.get_display_name(),
+        'vaccine_id': item.vaccine_id,
+        'lot_number': item.lot_number,
+        'current_stock': item.current_stock,
+        'min_stock_level': item.min_stock_level,
+        'status': item.status,
+        'is_usable': item.is_usable,
+        'expiration_date': item.expiration_date.isoformat(),
+        'updated_at': item.updated_at.isoformat(),
+    })
+
+PATIENT_LIST_SORTS = {'created': 'created_at', 'name': 'last_name', 'birth': 'date_of_birth'}
+PATIENT_LIST_FILTERS = {
+    'gender': ('gender', str),
+    'q': ('last_name__istartswith', str),
+    'born_from': ('date_of_birth__gte', date.fromisoformat),
+    'born_to': ('date_of_birth__lte', date.fromisoformat),
+}
+
+@require_http_methods(["GET"])
+@login_required(login_url='/login/')
+def patient_list_api(request):
+    """API endpoint listing the current user's patients, keyset paginated"""
+    try:
+        filters = parse_list_filters(request.GET, PATIENT_LIST_FILTERS)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    patients = Patient.objects.filter(user=request.user, **filters)
+    return keyset_list_response(request, patients, PATIENT_LIST_SORTS, '-created', lambda patient: {
+        'id': patient.id,
+        'first_name': patient.first_name,
+        'last_name': patient.last_name,
+        'date_of_birth': patient.date_of_birth.isoformat(),
+        'age': patient.age(),
+        'gender': patient.gender,
+        'created_at': patient.created_at.isoformat(),
+    })
+
+RECORD_LIST_SORTS = {'date': 'date_administered', 'created': 'created_at'}
+RECORD_LIST_FILTERS = {
+    'status': ('status', str),
+    'vaccine': ('vaccine_id', int),
+    'patient': ('patient_id', int),
+    'date_from': ('date_administered__gte', date.fromisoformat),
+    'date_to': ('date_administered__lte', date.fromisoformat),
+}
+
+@require_http_methods(["GET"])
+@login_required(login_url='/login/')
+def vaccination_record_list_api(request):
+    """API endpoint listing the vaccination records of the current user's patients, keyset paginated"""
+    try:
+        filters = parse_list_filters(request.GET, RECORD_LIST_FILTERS)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    records = VaccinationRecord.objects.filter(patient__user=request.user, **filters).select_related('patient', 'vaccine')
+    return keyset_list_response(request, records, RECORD_LIST_SORTS, '-date', lambda record: {
+        'id': record.id,
+        'patient_id': record.patient_id,
+        'patient_name': record.patient.full_name(),
+        'vaccine_id': record.vaccine_id,
+        'vaccine_name': record.vaccine.name,
+        'dose_number': record.dose_number,
+        'date_administered': record.date_administered.isoformat(),
+        'next_due_date': record.next_due_date.isoformat() if record.next_due_date else None,
+        'status': record.status,
+        'reaction': record.reaction,
+    })
+
+APPOINTMENT_LIST_SORTS = {'date': 'scheduled_date', 'created': 'created_at'}
+APPOINTMENT_LIST_FILTERS = {
+    'status': ('status', str),
+    'type': ('appointment_type', str),
+    'patient': ('patient_id', int),
+    'vaccine': ('vaccine_id', int),
+    'date_from': ('scheduled_date__date__gte', date.fromisoformat),
+    'date_to': ('scheduled_date__date__lte', date.fromisoformat),
+}
+
+@require_http_methods(["GET"])
+@login_required(login_url='/login/')
+def appointment_list_api(request):
+    """API endpoint listing the appointments of the current user's patients, keyset paginated"""
+    try:
+        filters = parse_list_filters(request.GET, APPOINTMENT_LIST_FILTERS)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    appointments = Appointment.objects.filter(patient__user=request.user, **filters).select_related('patient', 'vaccine')
+    return keyset_list_response(request, appointments, APPOINTMENT_LIST_SORTS, 'date', lambda appointment: {
+        'id': appointment.id,
+        'patient_id': appointment.patient_id,
+        'patient_name': appointment.patient.full_name(),
+        'appointment_type': appointment.appointment_type,
+        'scheduled_date': appointment.scheduled_date.isoformat(),
+        'duration': appointment.duration,
+        'status': appointment.status,
+        'vaccine_id': appointment.vaccine_id,
+        'vaccine_name': appointment.vaccine.name if appointment.vaccine else None,
+    })
+
 # =============================================
 # AUTHENTICATION PAGES - NO LOGIN REQUIRED
 # =============================================
@@ -176,10 +176,33 @@ EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'  # For developm
 # Message storage
 MESSAGE_STORAGE = 'django.contrib.messages.storage.session.SessionStorage'
 
-# Cache settings (simple memory cache for development)
+# Cache settings (simple memory cache for development). LocMemCache is private
+# to each server process, so cached dashboard statistics and their single-flight
+# locks are not shared between workers; use memcached, redis or the database
+# cache in production.
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         'LOCATION': 'unique-snowflake',
     }
-}
\ No newline at end of file
+}
+
+# Stale-while-revalidate cache for the dashboard statistics (seconds)
+DASHBOARD_CACHE = {
+    'FRESH_SECONDS': 30,      # served without recomputation
+    'STALE_SECONDS': 300,     # hard deadline; stale values are refreshed in the background
+    'LOCK_SECONDS': 30,       # single-flight lock held while recomputing
+}
+
+# Consumption forecast and reorder suggestions (vaccineapp.forecasting)
+FORECAST = {
+    'HORIZON_DAYS': 180,      # days of demand projected ahead
+    'LEAD_TIME_DAYS': 14,     # days between placing and receiving an order
+    'REVIEW_DAYS': 30,        # days of demand covered by each order
+}
+
+# Columnar snapshot of the vaccination records for ad-hoc reporting (vaccineapp.analytics)
+ANALYTICS = {
+    'DIRECTORY': os.path.join(BASE_DIR, 'analytics_snapshots'),
+    'KEEP': 2,                # snapshots kept on disk, the current one included
+}